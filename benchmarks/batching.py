@@ -0,0 +1,114 @@
+"""Delivery throughput of JoinChat against JoinChatBatched in a busy room.
+
+Joins N listeners into one room of an in-process server, publishes a burst of
+messages and waits until every listener has received all of them, once with
+one ChatMessage per stream message and once with MessageBatch frames. Listeners
+read raw bytes and count the publisher's messages without decoding them.
+
+No syscall tracer is assumed: /proc/<pid>/io does not count socket sends, so
+the TCP segments sent on loopback (from /proc/net/snmp, so run it on an
+otherwise idle host) stand in for send syscalls, alongside the process CPU
+time per delivered message.
+
+    python benchmarks/batching.py --listeners 50 --messages 2000
+"""
+import argparse
+import asyncio
+import time
+
+from common import InProcessServer, join_message
+
+import grpc
+import chat_pb2
+
+SENDER_TAG = b"\n\x06sender"  # user_id field of the publisher's messages
+
+
+def tcp_out_segments():
+    """Host-wide count of TCP segments sent"""
+    with open('/proc/net/snmp') as f:
+        lines = [line.split() for line in f if line.startswith('Tcp:')]
+    header, values = lines
+    return int(values[header.index('OutSegs')])
+
+
+async def listen(call, expected, done):
+    """Count the publisher's messages until all of them arrived; also count stream messages"""
+    received = 0
+    frames = 0
+    while received < expected:
+        frame = await call.read()
+        if frame is grpc.aio.EOF:
+            break
+        frames += 1
+        received += frame.count(SENDER_TAG)
+    done.append((received, frames))
+
+
+async def measure(target, method, listeners, count, body_size):
+    room_id = f"{method}-{listeners}"
+    channels = [grpc.aio.insecure_channel(target) for _ in range(8)]
+    join_chat = [
+        chan.stream_stream(
+            f'/chat.ChatService/{method}',
+            request_serializer=chat_pb2.ChatMessage.SerializeToString,
+            response_deserializer=None
+        )
+        for chan in channels
+    ]
+
+    calls = []
+    for i in range(listeners):
+        call = join_chat[i % len(join_chat)]()
+        await call.write(join_message(f"listener-{i}", room_id, chat_pb2.HistoryMode.NONE))
+        calls.append(call)
+    sender = join_chat[0]()
+    await sender.write(join_message("sender", room_id, chat_pb2.HistoryMode.NONE))
+    await asyncio.sleep(0.5)  # let joins and their announcements drain
+
+    done = []
+    readers = [asyncio.create_task(listen(call, count, done)) for call in calls]
+    body = "x" * body_size
+
+    segments_start = tcp_out_segments()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(count):
+        await sender.write(chat_pb2.ChatMessage(user_id="sender", username="sender", message=body))
+    await asyncio.gather(*readers)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    segments = tcp_out_segments() - segments_start
+
+    for call in calls + [sender]:
+        call.cancel()
+    for chan in channels:
+        await chan.close()
+    delivered = sum(received for received, _ in done)
+    frames = sum(frames for _, frames in done)
+    return delivered, frames, segments, cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'))
+    parser.add_argument('--listeners', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--body-size', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--batch-delay-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'method':>15} {'delivered':>10} {'msgs/sec':>10} {'frames/msg':>11} "
+          f"{'segs/msg':>9} {'cpu us/msg':>11}")
+    for method in ('JoinChat', 'JoinChatBatched'):
+        with InProcessServer(args.engine, max_workers=args.listeners + 8, queue_size=0,
+                             batch_size=args.batch_size, batch_delay=args.batch_delay_ms / 1000) as server:
+            delivered, frames, segments, cpu, wall = server.run(
+                measure(server.target, method, args.listeners, args.messages, args.body_size))
+        print(f"{method:>15} {delivered:>10} {delivered / wall:>10.0f} {frames / delivered:>11.3f} "
+              f"{segments / delivered:>9.3f} {cpu / delivered * 1e6:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Sessions per client process with chat_lib: memory per session and delivery rate.
+
+The server (asyncio engine) runs in a child process. Each run opens N sessions
+through one ChatPool in a fresh child process, in rooms of --room-size, each
+with an on_message callback. Every room holds a message beforehand, and a
+session counts as ready once the last one has been replayed to it; memory is
+the RSS growth per session. Then one member of every room posts --messages
+messages, and the time until every session has them all gives deliveries/sec.
+A channel count equal to the session count is the ChatClient way (a channel,
+so a TCP connection, per user) for comparison.
+
+    python benchmarks/client_sessions.py --sessions 1000 5000 10000
+"""
+import argparse
+import asyncio
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+from common import ROOT
+
+import grpc
+
+from loadgen import free_port, memory_kb, run_server
+
+sys.path.append(os.path.join(ROOT, 'client'))
+from chat_lib import ChatPool  # noqa: E402
+
+import chat_pb2  # noqa: E402
+
+
+async def wait_until(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+async def run(target, sessions, channels, room_size, messages):
+    received = [0] * sessions
+    texts = [0] * sessions
+
+    def on_message(i):
+        def count(message):
+            received[i] += 1
+            if message.type == chat_pb2.TEXT:
+                texts[i] += 1
+        return count
+
+    pool = ChatPool(target, channels=channels)
+    rooms = [f"room-{i}" for i in range(0, sessions, room_size)]
+    seeded = set()
+
+    def on_seed(message):
+        if message.type == chat_pb2.TEXT:
+            seeded.add(message.room_id)
+
+    seeder = await pool.open_session("seeder", "seeder", rooms=rooms, on_message=on_seed,
+                                     history=chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE))
+    for room_id in rooms:
+        seeder.send("seed", room_id)
+    await wait_until(lambda: len(seeded) == len(rooms), 60)
+    await seeder.close()
+
+    gc.collect()
+    rss_before, _ = memory_kb()
+    start = time.perf_counter()
+    history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.LAST, limit=1)
+    opened = []
+    for i in range(sessions):
+        opened.append(await pool.open_session(f"user-{i}", f"user{i}", rooms=[rooms[i // room_size]],
+                                              history=history, on_message=on_message(i)))
+        if i % 500 == 499:
+            await asyncio.sleep(0)  # let the joins go out
+    ready = await wait_until(lambda: all(received), 120)
+    ready_seconds = time.perf_counter() - start
+    gc.collect()
+    rss_after, _ = memory_kb()
+
+    texts[:] = [0] * sessions  # the replayed message may have been the seed
+    start = time.perf_counter()
+    for i in range(0, sessions, room_size):
+        opened[i].send_many(f"message {n}" for n in range(messages))
+    delivered = await wait_until(lambda: min(texts) >= messages, 120)
+    elapsed = time.perf_counter() - start
+    await pool.close()
+    return ready and delivered, ready_seconds, (rss_after - rss_before) * 1024 / sessions, \
+        sessions * messages / elapsed
+
+
+def measure(*args):
+    """One run in a fresh process, so RSS growth is its own"""
+    return asyncio.run(run(*args))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1000, 5000, 10000])
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--room-size', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=20, help="messages posted per room")
+    parser.add_argument('--per-session-max', type=int, default=1000,
+                        help="largest count to also run with a channel per session")
+    args = parser.parse_args()
+
+    address = f"localhost:{free_port()}"
+    server = multiprocessing.get_context('spawn').Process(
+        target=run_server, args=('asyncio', address, 10), daemon=True)
+    server.start()
+    try:
+        with grpc.insecure_channel(address) as channel:
+            grpc.channel_ready_future(channel).result(timeout=15)
+        print(f"{'sessions':>8} {'channels':>9} {'ready s':>8} {'KB/session':>11} {'deliveries/s':>13}")
+        for sessions in args.sessions:
+            runs = [args.channels]
+            if sessions <= args.per_session_max:
+                runs.append(sessions)
+            for channels in runs:
+                with multiprocessing.get_context('spawn').Pool(1) as runner:
+                    ok, ready, per_session, rate = runner.apply(
+                        measure, (address, sessions, channels, args.room_size, args.messages))
+                note = "" if ok else "  (timed out)"
+                print(f"{sessions:>8} {channels:>9} {ready:>8.2f} {per_session / 1024:>11.1f} {rate:>13.0f}{note}")
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
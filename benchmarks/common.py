@@ -0,0 +1,110 @@
+"""Shared helpers for the benchmark scripts: import paths, in-process servers and small utilities"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+from collections import deque
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for sub in ('pbs', 'server', 'client'):
+    sys.path.append(os.path.join(ROOT, sub))
+
+import chat_pb2
+import chat_server
+
+# Per-message INFO lines would dominate every measurement
+logging.getLogger('chat_server').setLevel(logging.WARNING)
+logging.getLogger('chat.messages').setLevel(logging.WARNING)
+
+
+def join_message(user_id, room_id, history_mode=None):
+    """JOIN for user_id, who is also the username; history_mode is a chat_pb2.HistoryMode, None for the default"""
+    history = None if history_mode is None else chat_pb2.HistoryPreference(mode=history_mode)
+    return chat_pb2.ChatMessage(user_id=user_id, username=user_id, type=chat_pb2.MessageType.JOIN, room_id=room_id,
+                                history=history)
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SinkQueue:
+    """Stands in for a client's outbound queue; keeps only the latest few messages"""
+
+    def __init__(self):
+        self.put_nowait = deque(maxlen=64).append
+
+
+class InProcessServer:
+    """Run one of the chat server engines on a free localhost port inside this process.
+
+    The harness owns a single event loop thread. grpc.aio only tolerates one loop per
+    process, so the asyncio engine and any grpc.aio benchmark clients share it: submit
+    client coroutines with run().
+    """
+
+    def __init__(self, engine='threaded', max_workers=10, **options):
+        if engine not in chat_server.ENGINES:
+            raise ValueError(f"Unknown engine: {engine}")
+        self.engine = engine
+        self.max_workers = max_workers
+        self.options = options  # passed to the ChatServer constructor
+        self.chat_server = None
+        self.port = None
+        self._server = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    @property
+    def target(self):
+        return f"localhost:{self.port}"
+
+    def start(self):
+        self._thread.start()
+        if self.engine == 'threaded':
+            self.chat_server = chat_server.ChatServer(**self.options)
+            self._server, self.port = chat_server.create_threaded_server(
+                self.chat_server, 'localhost:0', self.max_workers)
+            self._server.start()
+            return self
+
+        from aio_chat_server import AioChatServer, create_aio_server
+
+        async def start():
+            self.chat_server = AioChatServer(**self.options)
+            self._server, self.port = await create_aio_server(self.chat_server, 'localhost:0')
+            await self._server.start()
+
+        self.run(start())
+        return self
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the shared event loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def call_soon(self, func, *args):
+        """Call func where the server state lives (the event loop for the asyncio engine)"""
+        if self.engine == 'threaded':
+            return func(*args)
+
+        async def call():
+            return func(*args)
+        return self.run(call())
+
+    def stop(self):
+        if self.engine == 'threaded':
+            self._server.stop(0).wait()
+        else:
+            self.run(self._server.stop(0))
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,226 @@
+"""Response compression: bytes on the wire against CPU, per compression setting.
+
+Each setting gets its own in-process server behind a TCP relay that counts the
+bytes the server sends (HTTP/2 framing included). Three workloads:
+
+  replay  clients join a room of 1000 recorded messages asking for all of them
+          (JoinChat and JoinChatBatched), and leave after the end-of-history line
+  pages   GetHistory pages of 500 messages
+  live    one poster, N JoinChat listeners; 1 message in 10 is a long paste (2-4 KB)
+
+"CPU us/msg" is the whole process (server, relay and clients) per message
+received, so compare it between settings rather than reading it absolutely.
+
+    python benchmarks/compression.py --listeners 20 --messages 1000
+"""
+import argparse
+import random
+import socket
+import threading
+import time
+
+from common import InProcessServer, join_message
+
+import chat_pb2
+import chat_pb2_grpc
+import grpc
+from history_store import MemoryHistoryStore
+
+SETTINGS = [
+    # label, --compression, --compression-min-bytes
+    ("none", 'none', 0),
+    ("gzip, all", 'gzip', 0),
+    ("gzip >= 1 KB", 'gzip', 1024),
+    ("deflate >= 1 KB", 'deflate', 1024),
+]
+WORDS = ("the a to and of meeting tomorrow deploy build failed passed review please thanks ok lunch "
+         "server client room message latency error retry timeout config release branch merge").split()
+
+
+def chat_text(rng):
+    if rng.random() < 0.1:
+        # A pasted log or stack trace
+        lines = [f"  File \"server/{rng.choice(WORDS)}.py\", line {rng.randint(1, 900)}, in {rng.choice(WORDS)}"
+                 for _ in range(rng.randint(25, 50))]
+        return "\n".join(lines)
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 20)))
+
+
+class CountingRelay:
+    """Forwards TCP connections to the server and counts the bytes sent back to clients"""
+
+    def __init__(self, server_port):
+        self.server_port = server_port
+        self.downstream = 0
+        self._lock = threading.Lock()
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            server = socket.create_connection(('localhost', self.server_port))
+            for sock in (client, server):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._pump, args=(client, server, False), daemon=True).start()
+            threading.Thread(target=self._pump, args=(server, client, True), daemon=True).start()
+
+    def _pump(self, source, sink, count):
+        try:
+            while True:
+                data = source.recv(65536)
+                if not data:
+                    break
+                if count:
+                    with self._lock:
+                        self.downstream += len(data)
+                sink.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (source, sink):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def take(self):
+        """Bytes sent to clients since the last call"""
+        time.sleep(0.1)  # let the relay drain
+        with self._lock:
+            count, self.downstream = self.downstream, 0
+        return count
+
+    def close(self):
+        self._listener.close()
+
+
+def replay(stub, batched, count):
+    """Join with the full history `count` times; returns messages received"""
+    received = 0
+    history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.LAST, limit=1000)
+    for i in range(count):
+        join = chat_pb2.ChatMessage(user_id=f"replay-{i}", username=f"replay{i}", room_id="history",
+                                    type=chat_pb2.MessageType.JOIN, history=history)
+        call = (stub.JoinChatBatched if batched else stub.JoinChat)(iter([join]))
+        done = False
+        for response in call:
+            for message in (response.messages if batched else (response,)):
+                received += 1
+                done = done or message.message == "--- End of history ---"
+            if done:
+                break
+        call.cancel()
+    return received
+
+
+def live(stub, listeners, messages, rng):
+    """Post `messages` to a room of JoinChat listeners; returns messages received"""
+    texts = [chat_text(rng) for _ in range(messages)]
+    counts = [0] * listeners
+    ready = threading.Barrier(listeners + 1)
+    calls = []
+
+    def listen(i):
+        join = chat_pb2.ChatMessage(user_id=f"listener-{i}", username=f"listener{i}", room_id="live",
+                                    type=chat_pb2.MessageType.JOIN,
+                                    history=chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE))
+        stop = threading.Event()
+        call = stub.JoinChat(_until(join, stop))
+        calls.append((call, stop))
+        ready.wait()
+        try:
+            for message in call:
+                if message.user_id == "poster":
+                    counts[i] += 1
+        except grpc.RpcError:
+            pass
+
+    threads = [threading.Thread(target=listen, args=(i,), daemon=True) for i in range(listeners)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    time.sleep(0.5)  # every listener has joined
+
+    poster = join_message("poster", "live", chat_pb2.HistoryMode.NONE)
+    outgoing = [poster] + [chat_pb2.ChatMessage(user_id="poster", username="poster", room_id="live",
+                                                message=text, type=chat_pb2.MessageType.TEXT) for text in texts]
+    post = stub.JoinChat(_paced(outgoing))
+    deadline = time.time() + 60
+    while sum(counts) < listeners * messages and time.time() < deadline:
+        time.sleep(0.05)
+    post.cancel()
+    for call, stop in calls:
+        stop.set()
+        call.cancel()
+    return sum(counts)
+
+
+def _until(first, stop):
+    yield first
+    stop.wait()
+
+
+def _paced(messages):
+    for i, message in enumerate(messages):
+        if i % 100 == 0:
+            time.sleep(0.01)  # stay under the listeners' queue bound
+        yield message
+
+
+def measure(args, compression, min_bytes):
+    rng = random.Random(3)
+    server = InProcessServer(args.engine, max_workers=args.listeners + 8, history_store=MemoryHistoryStore(),
+                             compression=compression, compression_min_bytes=min_bytes).start()
+    room = server.call_soon(server.chat_server.get_room, "history", True)
+    for i in range(1000):
+        frame = chat_pb2.ChatMessage(user_id=f"user-{i % 40}", username=f"user{i % 40}", message=chat_text(rng),
+                                     timestamp=int(time.time() * 1000), type=chat_pb2.MessageType.TEXT,
+                                     room_id="history").SerializeToString()
+        server.call_soon(room.publish, frame, 0)
+
+    relay = CountingRelay(server.port)
+    channel = grpc.insecure_channel(f"127.0.0.1:{relay.port}")
+    stub = chat_pb2_grpc.ChatServiceStub(channel)
+    replay(stub, False, 1)  # connect and warm up
+    relay.take()
+
+    results = []
+    for name, run in [
+        ("replay", lambda: replay(stub, False, args.joins)),
+        ("replay batched", lambda: replay(stub, True, args.joins)),
+        ("pages", lambda: sum(len(stub.GetHistory(chat_pb2.HistoryRequest(room_id="history", limit=500)).messages)
+                              for _ in range(args.joins))),
+        ("live", lambda: live(stub, args.listeners, args.messages, rng)),
+    ]:
+        cpu = time.process_time()
+        received = run()
+        cpu = time.process_time() - cpu
+        results.append((name, relay.take() / max(received, 1), cpu / max(received, 1)))
+
+    channel.close()
+    relay.close()
+    server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', choices=('threaded', 'asyncio'), default='threaded')
+    parser.add_argument('--joins', type=int, default=20, help="history replays and pages per workload")
+    parser.add_argument('--listeners', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=1000, help="live messages posted")
+    args = parser.parse_args()
+
+    print(f"{'setting':<16} {'workload':<15} {'bytes/msg':>10} {'CPU us/msg':>11}")
+    for label, compression, min_bytes in SETTINGS:
+        for name, wire_bytes, cpu in measure(args, compression, min_bytes):
+            print(f"{label:<16} {name:<15} {wire_bytes:>10.1f} {cpu * 1e6:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Broadcast fan-out cost: process CPU time per delivered message against room size.
+
+Joins N listeners into one room of an in-process server, publishes a burst of
+messages and waits until every listener has received all of them. Listeners read
+raw bytes (no client-side decoding), so the measured CPU is dominated by the
+server's fan-out path: queueing, serialization and the gRPC send.
+
+    python benchmarks/fanout_cpu.py --sizes 10 100 500 --messages 200
+"""
+import argparse
+import asyncio
+import time
+
+from common import InProcessServer, join_message
+
+import grpc
+import chat_pb2
+
+
+async def listen(call, expected, done):
+    """Count TEXT-sized frames until the expected number of broadcasts arrived"""
+    received = 0
+    while received < expected:
+        frame = await call.read()
+        if frame is grpc.aio.EOF:
+            break
+        if frame.startswith(b"\n\x06sender"):  # user_id field of the publisher
+            received += 1
+    done.append(received)
+
+
+async def measure(target, room_size, count, body_size):
+    room_id = f"fanout-{room_size}"
+    channels = [grpc.aio.insecure_channel(target) for _ in range(8)]
+    join_chat = [
+        chan.stream_stream(
+            '/chat.ChatService/JoinChat',
+            request_serializer=chat_pb2.ChatMessage.SerializeToString,
+            response_deserializer=None
+        )
+        for chan in channels
+    ]
+
+    listeners = []
+    for i in range(room_size):
+        call = join_chat[i % len(join_chat)]()
+        await call.write(join_message(f"listener-{i}", room_id))
+        listeners.append(call)
+    sender = join_chat[0]()
+    await sender.write(join_message("sender", room_id))
+    await asyncio.sleep(0.5)  # let joins and their announcements drain
+
+    done = []
+    readers = [asyncio.create_task(listen(call, count, done)) for call in listeners]
+    body = "x" * body_size
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for _ in range(count):
+        await sender.write(chat_pb2.ChatMessage(user_id="sender", username="sender", message=body))
+    await asyncio.gather(*readers)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    for call in listeners + [sender]:
+        call.cancel()
+    for chan in channels:
+        await chan.close()
+    return sum(done), cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--body-size', type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"{'room size':>9} {'delivered':>10} {'cpu us/msg':>11} {'msgs/sec':>10}")
+    for size in args.sizes:
+        with InProcessServer(args.engine, max_workers=size + 8) as server:
+            delivered, cpu, wall = server.run(measure(server.target, size, args.messages, args.body_size))
+        print(f"{size:>9} {delivered:>10} {cpu / delivered * 1e6:>11.2f} {delivered / wall:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
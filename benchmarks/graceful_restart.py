@@ -0,0 +1,199 @@
+"""Restarting a server: reconnect spike and time to ready, with and without a drain.
+
+Reconnects: a server process (asyncio engine, memory history store) holds
+--sessions chat_lib sessions in rooms of --room-size, with some history. It
+gets SIGTERM and, once it has exited, a new process starts on the same port.
+"stop" is how servers used to stop: every stream is cut at once and the
+history is lost. "drain" tells every session when to reconnect, spread over
+--drain-seconds, and hands history to the new process through a snapshot. The new process's /metrics are polled for
+connected sessions: "peak/100ms" is the most sessions that came back within
+any 100ms, "all back s" the time from SIGTERM until every session is back,
+"history" the messages the new process has.
+
+Time to ready: a history store holding --messages messages is snapshotted
+("write s", "MiB") and loaded in-process ("load s"); "ready s" is the time from
+starting a server process until it answers, without and with the snapshot.
+
+    python benchmarks/graceful_restart.py --sessions 2000 --messages 1000000
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+
+from common import chat_server
+
+import grpc
+
+import chat_pb2
+from chat_lib import ChatPool
+from history_store import CompactHistoryStore, MemoryHistoryStore
+from loadgen import free_port
+from snapshot import load_snapshot, write_snapshot
+
+STORES = {'memory': MemoryHistoryStore, 'compact': CompactHistoryStore}
+
+
+def run_server(address, metrics_port, drain_seconds, snapshot_path, store):
+    logging.getLogger('chat_server').setLevel(logging.WARNING)
+    chat_server.serve('asyncio', address, metrics_port=metrics_port, drain_seconds=drain_seconds,
+                      snapshot_path=snapshot_path, history_store=STORES[store](max_messages=10 ** 7))
+
+
+def start_server(*args):
+    process = multiprocessing.get_context('spawn').Process(target=run_server, args=args, daemon=True)
+    process.start()
+    return process
+
+
+async def wait_ready(address, timeout=60):
+    async with grpc.aio.insecure_channel(address) as channel:
+        await asyncio.wait_for(channel.channel_ready(), timeout)
+
+
+def scrape(metrics_port, name):
+    """Sum of a metric's samples on a server's /metrics, or None if it is not up"""
+    try:
+        with urllib.request.urlopen(f"http://localhost:{metrics_port}/metrics", timeout=2) as response:
+            text = response.read().decode()
+    except OSError:
+        return None
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(name))
+
+
+def poll_connected(metrics_port, samples, stop):
+    """Record (time, connected sessions) every 20ms until stop is set"""
+    while not stop.is_set():
+        connected = scrape(metrics_port, 'chat_connected_clients')
+        if connected is not None:
+            samples.append((time.perf_counter(), connected))
+        stop.wait(0.02)
+
+
+def peak_per_window(samples, window=0.1):
+    """Most sessions connected within any window, from (time, count) samples"""
+    peak = 0
+    start = 0
+    for end in range(len(samples)):
+        while samples[end][0] - samples[start][0] > window:
+            start += 1
+        peak = max(peak, samples[end][1] - samples[start][1])
+    return peak
+
+
+async def until(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+async def restart(sessions, room_size, drain_seconds, messages_per_room):
+    """Reconnect figures for one restart: (peak per 100ms, seconds until all back, history kept)"""
+    loop = asyncio.get_running_loop()
+    address = f"localhost:{free_port()}"
+    old_metrics, new_metrics = free_port(), free_port()
+    snapshot_path = os.path.join(tempfile.mkdtemp(), 'history.snapshot') if drain_seconds else None
+    old = start_server(address, old_metrics, drain_seconds, snapshot_path, 'memory')
+    await wait_ready(address)
+
+    pool = ChatPool(address, channels=8)
+    history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE)
+    opened = [await pool.open_session(f"user-{i}", f"user{i}", rooms=[f"room-{i // room_size}"], history=history,
+                                      on_message=lambda message: None) for i in range(sessions)]
+    deadline = time.perf_counter() + 60
+    while (await loop.run_in_executor(None, scrape, old_metrics, 'chat_connected_clients') or 0) < sessions:
+        if time.perf_counter() > deadline:
+            raise RuntimeError("Sessions did not all connect")
+        await asyncio.sleep(0.2)
+    for i in range(0, sessions, room_size):
+        opened[i].send_many(f"message {n}" for n in range(messages_per_room))
+    await asyncio.sleep(1)
+
+    start = time.perf_counter()
+    old.terminate()
+    await until(lambda: not old.is_alive(), 60)
+    new = start_server(address, new_metrics, 0, snapshot_path, 'memory')
+    samples = []
+    stop = threading.Event()
+    poller = threading.Thread(target=poll_connected, args=(new_metrics, samples, stop), daemon=True)
+    poller.start()
+    back = await until(lambda: samples and samples[-1][1] >= sessions, drain_seconds + 60)
+    all_back = samples[-1][0] - start if back else float('nan')
+    stop.set()
+    poller.join()
+    kept = await loop.run_in_executor(None, scrape, new_metrics, 'chat_history_messages')
+
+    # Stopped with the sessions still connected, like a real restart
+    new.terminate()
+    await until(lambda: not new.is_alive(), 60)
+    await pool.close(timeout=1)
+    return peak_per_window(samples), all_back, kept
+
+
+def fill(store, rooms, messages):
+    for i in range(messages):
+        room_id = f"room-{i % rooms}"
+        frame = chat_pb2.ChatMessage(user_id=f"user-{i % 1000}", username=f"user{i % 1000}",
+                                     message=f"message number {i} of the benchmark", timestamp=i,
+                                     room_id=room_id, seq=i // rooms + 1).SerializeToString()
+        store.append(room_id, frame, i)
+
+
+async def time_to_ready(snapshot_path, store):
+    address = f"localhost:{free_port()}"
+    start = time.perf_counter()
+    server = start_server(address, None, 0, snapshot_path, store)
+    await wait_ready(address)
+    elapsed = time.perf_counter() - start
+    server.terminate()
+    server.join()
+    return elapsed
+
+
+async def run(args):
+    # One event loop for everything: grpc.aio does not get along with a new loop per run
+    print(f"{args.sessions} sessions, rooms of {args.room_size}")
+    print(f"{'restart':<8} {'peak/100ms':>11} {'all back s':>11} {'history':>8}")
+    for label, drain_seconds in (("stop", 0), ("drain", args.drain_seconds)):
+        peak, all_back, kept = await restart(args.sessions, args.room_size, drain_seconds, 20)
+        print(f"{label:<8} {peak:>11.0f} {all_back:>11.2f} {kept:>8.0f}")
+
+    print()
+    print(f"{args.messages} messages in {args.rooms} rooms")
+    print(f"{'store':<8} {'write s':>8} {'MiB':>6} {'load s':>7} {'ready s':>8} {'no snapshot':>12}")
+    snapshot_path = os.path.join(tempfile.mkdtemp(), 'history.snapshot')
+    for name, store_class in STORES.items():
+        store = store_class(max_messages=10 ** 7)
+        fill(store, args.rooms, args.messages)
+        start = time.perf_counter()
+        size = write_snapshot(store, snapshot_path)
+        write_seconds = time.perf_counter() - start
+        del store
+        start = time.perf_counter()
+        load_snapshot(store_class(max_messages=10 ** 7), snapshot_path)
+        load_seconds = time.perf_counter() - start
+        ready = await time_to_ready(snapshot_path, name)  # the server removes the snapshot once loaded
+        baseline = await time_to_ready(None, name)
+        print(f"{name:<8} {write_seconds:>8.2f} {size / 2 ** 20:>6.1f} {load_seconds:>7.2f} {ready:>8.2f} "
+              f"{baseline:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=2000)
+    parser.add_argument('--room-size', type=int, default=50)
+    parser.add_argument('--drain-seconds', type=float, default=5.0)
+    parser.add_argument('--messages', type=int, default=1000000, help="history messages for time to ready")
+    parser.add_argument('--rooms', type=int, default=100, help="rooms the history is spread over")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Memory per retained message: MemoryHistoryStore against CompactHistoryStore.
+
+Appends N chat messages (1000 senders, bodies of 20-120 characters, spread over a
+few rooms) to each in-memory store, each message serialized fresh the way the
+server hands it over, with its seq. Memory is what tracemalloc sees the store
+holding afterwards; append and read rates come from a second, untraced run.
+"read" rebuilds every frame of one room, which the compact store has to encode.
+
+    python benchmarks/history_memory.py --messages 1000000 --rooms 10
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+
+from common import chat_server  # noqa: F401  (sets up import paths)
+
+import chat_pb2
+from history_store import CompactHistoryStore, MemoryHistoryStore
+from wire import with_seq
+
+BATCH = 10000
+
+
+def message_batches(count, rooms, seed=1):
+    """Lists of (room_id, frame, timestamp), at most BATCH at a time"""
+    rng = random.Random(seed)
+    users = [(f"{rng.getrandbits(128):032x}", f"user{i}") for i in range(1000)]
+    words = ["hello", "there", "meeting", "at", "noon", "ok", "see", "you", "later", "thanks", "sure", "lunch"]
+    seqs = [0] * rooms
+    timestamp = int(time.time() * 1000)
+    done = 0
+    while done < count:
+        batch = []
+        for _ in range(min(BATCH, count - done)):
+            r = rng.randrange(rooms)
+            user_id, username = rng.choice(users)
+            body = " ".join(rng.choice(words) for _ in range(rng.randint(4, 24)))[:rng.randint(20, 120)]
+            timestamp += rng.randint(0, 3)
+            message = chat_pb2.ChatMessage(user_id=user_id, username=username, message=body, timestamp=timestamp,
+                                           type=chat_pb2.MessageType.TEXT, room_id=f"room-{r}")
+            seqs[r] += 1
+            batch.append((f"room-{r}", with_seq(message.SerializeToString(), seqs[r]), timestamp))
+        done += len(batch)
+        yield batch
+
+
+def fill(store, count, rooms):
+    """Append every message; returns (seconds spent in append, frame bytes appended)"""
+    spent = 0.0
+    frame_bytes = 0
+    for batch in message_batches(count, rooms):
+        frame_bytes += sum(len(frame) for _, frame, _ in batch)
+        start = time.perf_counter()
+        for room_id, frame, timestamp in batch:
+            store.append(room_id, frame, timestamp)
+        spent += time.perf_counter() - start
+    return spent, frame_bytes
+
+
+def retained_bytes(make, count, rooms):
+    gc.collect()
+    tracemalloc.start()
+    store = make()
+    fill(store, count, rooms)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current, store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--rooms', type=int, default=10)
+    args = parser.parse_args()
+
+    stores = [
+        ("memory", lambda: MemoryHistoryStore(max_messages=args.messages)),
+        ("compact", lambda: CompactHistoryStore(max_messages=args.messages)),
+    ]
+    print(f"{args.messages} messages in {args.rooms} rooms")
+    print(f"{'store':<8} {'MB':>8} {'bytes/msg':>10} {'appends/sec':>12} {'reads/sec':>10}")
+    for name, make in stores:
+        memory, store = retained_bytes(make, args.messages, args.rooms)
+        del store
+        store = make()
+        spent, frame_bytes = fill(store, args.messages, args.rooms)
+        start = time.perf_counter()
+        frames = store.read("room-0", 0, args.messages)
+        read_rate = len(frames) / (time.perf_counter() - start)
+        print(f"{name:<8} {memory / 1e6:>8.1f} {memory / args.messages:>10.1f} "
+              f"{args.messages / spent:>12.0f} {read_rate:>10.0f}")
+        del store, frames
+    print(f"(encoded frames average {frame_bytes / args.messages:.1f} bytes)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""History store write throughput and cold-start replay cost.
+
+Appends encoded ChatMessages to each history store backend, then reopens the log
+store from disk the way a restarted server would and times (a) priming every
+room's 50-message hot tail and (b) a full sequential replay of one room.
+
+    python benchmarks/history_throughput.py --rooms 20 --messages 50000
+"""
+import argparse
+import shutil
+import tempfile
+import time
+
+from common import chat_server  # noqa: F401  (sets up import paths)
+
+import chat_pb2
+from history_store import LogHistoryStore, MemoryHistoryStore
+
+
+def frames(count, body_size):
+    message = chat_pb2.ChatMessage(
+        user_id="3f1c0a52-5b7e-4c1e-9d55-0f0e8a1b2c3d",
+        username="alice",
+        message="x" * body_size,
+        timestamp=int(time.time() * 1000),
+        type=chat_pb2.MessageType.TEXT,
+        room_id="room"
+    )
+    frame = message.SerializeToString()
+    return [frame] * count
+
+
+def write(store, rooms, per_room, payload):
+    start = time.perf_counter()
+    for i in range(per_room):
+        for r in range(rooms):
+            store.append(f"room-{r}", payload[i], i)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--messages', type=int, default=50000, help="messages per room")
+    parser.add_argument('--body-size', type=int, default=128)
+    args = parser.parse_args()
+
+    payload = frames(args.messages, args.body_size)
+    total = args.rooms * args.messages
+    total_mb = total * (len(payload[0]) + 4) / 1e6
+    directory = tempfile.mkdtemp(prefix="chat-history-")
+    try:
+        backends = [
+            ("memory", lambda: MemoryHistoryStore(max_messages=args.messages)),
+            ("log", lambda: LogHistoryStore(directory)),
+            ("log+fsync", lambda: LogHistoryStore(directory + "-fsync", fsync=True)),
+        ]
+        print(f"{'backend':<10} {'appends/sec':>12} {'MB/sec':>8}")
+        for name, make in backends:
+            store = make()
+            # fsync is orders of magnitude slower; a slice of the workload is enough
+            per_room = args.messages if name != "log+fsync" else max(1, args.messages // 100)
+            elapsed = write(store, args.rooms, per_room, payload)
+            store.close()
+            count = args.rooms * per_room
+            print(f"{name:<10} {count / elapsed:>12.0f} {count * (len(payload[0]) + 4) / 1e6 / elapsed:>8.1f}")
+
+        print(f"\ncold start: {args.rooms} rooms, {total} messages, {total_mb:.1f} MB on disk")
+        start = time.perf_counter()
+        store = LogHistoryStore(directory)
+        tails = [store.tail(f"room-{r}", 50) for r in range(args.rooms)]
+        elapsed = time.perf_counter() - start
+        print(f"open + prime 50-message tails:  {elapsed * 1000:>8.2f} ms ({sum(map(len, tails))} messages)")
+
+        start = time.perf_counter()
+        replayed = 0
+        offset = 0
+        while True:
+            records = store.read("room-0", offset, 1000)
+            if not records:
+                break
+            for _, frame in records:
+                chat_pb2.ChatMessage.FromString(frame)
+            replayed += len(records)
+            offset = records[-1][0] + 1
+        elapsed = time.perf_counter() - start
+        print(f"full replay of one room:        {elapsed * 1000:>8.2f} ms ({replayed / elapsed:.0f} msgs/sec decoded)")
+        store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.rmtree(directory + "-fsync", ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
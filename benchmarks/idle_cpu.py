@@ -0,0 +1,102 @@
+"""Idle cost of connected clients: process CPU and thread wakeups while nobody talks.
+
+Opens N streams against an in-process server, lets them settle, then samples the
+process CPU time and context switches (summed over all threads) for a quiet
+window. Finally it cancels one stream and times how long the server takes to
+notice and unregister it.
+
+    python benchmarks/idle_cpu.py --clients 100 500 --seconds 5
+"""
+import argparse
+import asyncio
+import glob
+import time
+
+from common import InProcessServer, chat_server
+
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+
+
+def context_switches():
+    """Voluntary plus involuntary context switches of every thread in this process"""
+    total = 0
+    for path in glob.glob('/proc/self/task/*/status'):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if 'ctxt_switches' in line:
+                        total += int(line.split()[-1])
+        except FileNotFoundError:
+            pass  # the thread exited
+    return total
+
+
+async def open_streams(target, count, channels, rooms):
+    chans = [grpc.aio.insecure_channel(target) for _ in range(channels)]
+    calls = []
+    for i in range(count):
+        stub = chat_pb2_grpc.ChatServiceStub(chans[i % channels])
+        call = stub.JoinChat()
+        await call.write(chat_pb2.ChatMessage(
+            user_id=f"user-{i}",
+            username=f"user{i}",
+            type=chat_pb2.MessageType.JOIN,
+            room_id=f"idle-{i % rooms}",
+            history=chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE)
+        ))
+        calls.append(call)
+    return chans, calls
+
+
+async def measure(server, count, channels, rooms, seconds):
+    clients = server.chat_server.clients
+    chans, calls = await open_streams(server.target, count, channels, rooms)
+
+    # Wait until registrations stop growing; the threaded engine may hit a thread limit
+    accepted = -1
+    while len(clients) != accepted:
+        accepted = len(clients)
+        await asyncio.sleep(1.0)
+    await asyncio.sleep(2.0)  # let join announcements drain
+
+    cpu_start = time.process_time()
+    switches_start = context_switches()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu_start
+    switches = context_switches() - switches_start
+
+    # Disconnect detection: one client goes away without saying goodbye
+    start = time.perf_counter()
+    calls[0].cancel()
+    while len(clients) == accepted:
+        await asyncio.sleep(0.001)
+    noticed = time.perf_counter() - start
+
+    for call in calls[1:]:
+        call.cancel()
+    for chan in chans:
+        await chan.close()
+    return accepted, cpu / seconds, switches / seconds, noticed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[100, 500])
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=5.0, help="length of the idle window")
+    args = parser.parse_args()
+
+    print(f"{'engine':<10} {'clients':>8} {'cpu %':>7} {'switches/s':>11} {'disconnect ms':>14}")
+    for engine in chat_server.ENGINES:
+        for count in args.clients:
+            with InProcessServer(engine, max_workers=count + 8) as server:
+                accepted, cpu, switches, noticed = server.run(
+                    measure(server, count, args.channels, args.rooms, args.seconds))
+            print(f"{engine:<10} {accepted:>8} {cpu * 100:>7.2f} {switches:>11.0f} {noticed * 1000:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
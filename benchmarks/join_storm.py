@@ -0,0 +1,65 @@
+"""Join storm: N users join one room back to back, with and without presence digests.
+
+Drives ChatServer directly (no gRPC). The room has 50 messages of history,
+replayed to every joiner. "announce each" is --presence-interval-ms 0: every join is
+recorded and broadcast to everyone already there, which also invalidates the
+room's history snapshot, so every joiner copies the tail again. "digest" announces
+the joins as one message per room per interval. "ready" is the time join_room takes
+(history queued, session subscribed); "queued" counts every message put on any
+member's outbound queue, announcements included, until the last digest is out.
+
+    python benchmarks/join_storm.py --users 5000
+"""
+import argparse
+import time
+
+from common import chat_server, join_message
+
+import chat_pb2
+from history_store import MemoryHistoryStore
+
+
+class CountingQueue:
+    """Stands in for a client's outbound queue; only counts what is queued"""
+    queued = 0
+
+    def put_nowait(self, frame):
+        CountingQueue.queued += 1
+
+
+def storm(users, interval):
+    server = chat_server.ChatServer(history_store=MemoryHistoryStore(), presence_interval=interval)
+    server.get_room("storm", create=True)
+    for i in range(50):
+        server.broadcast_to_room("storm", chat_pb2.ChatMessage(user_id="old", username="old", message=f"message {i}",
+                                                               type=chat_pb2.MessageType.TEXT, room_id="storm"))
+    CountingQueue.queued = 0
+    ready = []
+    start = time.perf_counter()
+    for i in range(users):
+        session = server.new_session(f"user-{i}", f"user{i}", CountingQueue(), None)
+        joined = time.perf_counter()
+        server.join_room(session, join_message("", "storm", chat_pb2.HistoryMode.LAST))
+        ready.append(time.perf_counter() - joined)
+    server.presence.close()  # announce what is still pending
+    elapsed = time.perf_counter() - start
+    recorded = server.history_store.next_offset("storm") - 50
+    return elapsed, sorted(ready), CountingQueue.queued, recorded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--interval-ms', type=float, default=1000, help="digest interval")
+    args = parser.parse_args()
+
+    print(f"{args.users} users joining one room")
+    print(f"{'presence':<14} {'total s':>8} {'ready p50 us':>13} {'p99 us':>8} {'queued':>11} {'recorded':>9}")
+    for label, interval in (("announce each", 0), ("digest", args.interval_ms / 1000)):
+        elapsed, ready, queued, recorded = storm(args.users, interval)
+        print(f"{label:<14} {elapsed:>8.2f} {ready[len(ready) // 2] * 1e6:>13.1f} "
+              f"{ready[int(len(ready) * 0.99)] * 1e6:>8.1f} {queued:>11} {recorded:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Publish-to-receive latency between two live clients connected to one server.
+
+A sender and a receiver join the same room; the sender publishes one message at a
+time and waits until the receiver sees it. Both clients keep their streams open the
+whole time, so this also checks that broadcasts arrive while the sender is still
+sending.
+
+    python benchmarks/latency.py --messages 2000
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from common import InProcessServer, chat_server, join_message, percentile
+
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+
+
+async def join(stub, user_id, room_id):
+    call = stub.JoinChat()
+    await call.write(join_message(user_id, room_id))
+    return call
+
+
+async def wait_for_text(call, body, timeout):
+    """Read the stream until a TEXT message with the given body arrives"""
+    while True:
+        message = await asyncio.wait_for(call.read(), timeout)
+        if message is grpc.aio.EOF:
+            raise RuntimeError("stream closed before the message arrived")
+        if message.type == chat_pb2.MessageType.TEXT and message.message == body:
+            return
+
+
+async def measure(target, count, timeout):
+    async with grpc.aio.insecure_channel(target) as channel:
+        stub = chat_pb2_grpc.ChatServiceStub(channel)
+        receiver = await join(stub, "receiver", "latency")
+        sender = await join(stub, "sender", "latency")
+
+        # Make sure both streams are live before timing anything
+        await sender.write(chat_pb2.ChatMessage(user_id="sender", username="sender", message="warmup"))
+        await wait_for_text(receiver, "warmup", timeout)
+
+        samples = []
+        for i in range(count):
+            body = f"ping {i}"
+            start = time.perf_counter()
+            await sender.write(chat_pb2.ChatMessage(user_id="sender", username="sender", message=body))
+            await wait_for_text(receiver, body, timeout)
+            samples.append((time.perf_counter() - start) * 1000)
+
+        sender.cancel()
+        receiver.cancel()
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--timeout', type=float, default=5.0, help="seconds to wait for each delivery")
+    args = parser.parse_args()
+
+    print(f"{'engine':<10} {'messages':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'mean ms':>8}")
+    for engine in chat_server.ENGINES:
+        with InProcessServer(engine) as server:
+            samples = sorted(server.run(measure(server.target, args.messages, args.timeout)))
+        print(f"{engine:<10} {len(samples):>8} {percentile(samples, 0.5):>8.3f} "
+              f"{percentile(samples, 0.99):>8.3f} {samples[-1]:>8.3f} {statistics.mean(samples):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
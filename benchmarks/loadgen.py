@@ -0,0 +1,275 @@
+"""Headless load generator: simulated users chatting in many rooms, with join/leave churn.
+
+Each simulated user holds a JoinChat stream (through chat_pb2_grpc.ChatServiceStub)
+in one of the rooms and posts messages at random (Poisson) intervals. Every message
+carries its send time, so each delivery yields a publish-to-deliver latency.
+A churn task makes random users leave and replaces them with new ones.
+
+After a warm-up the generator measures for --duration seconds and reports
+latency percentiles, delivered messages/sec and the server's memory. By default
+the server runs in this process (so its RSS includes the generator); --spawn
+runs it in a child process instead, and --target points at a running server.
+
+    python benchmarks/loadgen.py --users 1000 --rooms 50 --rate 200 --churn 5 --duration 10
+
+For release gating, --max-p99-ms and --min-msgs-sec make the exit status 1 when
+the run is worse, and --json prints the results as one JSON object.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import socket
+import sys
+import time
+
+from common import InProcessServer, chat_server
+
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+
+
+class Stats:
+    """Counters and latency samples, recorded only inside the measurement window"""
+
+    def __init__(self):
+        self.measuring = False
+        self.latencies = []  # seconds
+        self.delivered = 0
+        self.sent = 0
+        self.joins = 0
+        self.leaves = 0
+        self.errors = 0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return float('nan')
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SimulatedUser:
+    def __init__(self, user_id, room_id, stub, rate, body_size, stats):
+        self.user_id = user_id
+        self.room_id = room_id
+        self.stub = stub
+        self.rate = rate  # messages per second
+        self.padding = "x" * body_size
+        self.stats = stats
+        self.leaving = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self
+
+    def message(self, message_type, text=""):
+        return chat_pb2.ChatMessage(
+            user_id=self.user_id,
+            username=self.user_id,
+            message=text,
+            type=message_type,
+            room_id=self.room_id,
+            history=chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE)
+        )
+
+    async def receive(self, call):
+        stats = self.stats
+        async for response in call:
+            if response.type != chat_pb2.MessageType.TEXT:
+                continue
+            sent, _, _ = response.message.partition(" ")
+            if stats.measuring:
+                stats.latencies.append((time.perf_counter_ns() - int(sent)) / 1e9)
+                stats.delivered += 1
+
+    async def run(self):
+        call = self.stub.JoinChat()
+        reader = None
+        try:
+            await call.write(self.message(chat_pb2.MessageType.JOIN))
+            self.stats.joins += 1
+            reader = asyncio.create_task(self.receive(call))
+            while not self.leaving.is_set():
+                try:
+                    await asyncio.wait_for(self.leaving.wait(), random.expovariate(self.rate))
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    break
+                await call.write(self.message(
+                    chat_pb2.MessageType.TEXT, f"{time.perf_counter_ns()} {self.padding}"))
+                if self.stats.measuring:
+                    self.stats.sent += 1
+            await call.write(self.message(chat_pb2.MessageType.LEAVE))
+            await call.done_writing()
+            self.stats.leaves += 1
+            await asyncio.wait_for(reader, timeout=5)
+        except (grpc.aio.AioRpcError, asyncio.TimeoutError):
+            self.stats.errors += 1
+        finally:
+            if reader is not None:
+                reader.cancel()
+            call.cancel()
+
+    def leave(self):
+        self.leaving.set()
+
+
+async def churn(users, spawn, rate, stop):
+    """Replace a random user with a new one, rate times per second"""
+    serial = 0
+    while not stop.is_set():
+        await asyncio.sleep(random.expovariate(rate))
+        index = random.randrange(len(users))
+        users[index].leave()
+        serial += 1
+        users[index] = spawn(f"churn-{serial}", users[index].room_id)
+
+
+async def generate(target, args, stats):
+    channels = [grpc.aio.insecure_channel(target) for _ in range(args.channels)]
+    stubs = [chat_pb2_grpc.ChatServiceStub(channel) for channel in channels]
+    per_user_rate = args.rate / args.users
+
+    def spawn(user_id, room_id):
+        stub = stubs[hash(user_id) % len(stubs)]
+        return SimulatedUser(user_id, room_id, stub, per_user_rate, args.body_size, stats).start()
+
+    users = []
+    for i in range(args.users):
+        users.append(spawn(f"user-{i}", f"room-{i % args.rooms}"))
+        if i % 100 == 99:
+            await asyncio.sleep(0)  # let the joins go out
+    stop = asyncio.Event()
+    churner = asyncio.create_task(churn(users, spawn, args.churn, stop)) if args.churn > 0 else None
+
+    await asyncio.sleep(args.warmup)
+    stats.measuring = True
+    start = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    stats.measuring = False
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    if churner is not None:
+        churner.cancel()
+    for user in users:
+        user.leave()
+    await asyncio.wait([user.task for user in users], timeout=10)
+    for channel in channels:
+        await channel.close()
+    return elapsed
+
+
+def memory_kb(pid='self'):
+    """(VmRSS, VmHWM) of a process in KiB"""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'VmHWM'):
+                values[key] = int(value.split()[0])
+    return values.get('VmRSS', 0), values.get('VmHWM', 0)
+
+
+def run_server(engine, address, max_workers):
+    logging.getLogger('chat_server').setLevel(logging.WARNING)
+    chat_server.serve(engine, address, max_workers)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='asyncio', choices=chat_server.ENGINES)
+    parser.add_argument('--max-workers', type=int, default=2000, help="threaded engine worker threads")
+    parser.add_argument('--spawn', action='store_true', help="run the server in a child process")
+    parser.add_argument('--target', help="use a running server instead, e.g. localhost:50051")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=200.0, help="messages/sec across all users")
+    parser.add_argument('--churn', type=float, default=5.0, help="users replaced per second")
+    parser.add_argument('--body-size', type=int, default=64)
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--warmup', type=float, default=3.0, help="seconds before measuring")
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of measurement")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    parser.add_argument('--max-p99-ms', type=float, help="fail if p99 latency is higher")
+    parser.add_argument('--min-msgs-sec', type=float, help="fail if delivered msgs/sec is lower")
+    args = parser.parse_args()
+
+    stats = Stats()
+    server_pid = None
+    if args.target:
+        elapsed = asyncio.run(generate(args.target, args, stats))
+        rss = hwm = None
+    elif args.spawn:
+        address = f"localhost:{free_port()}"
+        server = multiprocessing.get_context('spawn').Process(
+            target=run_server, args=(args.engine, address, args.max_workers), daemon=True)
+        server.start()
+        try:
+            with grpc.insecure_channel(address) as channel:
+                grpc.channel_ready_future(channel).result(timeout=15)
+            elapsed = asyncio.run(generate(address, args, stats))
+            server_pid = server.pid
+            rss, hwm = memory_kb(server_pid)
+        finally:
+            server.terminate()
+            server.join()
+    else:
+        with InProcessServer(args.engine, max_workers=args.max_workers) as server:
+            elapsed = server.run(generate(server.target, args, stats))
+            rss, hwm = memory_kb()
+
+    results = {
+        'engine': None if args.target else args.engine,
+        'users': args.users,
+        'rooms': args.rooms,
+        'sent': stats.sent,
+        'delivered': stats.delivered,
+        'msgs_per_sec': stats.delivered / elapsed,
+        'p50_ms': stats.percentile(0.50) * 1000,
+        'p99_ms': stats.percentile(0.99) * 1000,
+        'p999_ms': stats.percentile(0.999) * 1000,
+        'joins': stats.joins,
+        'leaves': stats.leaves,
+        'errors': stats.errors,
+        'server_rss_mb': rss / 1024 if rss else None,
+        'server_peak_rss_mb': hwm / 1024 if hwm else None,
+        'server_in_process': not (args.target or args.spawn),
+    }
+
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(f"users {args.users} in {args.rooms} rooms, {args.rate:g} msgs/sec offered, "
+              f"churn {args.churn:g}/sec, {elapsed:.1f}s measured")
+        print(f"sent {stats.sent}, delivered {stats.delivered} ({results['msgs_per_sec']:.0f} msgs/sec)")
+        print(f"latency p50 {results['p50_ms']:.2f} ms, p99 {results['p99_ms']:.2f} ms, "
+              f"p999 {results['p999_ms']:.2f} ms")
+        print(f"joins {stats.joins}, leaves {stats.leaves}, errors {stats.errors}")
+        if rss:
+            where = "" if server_pid else " (includes the load generator)"
+            print(f"server RSS {rss / 1024:.1f} MB, peak {hwm / 1024:.1f} MB{where}")
+
+    failed = []
+    if args.max_p99_ms is not None and not results['p99_ms'] <= args.max_p99_ms:
+        failed.append(f"p99 {results['p99_ms']:.2f} ms > {args.max_p99_ms} ms")
+    if args.min_msgs_sec is not None and not results['msgs_per_sec'] >= args.min_msgs_sec:
+        failed.append(f"{results['msgs_per_sec']:.0f} msgs/sec < {args.min_msgs_sec}")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Server publish throughput under different logging setups.
+
+Drives ChatServer.handle_client_message directly from several threads (no gRPC,
+so logging is a visible share of the work) into rooms whose members are plain
+outbound queues, with logs written to a temporary file. Setups: synchronous
+logging of every per-message event (what the server used to do), synchronous
+and queue-backed logging at INFO, queue-backed with the per-message rate limit,
+and logging off. "flush ms" is how long the queue-backed listener still needed
+to write its backlog after the run.
+
+    python benchmarks/logging_cost.py --threads 4 --messages 20000
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from common import chat_server
+
+import chat_pb2
+from chat_logging import configure_logging
+from history_store import MemoryHistoryStore
+from outbox import Outbox
+
+SETUPS = [
+    # name, level, mode, per-message rate limit
+    ('sync, every event', 'DEBUG', 'sync', None),
+    ('sync, INFO', 'INFO', 'sync', None),
+    ('async, INFO', 'INFO', 'async', None),
+    ('async, INFO, 50/s', 'INFO', 'async', 50),
+    ('off (WARNING)', 'WARNING', 'async', None),
+]
+
+
+def build_server(rooms, room_size):
+    server = chat_server.ChatServer(history_store=MemoryHistoryStore())
+    for r in range(rooms):
+        room_id = f"room-{r}"
+        room = server.get_room(room_id, create=True)
+        for i in range(room_size):
+            info = server.new_session(f"{room_id}-user-{i}", f"user{i}", Outbox(room_id, maxsize=100), None)
+            room.add_member(info)
+    return server
+
+
+def publish(server, room_id, count, body):
+    for _ in range(count):
+        message = chat_pb2.ChatMessage(user_id="sender", username="sender", message=body)
+        server.handle_client_message(message, room_id)
+
+
+def measure(threads, count, room_size, body_size):
+    server = build_server(threads, room_size)
+    body = "x" * body_size
+    workers = [
+        threading.Thread(target=publish, args=(server, f"room-{t}", count // threads, body))
+        for t in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4, help="publishing threads, one room each")
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--room-size', type=int, default=5)
+    parser.add_argument('--body-size', type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'logging':<20} {'msgs/sec':>9} {'log lines':>10} {'flush ms':>9}")
+    for name, level, mode, rate in SETUPS:
+        with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as log_file:
+            listener = configure_logging(level, mode, message_rate=rate, stream=log_file)
+            for logger_name in ('chat_server', 'chat.messages'):
+                logging.getLogger(logger_name).setLevel(logging.NOTSET)  # common.py quiets them
+            wall = measure(args.threads, args.messages, args.room_size, args.body_size)
+            flush_start = time.perf_counter()
+            if listener is not None:
+                listener.stop()
+            flush = time.perf_counter() - flush_start
+        with open(log_file.name) as f:
+            lines = sum(1 for _ in f)
+        os.unlink(log_file.name)
+        print(f"{name:<20} {args.messages / wall:>9.0f} {lines:>10} {flush * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
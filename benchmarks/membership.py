@@ -0,0 +1,72 @@
+"""Membership index costs: fan-out per recipient and moving a session between rooms.
+
+Drives ChatServer directly (no gRPC). Each room holds N sessions whose outbound
+queues only keep the latest few messages. "fan-out ns/recipient" is the time of
+one broadcast into the room divided by N. "move us" is one stream leaving a room of
+N and joining another of N; the user has another session in both rooms, so no
+join or leave is announced and only the membership index is measured.
+
+    python benchmarks/membership.py --sizes 10 100 1000 10000
+"""
+import argparse
+import time
+
+from common import SinkQueue, chat_server, join_message
+
+import chat_pb2
+from history_store import MemoryHistoryStore
+
+
+def fill(server, room_id, size):
+    # Straight into the room: announcing each join to everyone already there is quadratic
+    room = server.get_room(room_id, create=True)
+    for i in range(size):
+        session = server.new_session(f"{room_id}-user-{i}", f"user{i}", SinkQueue(), None)
+        room.add_member(session)
+        session['rooms'][room_id] = room
+
+
+def fanout_cost(size, count):
+    server = chat_server.ChatServer(history_store=MemoryHistoryStore())
+    fill(server, "room", size)
+    message = chat_pb2.ChatMessage(user_id="poster", username="poster", message="x" * 64)
+    server.handle_client_message(message, "room")  # build the subscriber tuple
+    start = time.perf_counter()
+    for _ in range(count):
+        server.handle_client_message(message, "room")
+    return (time.perf_counter() - start) / count / size
+
+
+def move_cost(size, count):
+    server = chat_server.ChatServer(history_store=MemoryHistoryStore())
+    fill(server, "a", size)
+    fill(server, "b", size)
+    for room_id in ("a", "b"):
+        server.join_room(server.new_session("mover", "mover", SinkQueue(), None), join_message("mover", room_id, chat_pb2.HistoryMode.NONE))
+    session = server.new_session("mover", "mover", SinkQueue(), None)
+    server.join_room(session, join_message("mover", "a", chat_pb2.HistoryMode.NONE))
+    rooms = ("a", "b")
+    start = time.perf_counter()
+    for i in range(count):
+        server.leave_room(session, rooms[i % 2])
+        server.join_room(session, join_message("mover", rooms[(i + 1) % 2], chat_pb2.HistoryMode.NONE))
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--broadcasts', type=int, default=200000,
+                        help="recipient deliveries per room size (broadcasts = this / size)")
+    parser.add_argument('--moves', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'sessions':>8} {'fan-out ns/recipient':>21} {'move us':>8}")
+    for size in args.sizes:
+        fanout = fanout_cost(size, max(10, args.broadcasts // size))
+        move = move_cost(size, args.moves)
+        print(f"{size:>8} {fanout * 1e9:>21.0f} {move * 1e6:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Cost of the metrics: per-update overhead on hot paths and the time to render a scrape.
+
+The scrape is rendered for a server with N registered clients spread over rooms
+(no gRPC streams involved), since client and room metrics are collected at scrape time.
+
+    python benchmarks/metrics_cost.py --clients 1000 10000
+"""
+import argparse
+import threading
+import time
+import timeit
+
+from common import chat_server
+
+import metrics
+from outbox import Outbox
+
+
+def per_call(stmt, number=200000, **names):
+    return min(timeit.repeat(stmt, globals=names, number=number, repeat=5)) / number
+
+
+def hot_path_costs():
+    registry = metrics.Registry()
+    counter = registry.counter('c', 'counter')
+    histogram = registry.histogram('h', 'histogram')
+    plain = threading.Lock()
+    timed = metrics.TimedLock(registry.histogram('w', 'wait'), registry.histogram('hd', 'hold'))
+
+    def with_lock(lock):
+        with lock:
+            pass
+
+    return [
+        ('Counter.inc', per_call('counter.inc()', counter=counter)),
+        ('Histogram.observe', per_call('histogram.observe(0.00042)', histogram=histogram)),
+        ('with threading.Lock', per_call('with_lock(lock)', with_lock=with_lock, lock=plain)),
+        ('with TimedLock', per_call('with_lock(lock)', with_lock=with_lock, lock=timed)),
+    ]
+
+
+def scrape_cost(clients, rooms):
+    server = chat_server.ChatServer()
+    for i in range(clients):
+        room_id = f"room-{i % rooms}"
+        info = server.new_session(f"user-{i}", f"user{i}", Outbox(room_id), None)
+        server.get_room(room_id, create=True).add_member(info)
+    registry = server.metrics.registry
+    start = time.perf_counter()
+    for _ in range(10):
+        text = registry.exposition()
+    return (time.perf_counter() - start) / 10, len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--rooms', type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'hot path':<22} {'ns/call':>8}")
+    for name, seconds in hot_path_costs():
+        print(f"{name:<22} {seconds * 1e9:>8.0f}")
+
+    print()
+    print(f"{'clients':>8} {'rooms':>6} {'scrape ms':>10} {'bytes':>8}")
+    for clients in args.clients:
+        seconds, size = scrape_cost(clients, args.rooms)
+        print(f"{clients:>8} {args.rooms:>6} {seconds * 1000:>10.2f} {size:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""Aggregate delivery throughput of several server processes sharing rooms through the hub.
+
+Starts a hub and W chat server processes on localhost, then client processes that
+join every room with listeners spread round-robin over the servers, so most
+deliveries cross a process boundary. Each room gets one sender; every listener
+waits for all of its room's messages. A single process with the local broker is
+measured first as the baseline.
+
+Scale-out needs spare cores: on a machine with fewer cores than servers plus
+client processes, the extra processes only add relay overhead.
+
+    python benchmarks/multiprocess.py --workers 1 2 4 --rooms 8 --messages 500
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from common import join_message
+
+import grpc
+import chat_pb2
+
+BASE_PORT = 50300
+
+
+def run_hub(path):
+    import hub
+    logging.getLogger('hub').setLevel(logging.WARNING)
+    asyncio.run(hub.serve_hub(path))
+
+
+def run_worker(engine, address, hub_socket):
+    import chat_server
+    from broker import HubBroker
+    from history_store import MemoryHistoryStore
+    logging.getLogger('chat_server').setLevel(logging.WARNING)
+    logging.getLogger('broker').setLevel(logging.WARNING)
+    broker = HubBroker(hub_socket) if hub_socket else None
+    chat_server.serve(engine, address, max_workers=256, queue_size=0,
+                      history_store=MemoryHistoryStore(), broker=broker)
+
+
+async def listen(call, sender_tag, expected):
+    received = 0
+    while received < expected:
+        frame = await call.read()
+        if frame is grpc.aio.EOF:
+            break
+        if frame.startswith(sender_tag):
+            received += 1
+    return received
+
+
+async def client_load(targets, rooms, listeners, count, body_size, barrier):
+    """Join listeners and senders for our rooms, then publish once every client process is ready"""
+    channels = [grpc.aio.insecure_channel(target) for target in targets]
+    join_chat = [
+        chan.stream_stream(
+            '/chat.ChatService/JoinChat',
+            request_serializer=chat_pb2.ChatMessage.SerializeToString,
+            response_deserializer=None
+        )
+        for chan in channels
+    ]
+
+    readers = []
+    senders = []
+    for room in rooms:
+        room_id = f"room-{room}"
+        sender_id = f"sender-{room}"
+        for i in range(listeners):
+            call = join_chat[(room + i) % len(join_chat)]()
+            await call.write(join_message(f"{room_id}-listener-{i}", room_id, chat_pb2.HistoryMode.NONE))
+            readers.append((call, chat_pb2.ChatMessage(user_id=sender_id).SerializeToString()))
+        sender = join_chat[room % len(join_chat)]()
+        await sender.write(join_message(sender_id, room_id, chat_pb2.HistoryMode.NONE))
+        senders.append((sender, sender_id))
+    await asyncio.sleep(1.0)  # let joins and their announcements drain
+
+    await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+    tasks = [asyncio.create_task(listen(call, tag, count)) for call, tag in readers]
+
+    body = "x" * body_size
+
+    async def publish(sender, sender_id):
+        for _ in range(count):
+            await sender.write(chat_pb2.ChatMessage(user_id=sender_id, username=sender_id, message=body))
+
+    await asyncio.gather(*(publish(sender, sender_id) for sender, sender_id in senders))
+    delivered = sum(await asyncio.gather(*tasks))
+    finished = time.time()
+
+    for call, _ in readers:
+        call.cancel()
+    for sender, _ in senders:
+        sender.cancel()
+    for chan in channels:
+        await chan.close()
+    return delivered, finished
+
+
+def run_clients(targets, rooms, listeners, count, body_size, barrier, results):
+    results.put(asyncio.run(client_load(targets, rooms, listeners, count, body_size, barrier)))
+
+
+def wait_ready(targets, timeout=15):
+    for target in targets:
+        with grpc.insecure_channel(target) as channel:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+
+
+def measure(ctx, engine, workers, use_hub, args):
+    processes = []
+    tmp = tempfile.mkdtemp()
+    hub_socket = os.path.join(tmp, 'hub.sock') if use_hub else None
+    targets = [f"localhost:{BASE_PORT + i}" for i in range(workers)]
+    try:
+        if use_hub:
+            processes.append(ctx.Process(target=run_hub, args=(hub_socket,), daemon=True))
+            processes[-1].start()
+            while not os.path.exists(hub_socket):
+                time.sleep(0.05)
+        for target in targets:
+            processes.append(ctx.Process(target=run_worker, args=(engine, target, hub_socket), daemon=True))
+            processes[-1].start()
+        wait_ready(targets)
+
+        barrier = ctx.Barrier(args.client_procs + 1)
+        results = ctx.Queue()
+        clients = []
+        for c in range(args.client_procs):
+            rooms = list(range(c, args.rooms, args.client_procs))
+            clients.append(ctx.Process(target=run_clients, args=(
+                targets, rooms, args.listeners, args.messages, args.body_size, barrier, results)))
+            clients[-1].start()
+        barrier.wait()
+        start = time.time()
+        outcomes = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        for process in reversed(processes):  # servers before the hub
+            process.terminate()
+            process.join()
+        if hub_socket and os.path.exists(hub_socket):
+            os.unlink(hub_socket)
+        os.rmdir(tmp)
+
+    delivered = sum(d for d, _ in outcomes)
+    wall = max(f for _, f in outcomes) - start
+    return delivered, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'))
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--listeners', type=int, default=10, help="listeners per room")
+    parser.add_argument('--messages', type=int, default=500, help="messages per room")
+    parser.add_argument('--body-size', type=int, default=128)
+    parser.add_argument('--client-procs', type=int, default=2)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context('spawn')
+    print(f"{os.cpu_count()} cores")
+    print(f"{'setup':>12} {'delivered':>10} {'seconds':>8} {'msgs/sec':>10}")
+    runs = [('local', 1, False)] + [(f"hub x{w}", w, True) for w in args.workers]
+    for name, workers, use_hub in runs:
+        delivered, wall = measure(ctx, args.engine, workers, use_hub, args)
+        print(f"{name:>12} {delivered:>10} {wall:>8.2f} {delivered / wall:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
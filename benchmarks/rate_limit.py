@@ -0,0 +1,81 @@
+"""Rate limit cost per message on the ingest path.
+
+Drives ChatServer.read_messages (the loop behind every JoinChat stream) directly,
+with one sender posting into a room of N members whose outbound queues only keep
+the latest few messages. "off" has no limits; "on" has per-user and per-room limits
+high enough that nothing is limited, so it shows the cost of the checks alone;
+"flood" has a 10/s user limit under the reject policy, so all but the first
+burst are dropped. "check ns" is RateLimiter.check on its own, over many users.
+
+    python benchmarks/rate_limit.py --members 100 --messages 200000
+"""
+import argparse
+import time
+
+from common import SinkQueue, chat_server
+
+import chat_pb2
+from history_store import MemoryHistoryStore
+from ratelimit import RateLimiter
+
+
+def ingest(limiter, members, count):
+    """Seconds per message for one session's stream of count TEXT messages"""
+    server = chat_server.ChatServer(history_store=MemoryHistoryStore(max_messages=1000), rate_limiter=limiter,
+                                    presence_interval=0)
+    room = server.get_room("room", create=True)
+    for i in range(members):
+        member = server.new_session(f"member-{i}", f"member{i}", SinkQueue(), None)
+        room.add_member(member)
+        member['rooms']["room"] = room
+    sender = server.new_session("sender", "sender", SinkQueue(), None)
+    room.add_member(sender)
+    sender['rooms']["room"] = room
+
+    messages = [chat_pb2.ChatMessage(user_id="sender", username="sender", message="hello there " * 4,
+                                     type=chat_pb2.MessageType.TEXT) for _ in range(count)]
+    start = time.perf_counter()
+    server.read_messages(iter(messages), sender)
+    elapsed = time.perf_counter() - start
+    return elapsed / count, server.metrics.messages_rate_limited.value
+
+
+def check_cost(limiter, users, count):
+    user_ids = [f"user-{i}" for i in range(users)]
+    check = limiter.check
+    start = time.perf_counter()
+    for i in range(count):
+        check(user_ids[i % users], "room")
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=10000, help="distinct senders for the check timing")
+    args = parser.parse_args()
+
+    generous = dict(user_rate=1e9, user_burst=10 ** 9, room_rate=1e9, room_burst=10 ** 9)
+    print(f"one sender, room of {args.members}, {args.messages} messages")
+    print(f"{'limits':<8} {'us/msg':>8} {'limited':>9}")
+    for label, limiter in (
+        ("off", None),
+        ("on", RateLimiter(**generous)),
+        ("flood", RateLimiter(user_rate=10, user_burst=10)),
+    ):
+        per_message, limited = ingest(limiter, args.members, args.messages)
+        print(f"{label:<8} {per_message * 1e6:>8.2f} {limited:>9.0f}")
+
+    print()
+    print(f"{'check':<12} {'ns':>6}   ({args.users} users)")
+    for label, limiter in (
+        ("user", RateLimiter(user_rate=1e9, user_burst=10 ** 9)),
+        ("room", RateLimiter(room_rate=1e9, room_burst=10 ** 9)),
+        ("user + room", RateLimiter(**generous)),
+    ):
+        print(f"{label:<12} {check_cost(limiter, args.users, args.messages) * 1e9:>6.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Multi-room contention: posts/sec and join latency while one room is very busy.
+
+Drives ChatServer directly (no gRPC) with one poster thread per room. Room 0 is a
+hot room with many members; the other rooms are small. A churn thread repeatedly
+joins and leaves a separate idle room and records how long each join+leave takes.
+
+    python benchmarks/room_contention.py --rooms 8 --hot-members 2000 --seconds 5
+"""
+import argparse
+import threading
+import time
+
+from common import SinkQueue, chat_server, join_message
+
+import chat_pb2
+
+
+def join(server, user_id, room_id):
+    return server.open_session(join_message(user_id, room_id), SinkQueue(), None)
+
+
+def poster(server, room_id, stop, counts, index):
+    sent = 0
+    while not stop.is_set():
+        message = chat_pb2.ChatMessage(user_id=f"poster-{room_id}", username="poster", message="hello")
+        server.handle_client_message(message, room_id)
+        sent += 1
+    counts[index] = sent
+
+
+def churner(server, room_id, stop, samples):
+    i = 0
+    while not stop.is_set():
+        user_id = f"churn-{i}"
+        start = time.perf_counter()
+        session = join(server, user_id, room_id)
+        server.cleanup_client(session)
+        samples.append((time.perf_counter() - start) * 1000)
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--members', type=int, default=10, help="members in each small room")
+    parser.add_argument('--hot-members', type=int, default=2000, help="members in the hot room")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    args = parser.parse_args()
+
+    server = chat_server.ChatServer()
+    room_ids = [f"room-{r}" for r in range(args.rooms)]
+    for r, room_id in enumerate(room_ids):
+        for m in range(args.hot_members if r == 0 else args.members):
+            join(server, f"{room_id}-member-{m}", room_id)
+
+    stop = threading.Event()
+    counts = [0] * args.rooms
+    samples = []
+    threads = [
+        threading.Thread(target=poster, args=(server, room_id, stop, counts, r))
+        for r, room_id in enumerate(room_ids)
+    ]
+    for m in range(args.members):
+        join(server, f"idle-member-{m}", "idle")
+    threads.append(threading.Thread(target=churner, args=(server, "idle", stop, samples)))
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    samples.sort()
+    quiet = sum(counts[1:])
+    print(f"hot room posts/sec:    {counts[0] / args.seconds:>10.0f}  ({args.hot_members} members)")
+    print(f"small rooms posts/sec: {quiet / args.seconds:>10.0f}  ({args.rooms - 1} rooms x {args.members} members)")
+    print(f"delivered msgs/sec:    {(counts[0] * args.hot_members + quiet * args.members) / args.seconds:>10.0f}")
+    if samples:
+        print(f"join+leave p50 / p99:  {samples[len(samples) // 2]:.3f} / {samples[int(len(samples) * 0.99)]:.3f} ms"
+              f"  ({len(samples)} cycles)")
+
+
+if __name__ == '__main__':
+    main()
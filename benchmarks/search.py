@@ -0,0 +1,143 @@
+"""Search index: indexing throughput and SearchMessages query latency in a large room.
+
+Publishes N TEXT messages (words drawn from a Zipf-like 20000-word vocabulary)
+into one room of a ChatServer (no gRPC), the way broadcasts are recorded: once
+with the room's search index live, and once into a room nobody has searched, to
+show what indexing adds per message. Then times building an index from the
+store from scratch (what the first search of a room does after a restart), and
+the latency of query kinds over the whole room: "index" is the lookup alone,
+"page" is the SearchMessages page with the matching messages read from the store.
+Last, a first search builds the index again while messages are posted to the
+room every millisecond, and the slowest of those posts is reported: the build
+must not hold up the room.
+
+    python benchmarks/search.py --messages 1000000 --store compact
+"""
+import argparse
+import itertools
+import random
+import threading
+import time
+
+from common import chat_server, percentile
+
+import chat_pb2
+from history_store import CompactHistoryStore, MemoryHistoryStore
+from search_index import SearchIndex
+
+VOCABULARY = 20000
+
+
+def make_vocabulary(rng):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add("".join(rng.choice(letters) for _ in range(rng.randint(2, 9))))
+    return sorted(words, key=lambda _: rng.random())  # rank order: earlier words are more common
+
+
+def make_frames(count, words, rng):
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(words))))
+    frames = []
+    timestamp = int(time.time() * 1000)
+    for _ in range(count):
+        body = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 15)))
+        frames.append(chat_pb2.ChatMessage(user_id="u", username="user", message=body, timestamp=timestamp,
+                                           type=chat_pb2.MessageType.TEXT, room_id="room").SerializeToString())
+    return frames
+
+
+def publish_all(room, frames):
+    start = time.perf_counter()
+    for frame in frames:
+        room.publish(frame, 0)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def publish_during_build(server, room, frames, words):
+    """Publish latencies into room while its first search builds the index from the store"""
+    server.search_index = room.index = SearchIndex(server.history_store)
+    search = threading.Thread(target=server.search_index.search, args=("room", words[0]))
+    frames = itertools.cycle(frames)
+    latencies = []
+    search.start()
+    while search.is_alive():
+        start = time.perf_counter()
+        room.publish(next(frames), 0)
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+    search.join()
+    return latencies
+
+
+def query_kinds(words, rng):
+    """Query generators; words are in rank order"""
+    common, mid, rare = words[:20], words[100:2000], words[5000:]
+    return [
+        ("common word", lambda: rng.choice(common)),
+        ("rare word", lambda: rng.choice(rare)),
+        ("2 words", lambda: f"{rng.choice(common)} {rng.choice(mid)}"),
+        ("3 words", lambda: f"{rng.choice(common)} {rng.choice(common)} {rng.choice(mid)}"),
+        ("prefix", lambda: rng.choice(mid)[:3] + "*"),
+        ("word + prefix", lambda: f"{rng.choice(common)} {rng.choice(mid)[:3]}*"),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=1000000)
+    parser.add_argument('--store', choices=('compact', 'memory'), default='compact')
+    parser.add_argument('--queries', type=int, default=500, help="queries per kind")
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    words = make_vocabulary(rng)
+    frames = make_frames(args.messages, words, rng)
+    store_class = CompactHistoryStore if args.store == 'compact' else MemoryHistoryStore
+    server = chat_server.ChatServer(history_store=store_class(max_messages=args.messages))
+
+    plain = server.get_room("unsearched", create=True)
+    plain_rate = publish_all(plain, frames)
+
+    room = server.get_room("room", create=True)
+    room.publish(frames[0], 0)
+    server.search_index.search("room", words[0])  # from here on the room keeps its index up to date
+    indexed_rate = publish_all(room, frames[1:])
+    tokens, postings = server.search_index.stats()["room"]
+
+    start = time.perf_counter()
+    SearchIndex(server.history_store).search("room", words[0])
+    build_rate = (args.messages) / (time.perf_counter() - start)
+
+    print(f"{args.messages} messages, {args.store} store, {tokens} distinct words, {postings} postings")
+    print(f"record rate, room never searched: {plain_rate:>9.0f} msgs/sec")
+    print(f"record rate, index live:          {indexed_rate:>9.0f} msgs/sec "
+          f"(+{(1 / indexed_rate - 1 / plain_rate) * 1e6:.1f} us/msg)")
+    print(f"index build from the store:       {build_rate:>9.0f} msgs/sec")
+    print()
+    print(f"{'query':<14} {'hits':>6} {'index p50':>10} {'p99 us':>8} {'page p50':>9} {'p99 us':>8}")
+    for name, make_query in query_kinds(words, rng):
+        lookups, pages, hits = [], [], []
+        for _ in range(args.queries):
+            query = make_query()
+            start = time.perf_counter()
+            found = server.search_index.search("room", query, None, args.limit + 1)
+            lookups.append(time.perf_counter() - start)
+            hits.append(min(len(found), args.limit))
+            request = chat_pb2.SearchRequest(room_id="room", query=query, limit=args.limit)
+            start = time.perf_counter()
+            server.search_page(request)
+            pages.append(time.perf_counter() - start)
+        print(f"{name:<14} {sum(hits) / len(hits):>6.1f} {percentile(lookups, 0.5) * 1e6:>10.0f} "
+              f"{percentile(lookups, 0.99) * 1e6:>8.0f} {percentile(pages, 0.5) * 1e6:>9.0f} "
+              f"{percentile(pages, 0.99) * 1e6:>8.0f}")
+
+    latencies = publish_during_build(server, room, frames, words)
+    print()
+    print(f"posts during a first search: {len(latencies)}, p50 {percentile(latencies, 0.5) * 1e3:.2f} ms, "
+          f"max {max(latencies) * 1e3:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Slow consumer: one client never reads while the rest of the room keeps up.
+
+For each overflow policy, a stalled client joins a room next to a few live
+receivers and a sender that publishes at a fixed rate. Reports receiver latency
+for the first and second half of the run (they should match), and the stalled
+client's outbound queue depth and drop count from ChatServer.client_stats().
+
+    python benchmarks/slow_consumer.py --messages 5000 --rate 2000
+"""
+import argparse
+import asyncio
+import time
+
+from common import InProcessServer, join_message, percentile
+
+import grpc
+import chat_pb2
+import outbox
+
+
+async def discard(call):
+    """Keep reading so the sender itself is not a slow consumer"""
+    while await call.read() is not grpc.aio.EOF:
+        pass
+
+
+async def receive(call, sent_at, count, samples):
+    """Record latency for each of the sender's messages, by index"""
+    seen = 0
+    while seen < count:
+        message = await call.read()
+        if message is grpc.aio.EOF:
+            break
+        if message.type == chat_pb2.MessageType.TEXT and message.user_id == "sender":
+            index = int(message.message.split(" ", 1)[0])
+            samples.append((index, (time.perf_counter() - sent_at[index]) * 1000))
+            seen += 1
+
+
+async def measure(server, count, rate, receivers, body_size):
+    room_id = "slow"
+    async with grpc.aio.insecure_channel(server.target) as channel:
+        join_chat = channel.stream_stream(
+            '/chat.ChatService/JoinChat',
+            request_serializer=chat_pb2.ChatMessage.SerializeToString,
+            response_deserializer=chat_pb2.ChatMessage.FromString
+        )
+        stalled = join_chat()
+        await stalled.write(join_message("stalled", room_id))
+
+        live = []
+        for i in range(receivers):
+            call = join_chat()
+            await call.write(join_message(f"receiver-{i}", room_id))
+            live.append(call)
+        sender = join_chat()
+        await sender.write(join_message("sender", room_id))
+        drain = asyncio.create_task(discard(sender))
+        await asyncio.sleep(0.2)
+
+        sent_at = [0.0] * count
+        samples = []
+        readers = [asyncio.create_task(receive(call, sent_at, count, samples)) for call in live]
+        padding = "x" * body_size
+        interval = 1.0 / rate
+        start = time.perf_counter()
+        for i in range(count):
+            # Pace against the schedule rather than sleeping a fixed interval
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            sent_at[i] = time.perf_counter()
+            await sender.write(chat_pb2.ChatMessage(user_id="sender", username="sender", message=f"{i} {padding}"))
+        await asyncio.wait_for(asyncio.gather(*readers), timeout=30)
+
+        stats = {s['user_id']: s for s in server.chat_server.client_stats()}
+        for call in live + [sender, stalled]:
+            call.cancel()
+        drain.cancel()
+
+    first = sorted(latency for index, latency in samples if index < count // 2)
+    second = sorted(latency for index, latency in samples if index >= count // 2)
+    return first, second, stats.get("stalled")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--engine', default='asyncio', choices=('threaded', 'asyncio'))
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--rate', type=float, default=2000, help="messages/sec from the sender")
+    parser.add_argument('--receivers', type=int, default=4)
+    parser.add_argument('--body-size', type=int, default=1024)
+    parser.add_argument('--queue-size', type=int, default=256)
+    args = parser.parse_args()
+
+    print(f"{'policy':<12} {'1st half p50/p99 ms':>20} {'2nd half p50/p99 ms':>20} {'stalled depth':>14} {'dropped':>8}")
+    for policy in outbox.OVERFLOW_POLICIES:
+        with InProcessServer(args.engine, queue_size=args.queue_size, overflow_policy=policy) as server:
+            first, second, stalled = server.run(
+                measure(server, args.messages, args.rate, args.receivers, args.body_size))
+        depth, dropped = (stalled['queue_depth'], stalled['dropped']) if stalled else ('gone', '-')
+        print(f"{policy:<12} {percentile(first, 0.5):>9.2f} / {percentile(first, 0.99):>7.2f} "
+              f"{percentile(second, 0.5):>9.2f} / {percentile(second, 0.99):>7.2f} {depth:>14} {dropped:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Load test: how many concurrent JoinChat streams each server engine actually accepts.
+
+Opens N idle streams against an in-process server and counts how many the server
+has registered once things settle. The threaded engine stops at max_workers; the
+asyncio engine should accept all of them.
+
+    python benchmarks/stream_capacity.py --streams 2000
+"""
+import argparse
+import asyncio
+import time
+
+from common import InProcessServer, chat_server
+
+import grpc
+import chat_pb2
+import chat_pb2_grpc
+
+
+async def open_streams(target, count, channels, rooms):
+    """Open count streams spread over a few channels; returns (channels, calls)"""
+    chans = [grpc.aio.insecure_channel(target) for _ in range(channels)]
+    calls = []
+    for i in range(count):
+        stub = chat_pb2_grpc.ChatServiceStub(chans[i % channels])
+        call = stub.JoinChat()
+        join = chat_pb2.ChatMessage(
+            user_id=f"user-{i}",
+            username=f"user{i}",
+            type=chat_pb2.MessageType.JOIN,
+            room_id=f"capacity-{i % rooms}"
+        )
+        try:
+            await asyncio.wait_for(call.write(join), timeout=1.0)
+        except asyncio.TimeoutError:
+            pass
+        calls.append(call)
+    return chans, calls
+
+
+def registered(server):
+    return len(server.chat_server.clients)
+
+
+async def measure(server, count, channels, rooms, settle):
+    start = time.perf_counter()
+    chans, calls = await open_streams(server.target, count, channels, rooms)
+
+    # Wait until the registered count stops growing
+    accepted = -1
+    deadline = time.perf_counter() + settle
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.2)
+        now = registered(server)
+        if now == count or now == accepted:
+            break
+        accepted = now
+    accepted = registered(server)
+    elapsed = time.perf_counter() - start
+
+    for call in calls:
+        call.cancel()
+    for chan in chans:
+        await chan.close()
+    return accepted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=16)
+    parser.add_argument('--rooms', type=int, default=100,
+                        help="spread streams over rooms so join broadcasts don't dominate")
+    parser.add_argument('--max-workers', type=int, default=10)
+    parser.add_argument('--settle', type=float, default=5.0, help="seconds to wait for registrations")
+    args = parser.parse_args()
+
+    print(f"{'engine':<10} {'requested':>10} {'accepted':>10} {'seconds':>8}")
+    for engine in chat_server.ENGINES:
+        with InProcessServer(engine, max_workers=args.max_workers) as server:
+            accepted, elapsed = server.run(measure(server, args.streams, args.channels, args.rooms, args.settle))
+        print(f"{engine:<10} {args.streams:>10} {accepted:>10} {elapsed:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,8 @@ import threading
 import time
 import sys
 import os
+import queue
+import random
 import uuid
 
 # Add pbs files to path
@@ -11,110 +13,320 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
 import chat_pb2
 import chat_pb2_grpc
 
+RECONNECT_INITIAL_DELAY = 0.5  # seconds; doubles per failed attempt, with jitter
+RECONNECT_MAX_DELAY = 30.0
+COMPRESSION_ALGORITHMS = {
+    'none': grpc.Compression.NoCompression,
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+}
+
 
 class ChatClient:
-    def __init__(self, server_address='localhost:50051'):
+    def __init__(self, server_address='localhost:50051', batched=False, compression='none'):
         self.server_address = server_address
+        self.batched = batched  # use JoinChatBatched instead of JoinChat
+        # What this client sends; the server picks the compression of what it receives
+        self.compression = COMPRESSION_ALGORITHMS[compression]
         self.user_id = str(uuid.uuid4())
         self.username = None
-        self.room_id = "general"
+        self.room_id = "general"  # room typed messages go to
+        self.rooms = []  # rooms this stream is in, in join order
         self.channel = None
         self.stub = None
         self.stream = None
         self.running = False
+        self.history = None  # HistoryPreference sent when joining
+        self.oldest_timestamp = None  # oldest message shown, for paging history
+        self.history_cursor = None
+        self.history_exhausted = False
+        self.last_seqs = {}  # room_id -> highest seq received, for resuming after a drop
+        self.retry_after = None  # seconds to wait before reconnecting, when a restarting server says so
+        self.outgoing = queue.Queue()  # typed messages, kept across reconnects
+        self.unsent = None  # taken off outgoing but not known to be sent; the next stream sends it first
         
-    def connect(self, username, room_id="general"):
+    def connect(self, username, room_id="general", history=None):
         """Connect to the chat server"""
         self.username = username
         self.room_id = room_id
+        self.rooms = [room_id]
+        self.history = history
         
         try:
-            # Create gRPC channel
-            self.channel = grpc.insecure_channel(self.server_address)
+            # One channel for the whole session; it reconnects underneath each new stream
+            self.channel = grpc.insecure_channel(self.server_address, options=[
+                ('grpc.initial_reconnect_backoff_ms', int(RECONNECT_INITIAL_DELAY * 1000)),
+                ('grpc.max_reconnect_backoff_ms', int(RECONNECT_MAX_DELAY * 1000)),
+            ], compression=self.compression)
             self.stub = chat_pb2_grpc.ChatServiceStub(self.channel)
             
             print(f"[CLIENT] Connecting to {self.server_address} as {username}")
             print(f"[CLIENT] Joining room: {room_id}")
-            print("[CLIENT] Type messages and press Enter. Type '/quit' to exit.")
+            print("[CLIENT] Type messages and press Enter. Type '/history' for older messages, "
+                  "'/search WORDS' to search the room, '/join ROOM' or '/leave [ROOM]' to change rooms, "
+                  "'/quit' to exit.")
             print("-" * 50)
             
-            # Start the bidirectional stream
+            # Start the bidirectional stream, resuming it whenever it drops
             self.start_chat()
             
         except Exception as e:
             print(f"[CLIENT] Connection error: {e}")
     
     def start_chat(self):
-        """Start the bidirectional streaming chat"""
+        """Run the chat, reconnecting with exponential backoff until the user quits"""
         self.running = True
-        
-        def message_generator():
-            """Generator for outgoing messages"""
-            # Send initial join message
-            join_message = chat_pb2.ChatMessage(
-                user_id=self.user_id,
-                username=self.username,
-                message="",
-                timestamp=int(time.time() * 1000),
-                type=chat_pb2.MessageType.JOIN,
-                room_id=self.room_id
-            )
-            yield join_message
-            
-            # Handle user input
+
+        # Input is read on its own thread so typing survives reconnects
+        input_thread = threading.Thread(target=self.read_input, daemon=True)
+        input_thread.start()
+
+        delay = RECONNECT_INITIAL_DELAY
+        try:
             while self.running:
-                try:
-                    user_input = input()
-                    
-                    if user_input.lower() in ['/quit', '/exit', '/q']:
-                        # Send leave message
-                        leave_message = chat_pb2.ChatMessage(
-                            user_id=self.user_id,
-                            username=self.username,
-                            message="",
-                            timestamp=int(time.time() * 1000),
-                            type=chat_pb2.MessageType.LEAVE,
-                            room_id=self.room_id
-                        )
-                        yield leave_message
-                        break
-                    
-                    if user_input.strip():  # Only send non-empty messages
-                        message = chat_pb2.ChatMessage(
-                            user_id=self.user_id,
-                            username=self.username,
-                            message=user_input,
-                            timestamp=int(time.time() * 1000),
-                            type=chat_pb2.MessageType.TEXT,
-                            room_id=self.room_id
-                        )
-                        yield message
-                        
-                except EOFError:
-                    # Handle Ctrl+D
-                    break
-                except KeyboardInterrupt:
-                    # Handle Ctrl+C
+                connected = self.run_stream()
+                if not self.running:
                     break
-        
+                if connected:
+                    # The last attempt got through; start backing off from scratch
+                    delay = RECONNECT_INITIAL_DELAY
+                if self.retry_after is not None:
+                    # The server is restarting and spreads its clients' reconnects; it said when
+                    time.sleep(self.retry_after)
+                    self.retry_after = None
+                    continue
+                wait = random.uniform(delay / 2, delay)
+                print(f"[CLIENT] Connection lost; reconnecting in {wait:.1f}s")
+                time.sleep(wait)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.disconnect()
+
+    def read_input(self):
+        """Queue lines typed by the user; None tells the stream to finish"""
+        while self.running:
+            try:
+                user_input = input()
+            except (EOFError, KeyboardInterrupt):
+                # Ctrl+D / Ctrl+C
+                self.outgoing.put(None)
+                return
+
+            if user_input.lower() in ['/quit', '/exit', '/q']:
+                # Send leave message; without a room_id it leaves every room and ends the stream
+                self.outgoing.put(chat_pb2.ChatMessage(
+                    user_id=self.user_id,
+                    username=self.username,
+                    message="",
+                    timestamp=int(time.time() * 1000),
+                    type=chat_pb2.MessageType.LEAVE
+                ))
+                return
+
+            if user_input.lower() == '/history':
+                self.show_older_history()
+                continue
+
+            command, _, argument = user_input.partition(' ')
+            if command.lower() == '/search' and argument.strip():
+                self.search(argument.strip())
+                continue
+            if command.lower() == '/join' and argument.strip():
+                self.join_room(argument.strip())
+                continue
+            if command.lower() == '/leave':
+                self.leave_room(argument.strip() or self.room_id)
+                continue
+
+            if user_input.strip():  # Only send non-empty messages
+                self.outgoing.put(chat_pb2.ChatMessage(
+                    user_id=self.user_id,
+                    username=self.username,
+                    message=user_input,
+                    timestamp=int(time.time() * 1000),
+                    type=chat_pb2.MessageType.TEXT,
+                    room_id=self.room_id
+                ))
+
+    def join_room(self, room_id):
+        """Join another room on the open stream; typed messages go there from now on"""
+        if room_id not in self.rooms:
+            self.rooms.append(room_id)
+        self.room_id = room_id
+        # History paging restarts in the new room
+        self.oldest_timestamp = None
+        self.history_cursor = None
+        self.history_exhausted = False
+        self.outgoing.put(self.join_message(room_id))
+        print(f"[CLIENT] Now in room: {room_id}")
+
+    def leave_room(self, room_id):
+        """Leave one room but keep the stream; use /quit to leave the last one"""
+        if room_id not in self.rooms:
+            print(f"[CLIENT] Not in room: {room_id}")
+            return
+        if len(self.rooms) == 1:
+            print("[CLIENT] That is your only room; use /quit to exit")
+            return
+        self.rooms.remove(room_id)
+        self.outgoing.put(chat_pb2.ChatMessage(
+            user_id=self.user_id,
+            username=self.username,
+            message="",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.LEAVE,
+            room_id=room_id
+        ))
+        if room_id == self.room_id:
+            self.join_room(self.rooms[-1])
+
+    def join_message(self, room_id):
+        """JOIN for a room; after a drop it asks only for what was missed"""
+        history = self.history
+        if room_id in self.last_seqs:
+            history = chat_pb2.HistoryPreference(
+                mode=chat_pb2.HistoryMode.SINCE, since_seq=self.last_seqs[room_id])
+        return chat_pb2.ChatMessage(
+            user_id=self.user_id,
+            username=self.username,
+            message="",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.JOIN,
+            room_id=room_id,
+            history=history
+        )
+
+    def run_stream(self):
+        """One JoinChat stream; returns True if it delivered anything before ending"""
+        stream_done = threading.Event()
+        taking = threading.Lock()  # held while the generator takes a message off outgoing
+
+        def message_generator():
+            """Generator for outgoing messages"""
+            # The room typed messages go to is joined last, so it is also the server's default
+            for room_id in self.rooms:
+                if room_id != self.room_id:
+                    yield self.join_message(room_id)
+            yield self.join_message(self.room_id)
+
+            while not stream_done.is_set():
+                message = self.unsent
+                if message is None:
+                    with taking:
+                        if stream_done.is_set():
+                            return
+                        try:
+                            message = self.outgoing.get(timeout=0.5)
+                        except queue.Empty:
+                            continue
+                        if message is None:
+                            self.running = False
+                            return
+                        self.unsent = message
+                        if stream_done.is_set():
+                            return
+                # gRPC asks for the next message once this one is written; a stream
+                # that ends first leaves it in unsent
+                yield message
+                self.unsent = None
+                if message.type == chat_pb2.MessageType.LEAVE and not message.room_id:
+                    self.running = False
+                    return
+
+        connected = False
         try:
-            # Start the bidirectional stream
-            self.stream = self.stub.JoinChat(message_generator())
-            
+            # While the server is down the channel backs off on its own; wait for it
+            # rather than failing fast
+            join_chat = self.stub.JoinChatBatched if self.batched else self.stub.JoinChat
+            self.stream = join_chat(message_generator(), wait_for_ready=True)
+
             # Handle incoming messages
             for response in self.stream:
-                self.handle_incoming_message(response)
-                
+                if not connected and self.last_seqs:
+                    print("[CLIENT] Reconnected")
+                connected = True
+                for message in (response.messages if self.batched else (response,)):
+                    if message.seq:
+                        # Resume replays start right after this, so nothing is shown twice
+                        self.last_seqs[message.room_id] = message.seq
+                    elif message.retry_after_ms:
+                        self.retry_after = message.retry_after_ms / 1000
+                    self.handle_incoming_message(message)
+
         except grpc.RpcError as e:
-            print(f"[CLIENT] gRPC error: {e}")
+            if self.running:
+                print(f"[CLIENT] gRPC error: {e.code().name}: {e.details()}")
         except Exception as e:
             print(f"[CLIENT] Error: {e}")
         finally:
-            self.disconnect()
-    
+            stream_done.set()
+            # Let a get() in progress finish, so nothing is taken for this stream after it
+            with taking:
+                pass
+        return connected
+
+    def show_older_history(self, limit=20):
+        """Fetch and print the page of room history before the oldest message shown"""
+        if self.history_exhausted:
+            print("[CLIENT] No older messages")
+            return
+
+        request = chat_pb2.HistoryRequest(room_id=self.room_id, limit=limit)
+        if self.history_cursor is not None:
+            request.cursor = self.history_cursor
+        elif self.oldest_timestamp is not None:
+            request.before_ts = self.oldest_timestamp
+
+        try:
+            # A few bytes: not worth the channel's compression
+            page = self.stub.GetHistory(request, compression=grpc.Compression.NoCompression)
+        except grpc.RpcError as e:
+            print(f"[CLIENT] Could not fetch history: {e.details()}")
+            return
+
+        self.history_cursor = page.next_cursor
+        self.history_exhausted = not page.has_more
+        if not page.messages:
+            print("[CLIENT] No older messages")
+            return
+
+        print(f"--- Older messages in {self.room_id} ---")
+        for message in page.messages:
+            self.handle_incoming_message(message)
+        print("--- End of older messages ---")
+
+    def search(self, query, limit=20):
+        """Print the newest messages of the current room matching query"""
+        try:
+            request = chat_pb2.SearchRequest(room_id=self.room_id, query=query, limit=limit)
+            page = self.stub.SearchMessages(request, compression=grpc.Compression.NoCompression)
+        except grpc.RpcError as e:
+            print(f"[CLIENT] Search failed: {e.details()}")
+            return
+
+        if not page.messages:
+            print(f"[CLIENT] No messages in {self.room_id} match '{query}'")
+            return
+        more = " (older matches not shown)" if page.has_more else ""
+        print(f"--- Messages in {self.room_id} matching '{query}'{more} ---")
+        oldest = self.oldest_timestamp
+        for message in page.messages:
+            self.handle_incoming_message(message)
+        self.oldest_timestamp = oldest  # search results don't move /history paging
+        print("--- End of search results ---")
+
     def handle_incoming_message(self, message):
         """Handle incoming messages from server"""
+        if message.type != chat_pb2.MessageType.SYSTEM:
+            if self.oldest_timestamp is None or message.timestamp < self.oldest_timestamp:
+                self.oldest_timestamp = message.timestamp
+
         timestamp = time.strftime('%H:%M:%S', time.localtime(message.timestamp / 1000))
+        if message.room_id and message.room_id != self.room_id:
+            # From one of the other rooms this stream is in
+            timestamp = f"{timestamp} #{message.room_id}"
         
         if message.type == chat_pb2.MessageType.TEXT:
             print(f"[{timestamp}] {message.username}: {message.message}")
@@ -134,15 +346,27 @@ class ChatClient:
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python chat_client.py <username> [room_id] [server_address]")
+    # --batched receives messages through JoinChatBatched
+    batched = '--batched' in sys.argv
+    if batched:
+        sys.argv.remove('--batched')
+    # --compression gzip|deflate compresses what the client sends
+    compression = 'none'
+    if '--compression' in sys.argv:
+        i = sys.argv.index('--compression')
+        compression = sys.argv[i + 1] if i + 1 < len(sys.argv) else ''
+        del sys.argv[i:i + 2]
+
+    if len(sys.argv) < 2 or compression not in COMPRESSION_ALGORITHMS:
+        print("Usage: python chat_client.py <username> [room_id] [server_address] [--batched] "
+              "[--compression gzip|deflate]")
         sys.exit(1)
     
     username = sys.argv[1]
     room_id = sys.argv[2] if len(sys.argv) > 2 else "general"
     server_address = sys.argv[3] if len(sys.argv) > 3 else "localhost:50051"
     
-    client = ChatClient(server_address)
+    client = ChatClient(server_address, batched, compression)
     
     try:
         client.connect(username, room_id)
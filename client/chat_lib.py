@@ -0,0 +1,288 @@
+"""Async client library: many chat sessions over a few shared channels.
+
+For bots and gateways that act for many users at once. ChatClient (chat_client.py)
+is the interactive CLI: one channel and a few threads per user. Here a ChatPool
+holds a handful of grpc.aio channels to one server, and every ChatSession (one
+user's JoinChat stream) is a stream on one of them, so thousands of sessions
+cost thousands of HTTP/2 streams and asyncio tasks, not connections and threads.
+
+    async with ChatPool("localhost:50051", channels=4) as pool:
+        session = await pool.open_session(user_id, "alice", rooms=["general"])
+        session.send("hello")
+        async for message in session:
+            print(message.username, message.message)
+
+Incoming messages are read from the session as an async iterator, or handed
+to an on_message callback (a function or a coroutine function) instead.
+Sessions reconnect on their own like ChatClient does, rejoining each room
+with SINCE their last seq, and when a draining server tells them to.
+"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+import grpc
+
+# Add pbs files to path
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import chat_pb2
+import chat_pb2_grpc
+from chat_client import COMPRESSION_ALGORITHMS, RECONNECT_INITIAL_DELAY, RECONNECT_MAX_DELAY
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()  # tells a session's request stream to end
+
+
+class ChatPool:
+    """A few channels to one server, shared by every session opened through the pool
+
+    Each channel is its own TCP connection; a new session goes to the channel
+    carrying the fewest. grpc.aio objects belong to the event loop they are
+    created on, so use a pool from one loop only.
+    """
+
+    def __init__(self, target, channels=4, compression='none', batched=False):
+        self.target = target
+        self.batched = batched  # default for sessions: JoinChatBatched instead of JoinChat
+        self.compression = COMPRESSION_ALGORITHMS[compression]  # what sessions send
+        self._channels = [
+            grpc.aio.insecure_channel(target, options=[
+                # Otherwise channels with the same target and options share one connection
+                ('grpc.use_local_subchannel_pool', 1),
+                ('grpc.initial_reconnect_backoff_ms', int(RECONNECT_INITIAL_DELAY * 1000)),
+                ('grpc.max_reconnect_backoff_ms', int(RECONNECT_MAX_DELAY * 1000)),
+            ], compression=self.compression)
+            for _ in range(max(channels, 1))
+        ]
+        self._stubs = [chat_pb2_grpc.ChatServiceStub(channel) for channel in self._channels]
+        self._load = [0] * len(self._channels)  # open streams per channel
+        self.sessions = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def acquire(self):
+        """(index, stub) of the least busy channel, for one stream"""
+        index = min(range(len(self._load)), key=self._load.__getitem__)
+        self._load[index] += 1
+        return index, self._stubs[index]
+
+    def release(self, index):
+        self._load[index] -= 1
+
+    def channel_load(self):
+        """Open streams per channel"""
+        return list(self._load)
+
+    async def open_session(self, user_id, username, rooms=("general",), history=None, on_message=None,
+                           batched=None):
+        """Start a user's session in rooms; messages go to the last room unless sent elsewhere
+
+        history is the HistoryPreference for the first join of each room.
+        """
+        session = ChatSession(self, user_id, username, rooms, history, on_message,
+                              self.batched if batched is None else batched)
+        self.sessions.add(session)
+        session.start()
+        return session
+
+    async def history(self, room_id, limit=50, cursor=0, before_ts=0):
+        """One GetHistory page (oldest first); pass its next_cursor back for older messages"""
+        _, stub = min(zip(self._load, self._stubs), key=lambda pair: pair[0])
+        request = chat_pb2.HistoryRequest(room_id=room_id, limit=limit, cursor=cursor, before_ts=before_ts)
+        return await stub.GetHistory(request, compression=grpc.Compression.NoCompression)
+
+    async def search(self, room_id, query, limit=20, cursor=0):
+        """One SearchMessages page of the newest matches (oldest first)"""
+        _, stub = min(zip(self._load, self._stubs), key=lambda pair: pair[0])
+        request = chat_pb2.SearchRequest(room_id=room_id, query=query, limit=limit, cursor=cursor)
+        return await stub.SearchMessages(request, compression=grpc.Compression.NoCompression)
+
+    async def close(self, timeout=5.0):
+        """Leave every session, then close the channels"""
+        sessions = list(self.sessions)
+        if sessions:
+            await asyncio.gather(*(session.close(timeout) for session in sessions))
+        for channel in self._channels:
+            await channel.close()
+
+
+class ChatSession:
+    """One user's JoinChat stream on a pooled channel.
+
+    send() and send_many() only queue messages; the stream writes them back to
+    back in the background, so a burst goes out without a round trip per message.
+    """
+
+    def __init__(self, pool, user_id, username, rooms, history=None, on_message=None, batched=False):
+        self.pool = pool
+        self.user_id = user_id
+        self.username = username
+        self.rooms = list(rooms)  # in join order; the last is where send() posts by default
+        if not self.rooms:
+            raise ValueError("A session needs at least one room")
+        self.history = history  # HistoryPreference for first joins
+        self.on_message = on_message
+        self.batched = batched
+        self.last_seqs = {}  # room_id -> highest seq received, for resuming after a drop
+        self.retry_after = None  # seconds to wait before reconnecting, when a restarting server says so
+        self.connected = False
+        self.closed = False
+        self._outgoing = asyncio.Queue()  # messages for the server, kept across reconnects
+        self._unsent = None  # taken off _outgoing but not written yet; the next stream sends it first
+        self._incoming = asyncio.Queue() if on_message is None else None
+        self._call = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name=f"chat-session-{self.user_id}")
+
+    def message(self, message_type, text="", room_id="", history=None):
+        return chat_pb2.ChatMessage(
+            user_id=self.user_id,
+            username=self.username,
+            message=text,
+            timestamp=int(time.time() * 1000),
+            type=message_type,
+            room_id=room_id,
+            history=history
+        )
+
+    def send(self, text, room_id=None):
+        """Queue a text message for room_id, or for the room joined last"""
+        self._outgoing.put_nowait(self.message(chat_pb2.TEXT, text, room_id or self.rooms[-1]))
+
+    def send_many(self, texts, room_id=None):
+        """Queue several text messages for one room; they are written back to back"""
+        room_id = room_id or self.rooms[-1]
+        put = self._outgoing.put_nowait
+        for text in texts:
+            put(self.message(chat_pb2.TEXT, text, room_id))
+
+    def join(self, room_id, history=None):
+        """Join another room on this stream; send() posts there from now on"""
+        if room_id in self.rooms:
+            self.rooms.remove(room_id)
+        self.rooms.append(room_id)
+        self._outgoing.put_nowait(self.join_message(room_id, history))
+
+    def leave(self, room_id):
+        """Leave one room; close() ends the session"""
+        if room_id not in self.rooms or len(self.rooms) == 1:
+            raise ValueError(f"Cannot leave '{room_id}': not in it, or it is the session's only room")
+        self.rooms.remove(room_id)
+        self._outgoing.put_nowait(self.message(chat_pb2.LEAVE, room_id=room_id))
+
+    def join_message(self, room_id, history=None):
+        """JOIN for a room; after a drop it asks only for what was missed"""
+        if room_id in self.last_seqs:
+            history = chat_pb2.HistoryPreference(
+                mode=chat_pb2.HistoryMode.SINCE, since_seq=self.last_seqs[room_id])
+        return self.message(chat_pb2.JOIN, room_id=room_id, history=history or self.history)
+
+    def __aiter__(self):
+        if self._incoming is None:
+            raise TypeError("Messages of this session go to its on_message callback")
+        return self
+
+    async def __anext__(self):
+        message = await self._incoming.get()
+        if message is None:
+            self._incoming.put_nowait(None)  # for anyone else iterating
+            raise StopAsyncIteration
+        return message
+
+    async def _write(self, call):
+        """What one stream sends: a JOIN per room, then whatever is queued
+
+        Runs as its own task, cancelled when the stream ends, so it never takes
+        a message off the queue for a stream that is already gone.
+        """
+        for room_id in self.rooms:
+            await call.write(self.join_message(room_id))
+        get = self._outgoing.get
+        while True:
+            if self._unsent is None:
+                self._unsent = await get()
+            message = self._unsent
+            if message is _CLOSE:
+                await call.write(self.message(chat_pb2.LEAVE))  # no room_id: ends the stream
+                await call.done_writing()
+                return
+            await call.write(message)
+            self._unsent = None
+
+    async def _dispatch(self, message):
+        if message.seq:
+            # Resume replays start right after this, so nothing is delivered twice
+            self.last_seqs[message.room_id] = message.seq
+        elif message.retry_after_ms:
+            self.retry_after = message.retry_after_ms / 1000
+        if self._incoming is not None:
+            self._incoming.put_nowait(message)
+            return
+        try:
+            result = self.on_message(message)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception:
+            logger.exception(f"on_message failed for {self.username} ({self.user_id})")
+
+    async def _run(self):
+        delay = RECONNECT_INITIAL_DELAY
+        try:
+            while not self.closed:
+                index, stub = self.pool.acquire()
+                join_chat = stub.JoinChatBatched if self.batched else stub.JoinChat
+                # While the server is down the channel backs off on its own; wait for it
+                self._call = join_chat(wait_for_ready=True)
+                writer = asyncio.create_task(self._write(self._call))
+                try:
+                    async for response in self._call:
+                        self.connected = True
+                        delay = RECONNECT_INITIAL_DELAY
+                        for message in (response.messages if self.batched else (response,)):
+                            await self._dispatch(message)
+                except grpc.aio.AioRpcError:
+                    pass
+                finally:
+                    self.connected = False
+                    writer.cancel()
+                    # A write to the ended stream fails; what it was writing stays in _unsent
+                    await asyncio.gather(writer, return_exceptions=True)
+                    self.pool.release(index)
+                if self.closed:
+                    break
+                if self.retry_after is not None:
+                    # The server is restarting and spreads its clients' reconnects; it said when
+                    await asyncio.sleep(self.retry_after)
+                    self.retry_after = None
+                    continue
+                # The server ended the stream or it dropped: resume after a jittered backoff
+                await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        finally:
+            self.closed = True
+            self.pool.sessions.discard(self)
+            if self._incoming is not None:
+                self._incoming.put_nowait(None)
+
+    async def close(self, timeout=5.0):
+        """Leave every room and end the stream, waiting up to timeout for the server"""
+        if self._task is None or self._task.done():
+            return
+        self.closed = True
+        self._outgoing.put_nowait(_CLOSE)
+        done, _ = await asyncio.wait([self._task], timeout=timeout)
+        if not done:
+            # The server did not answer, or the session is waiting to reconnect
+            self._task.cancel()
+            await asyncio.wait([self._task])
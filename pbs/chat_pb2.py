@@ -24,17 +24,29 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\x04\x63hat\"\x86\x01\n\x0b\x43hatMessage\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x11\n\ttimestamp\x18\x04 \x01(\x03\x12\x1f\n\x04type\x18\x05 \x01(\x0e\x32\x11.chat.MessageType\x12\x0f\n\x07room_id\x18\x06 \x01(\t*8\n\x0bMessageType\x12\x08\n\x04TEXT\x10\x00\x12\x08\n\x04JOIN\x10\x01\x12\t\n\x05LEAVE\x10\x02\x12\n\n\x06SYSTEM\x10\x03\x32\x43\n\x0b\x43hatService\x12\x34\n\x08JoinChat\x12\x11.chat.ChatMessage\x1a\x11.chat.ChatMessage(\x01\x30\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\nchat.proto\x12\x04\x63hat\"\xd5\x01\n\x0b\x43hatMessage\x12\x0f\n\x07user_id\x18\x01 \x01(\t\x12\x10\n\x08username\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\x12\x11\n\ttimestamp\x18\x04 \x01(\x03\x12\x1f\n\x04type\x18\x05 \x01(\x0e\x32\x11.chat.MessageType\x12\x0f\n\x07room_id\x18\x06 \x01(\t\x12(\n\x07history\x18\x07 \x01(\x0b\x32\x17.chat.HistoryPreference\x12\x0b\n\x03seq\x18\x08 \x01(\x03\x12\x16\n\x0eretry_after_ms\x18\t \x01(\x05\"3\n\x0cMessageBatch\x12#\n\x08messages\x18\x01 \x03(\x0b\x32\x11.chat.ChatMessage\"h\n\x11HistoryPreference\x12\x1f\n\x04mode\x18\x01 \x01(\x0e\x32\x11.chat.HistoryMode\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\x10\n\x08since_ts\x18\x03 \x01(\x03\x12\x11\n\tsince_seq\x18\x04 \x01(\x03\"S\n\x0eHistoryRequest\x12\x0f\n\x07room_id\x18\x01 \x01(\t\x12\x11\n\tbefore_ts\x18\x02 \x01(\x03\x12\r\n\x05limit\x18\x03 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x04 \x01(\x03\"Y\n\x0bHistoryPage\x12#\n\x08messages\x18\x01 \x03(\x0b\x32\x11.chat.ChatMessage\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\x03\x12\x10\n\x08has_more\x18\x03 \x01(\x08\"N\n\rSearchRequest\x12\x0f\n\x07room_id\x18\x01 \x01(\t\x12\r\n\x05query\x18\x02 \x01(\t\x12\r\n\x05limit\x18\x03 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x04 \x01(\x03*8\n\x0bMessageType\x12\x08\n\x04TEXT\x10\x00\x12\x08\n\x04JOIN\x10\x01\x12\t\n\x05LEAVE\x10\x02\x12\n\n\x06SYSTEM\x10\x03*,\n\x0bHistoryMode\x12\x08\n\x04LAST\x10\x00\x12\x08\n\x04NONE\x10\x01\x12\t\n\x05SINCE\x10\x02\x32\xf2\x01\n\x0b\x43hatService\x12\x34\n\x08JoinChat\x12\x11.chat.ChatMessage\x1a\x11.chat.ChatMessage(\x01\x30\x01\x12<\n\x0fJoinChatBatched\x12\x11.chat.ChatMessage\x1a\x12.chat.MessageBatch(\x01\x30\x01\x12\x35\n\nGetHistory\x12\x14.chat.HistoryRequest\x1a\x11.chat.HistoryPage\x12\x38\n\x0eSearchMessages\x12\x13.chat.SearchRequest\x1a\x11.chat.HistoryPageb\x06proto3')
 
 _globals = globals()
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'chat_pb2', _globals)
 if not _descriptor._USE_C_DESCRIPTORS:
   DESCRIPTOR._loaded_options = None
-  _globals['_MESSAGETYPE']._serialized_start=157
-  _globals['_MESSAGETYPE']._serialized_end=213
+  _globals['_MESSAGETYPE']._serialized_start=651
+  _globals['_MESSAGETYPE']._serialized_end=707
+  _globals['_HISTORYMODE']._serialized_start=709
+  _globals['_HISTORYMODE']._serialized_end=753
   _globals['_CHATMESSAGE']._serialized_start=21
-  _globals['_CHATMESSAGE']._serialized_end=155
-  _globals['_CHATSERVICE']._serialized_start=215
-  _globals['_CHATSERVICE']._serialized_end=282
+  _globals['_CHATMESSAGE']._serialized_end=234
+  _globals['_MESSAGEBATCH']._serialized_start=236
+  _globals['_MESSAGEBATCH']._serialized_end=287
+  _globals['_HISTORYPREFERENCE']._serialized_start=289
+  _globals['_HISTORYPREFERENCE']._serialized_end=393
+  _globals['_HISTORYREQUEST']._serialized_start=395
+  _globals['_HISTORYREQUEST']._serialized_end=478
+  _globals['_HISTORYPAGE']._serialized_start=480
+  _globals['_HISTORYPAGE']._serialized_end=569
+  _globals['_SEARCHREQUEST']._serialized_start=571
+  _globals['_SEARCHREQUEST']._serialized_end=649
+  _globals['_CHATSERVICE']._serialized_start=756
+  _globals['_CHATSERVICE']._serialized_end=998
 # @@protoc_insertion_point(module_scope)
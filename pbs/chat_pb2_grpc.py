@@ -40,6 +40,21 @@ class ChatServiceStub(object):
                 request_serializer=chat__pb2.ChatMessage.SerializeToString,
                 response_deserializer=chat__pb2.ChatMessage.FromString,
                 _registered_method=True)
+        self.JoinChatBatched = channel.stream_stream(
+                '/chat.ChatService/JoinChatBatched',
+                request_serializer=chat__pb2.ChatMessage.SerializeToString,
+                response_deserializer=chat__pb2.MessageBatch.FromString,
+                _registered_method=True)
+        self.GetHistory = channel.unary_unary(
+                '/chat.ChatService/GetHistory',
+                request_serializer=chat__pb2.HistoryRequest.SerializeToString,
+                response_deserializer=chat__pb2.HistoryPage.FromString,
+                _registered_method=True)
+        self.SearchMessages = channel.unary_unary(
+                '/chat.ChatService/SearchMessages',
+                request_serializer=chat__pb2.SearchRequest.SerializeToString,
+                response_deserializer=chat__pb2.HistoryPage.FromString,
+                _registered_method=True)
 
 
 class ChatServiceServicer(object):
@@ -52,6 +67,27 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def JoinChatBatched(self, request_iterator, context):
+        """Same as JoinChat, but delivers messages in batches to cut per-message framing
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def GetHistory(self, request, context):
+        """Page backwards through a room's stored history
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchMessages(self, request, context):
+        """Full-text search of a room's stored history, newest matches first, a page at a time
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ChatServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -60,6 +96,21 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__pb2.ChatMessage.FromString,
                     response_serializer=chat__pb2.ChatMessage.SerializeToString,
             ),
+            'JoinChatBatched': grpc.stream_stream_rpc_method_handler(
+                    servicer.JoinChatBatched,
+                    request_deserializer=chat__pb2.ChatMessage.FromString,
+                    response_serializer=chat__pb2.MessageBatch.SerializeToString,
+            ),
+            'GetHistory': grpc.unary_unary_rpc_method_handler(
+                    servicer.GetHistory,
+                    request_deserializer=chat__pb2.HistoryRequest.FromString,
+                    response_serializer=chat__pb2.HistoryPage.SerializeToString,
+            ),
+            'SearchMessages': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchMessages,
+                    request_deserializer=chat__pb2.SearchRequest.FromString,
+                    response_serializer=chat__pb2.HistoryPage.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'chat.ChatService', rpc_method_handlers)
@@ -98,3 +149,84 @@ class ChatService(object):
             timeout,
             metadata,
             _registered_method=True)
+
+    @staticmethod
+    def JoinChatBatched(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/chat.ChatService/JoinChatBatched',
+            chat__pb2.ChatMessage.SerializeToString,
+            chat__pb2.MessageBatch.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def GetHistory(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/GetHistory',
+            chat__pb2.HistoryRequest.SerializeToString,
+            chat__pb2.HistoryPage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def SearchMessages(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/chat.ChatService/SearchMessages',
+            chat__pb2.SearchRequest.SerializeToString,
+            chat__pb2.HistoryPage.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
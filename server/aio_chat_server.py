@@ -0,0 +1,198 @@
+import asyncio
+import os
+import signal
+import sys
+import threading
+
+import grpc
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+from chat_server import (DRAIN_GRACE, JOIN, TEXT, ChatServer, add_chat_service, logger, restore_history,
+                         save_history, start_metrics)
+from history_store import MAX_ROOM_ID_BYTES
+from outbox import AsyncOutbox
+from wire import encode_message_list
+
+
+async def prepend(message, request_iterator):
+    """An async request iterator with one message put back in front"""
+    yield message
+    async for message in request_iterator:
+        yield message
+
+
+class AioChatServer(ChatServer):
+    """ChatServer for the grpc.aio engine: each stream is a coroutine instead of a worker thread.
+
+    Room state, history and broadcast are inherited unchanged; everything runs on the
+    event loop thread, so the inherited room locks are barely contended. The one
+    exception is a hub broker, whose reader thread delivers broadcasts from other
+    servers; AsyncOutbox hands those over to the loop thread-safely.
+    """
+
+    def new_client_queue(self, room_id):
+        """Create the bounded outbound queue for a newly joined client"""
+        return AsyncOutbox(room_id, self.queue_size, self.overflow_policy)
+
+    async def read_replay(self, client_info, message):
+        """Read what a JOIN replays from the history store, off the event loop
+
+        Creating a room primes its hot tail from the store, and replays beyond
+        the hot tail read the store, which may mean the disk; both run on the
+        default executor, like GetHistory. Returns a replay for join_room, or
+        None when joining needs nothing from the store.
+        """
+        room_id = message.room_id or "general"
+        if len(room_id.encode()) > MAX_ROOM_ID_BYTES or (client_info and room_id in client_info['rooms']):
+            return None
+        loop = asyncio.get_running_loop()
+        room = self.get_room(room_id)
+        if room is None:
+            room = await loop.run_in_executor(None, self.get_room, room_id, True)
+        if self.replay_in_memory(message.history):
+            return None
+        return await loop.run_in_executor(None, self.select_history, room, message.history)
+
+    async def read_messages(self, request_iterator, client_info, first_message=None):
+        """Consume the client's stream until it leaves or disconnects
+
+        first_message, the stream's TEXT first message if it had one, is handled first.
+        """
+        limits = self.rate_limiter.enabled
+        if first_message is not None:
+            request_iterator = prepend(first_message, request_iterator)
+        try:
+            async for message in request_iterator:
+                if limits and message.type == TEXT:
+                    wait = self.rate_limit(client_info, message)
+                    if wait is None:
+                        continue
+                    if wait:
+                        await asyncio.sleep(wait)
+                replay = await self.read_replay(client_info, message) if message.type == JOIN else None
+                if not self.handle_session_message(client_info, message, replay):
+                    break
+        except asyncio.CancelledError:
+            raise
+        except (grpc.RpcError, grpc.aio.BaseError):
+            # The stream was cancelled or the server is stopping
+            pass
+        except Exception as e:
+            logger.error(f"Error reading from client {client_info['username']}: {e}")
+        finally:
+            # Wake the sender so the stream completes
+            client_info['queue'].put_nowait(None)
+
+    # grpc.aio only streams from async generator functions, so these can't just
+    # return stream_chat() like the threaded engine does
+    async def JoinChat(self, request_iterator, context):
+        async for frame in self.stream_chat(request_iterator, context):
+            yield frame
+
+    async def JoinChatBatched(self, request_iterator, context):
+        async for frame in self.stream_chat(request_iterator, context, batched=True):
+            yield frame
+
+    async def stream_chat(self, request_iterator, context, batched=False):
+        client_info = None
+        username = None
+        reader = None
+
+        try:
+            # Get the first message to identify the user
+            try:
+                first_message = await request_iterator.__anext__()
+            except StopAsyncIteration:
+                logger.warning("Client disconnected without sending initial message")
+                return
+            username = first_message.username
+            if self.draining:
+                self.refuse_stream(context)
+                return
+
+            # Queue for this specific client
+            client_queue = self.new_client_queue(first_message.room_id or "general")
+            # A send blocked on flow control only ends if the handler task is cancelled;
+            # the overflow may happen on a broker thread
+            task = asyncio.current_task()
+            client_queue.on_overflow = lambda: task.get_loop().call_soon_threadsafe(task.cancel)
+            replay = await self.read_replay(None, first_message)
+            client_info = self.open_session(first_message, client_queue, context, replay)
+
+            # Incoming messages are read concurrently with outgoing delivery
+            reader = asyncio.create_task(self.read_messages(
+                request_iterator, client_info, first_message if first_message.type == TEXT else None))
+
+            min_bytes = self.compression_min_bytes
+            while True:
+                if batched:
+                    message = await client_queue.get_batch(self.batch_size, self.batch_delay)
+                else:
+                    message = await client_queue.get()
+                if message is None:
+                    break
+                frame = encode_message_list(message) if batched else message
+                if len(frame) < min_bytes:
+                    context.disable_next_message_compression()
+                yield frame
+
+            self.end_slow_consumer(client_queue, context, username)
+
+        except Exception as e:
+            logger.error(f"Error handling client {username}: {e}")
+        finally:
+            if reader is not None:
+                reader.cancel()
+            self.cleanup_client(client_info)
+
+
+    async def GetHistory(self, request, context):
+        # Log store reads hit the disk; keep them off the event loop
+        page = await asyncio.get_running_loop().run_in_executor(None, self.history_page, request)
+        return self.compress_if_large(context, page)
+
+    async def SearchMessages(self, request, context):
+        # Indexing a room on its first search reads its whole history
+        page = await asyncio.get_running_loop().run_in_executor(None, self.search_page, request)
+        return self.compress_if_large(context, page)
+
+
+async def create_aio_server(chat_server, listen_addr):
+    """Build a grpc.aio server; streams are not bounded by a thread pool"""
+    server = grpc.aio.server(compression=chat_server.compression)
+    add_chat_service(chat_server, server)
+    port = server.add_insecure_port(listen_addr)
+    return server, port
+
+
+async def serve_aio(listen_addr='[::]:50051', metrics_port=None, drain_seconds=0, snapshot_path=None, **options):
+    chat_server = AioChatServer(**options)
+    restore_history(chat_server.history_store, snapshot_path)
+    server, _ = await create_aio_server(chat_server, listen_addr)
+    start_metrics(chat_server, metrics_port)
+
+    logger.info(f"Enhanced gRPC Chat Server listening on {listen_addr}")
+    logger.info("Features: Room isolation, Message history, Better logging (engine: asyncio)")
+    await server.start()
+    if threading.current_thread() is threading.main_thread():
+        # SIGTERM shuts down like Ctrl-C: asyncio.run's SIGINT handler cancels this task
+        signal.signal(signal.SIGTERM, signal.getsignal(signal.SIGINT))
+
+    try:
+        await server.wait_for_termination()
+    except asyncio.CancelledError:
+        logger.info("Shutting down server...")
+        if drain_seconds > 0:
+            # Stop listening first, so reconnecting clients find the next process
+            stopping = asyncio.ensure_future(server.stop(DRAIN_GRACE))
+            await asyncio.sleep(0)
+            chat_server.drain(drain_seconds)
+            await stopping
+        else:
+            await server.stop(0)
+    finally:
+        chat_server.presence.close()
+        chat_server.broker.close()
+        save_history(chat_server.history_store, snapshot_path)
+        chat_server.history_store.close()
@@ -0,0 +1,214 @@
+import logging
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BROKERS = ('local', 'hub')
+
+# Hub packets: 4-byte big-endian length of the rest, then the envelope and the encoded message
+PACKET_HEADER = struct.Struct('>I')
+# Envelope: timestamp (ms), seq, room_id length, exclude_user length. From a server
+# the seq is the last one it knows in the room; from the hub, the message's own
+ENVELOPE = struct.Struct('>qqHH')
+
+RECONNECT_DELAY = 0.5  # seconds; doubles while the hub is unreachable
+RECONNECT_MAX_DELAY = 10.0
+
+
+def pack_packet(room_id, frame, timestamp, exclude_user=None, seq=0):
+    room = room_id.encode()
+    exclude = (exclude_user or '').encode()
+    envelope = ENVELOPE.pack(timestamp, seq, len(room), len(exclude))
+    length = len(envelope) + len(room) + len(exclude) + len(frame)
+    return b''.join((PACKET_HEADER.pack(length), envelope, room, exclude, frame))
+
+
+def split_packets(buffer):
+    """Length of the complete packets at the start of buffer"""
+    end = 0
+    while end + PACKET_HEADER.size <= len(buffer):
+        length, = PACKET_HEADER.unpack_from(buffer, end)
+        if end + PACKET_HEADER.size + length > len(buffer):
+            break
+        end += PACKET_HEADER.size + length
+    return end
+
+
+def sequence_packets(data, seqs):
+    """Number the packets in data with their rooms' next seqs, as the hub does; returns what to relay
+
+    seqs maps room_id (encoded) to the last seq handed out in the room. A server
+    sends the last seq it knows of, so a restarted hub carries on from the
+    servers' numbering rather than from 1. Packets without a frame only report
+    that (servers send one per room on connecting) and are not relayed.
+    """
+    data = bytearray(data)
+    relay = []  # (start, end) of each packet to relay
+    packets = 0
+    position = 0
+    while position < len(data):
+        length, = PACKET_HEADER.unpack_from(data, position)
+        start = position + PACKET_HEADER.size
+        end = start + length
+        timestamp, known, room_len, exclude_len = ENVELOPE.unpack_from(data, start)
+        room_start = start + ENVELOPE.size
+        room_id = bytes(data[room_start:room_start + room_len])
+        seq = max(seqs.get(room_id, 0), known)
+        if end > room_start + room_len + exclude_len:
+            seq += 1
+            ENVELOPE.pack_into(data, start, timestamp, seq, room_len, exclude_len)
+            relay.append((position, end))
+        seqs[room_id] = seq
+        position = end
+        packets += 1
+    if len(relay) == packets:
+        return bytes(data)
+    return b''.join(data[start:end] for start, end in relay)
+
+
+def unpack_packets(data):
+    """Yield (room_id, frame, timestamp, exclude_user, seq) for each packet in data"""
+    position = 0
+    view = memoryview(data)
+    while position < len(data):
+        length, = PACKET_HEADER.unpack_from(data, position)
+        start = position + PACKET_HEADER.size
+        timestamp, seq, room_len, exclude_len = ENVELOPE.unpack_from(data, start)
+        room_start = start + ENVELOPE.size
+        frame_start = room_start + room_len + exclude_len
+        room_id = bytes(view[room_start:room_start + room_len]).decode()
+        exclude_user = bytes(view[room_start + room_len:frame_start]).decode() or None
+        position = start + length
+        yield room_id, bytes(view[frame_start:position]), timestamp, exclude_user, seq
+
+
+class InProcessBroker:
+    """Delivers broadcasts straight back to this process; rooms live in one server only
+
+    The room numbers each message itself, so the publisher's seq is not needed.
+    """
+
+    def __init__(self):
+        self.deliver = None
+
+    def start(self, deliver, last_seqs=None):
+        self.deliver = deliver
+
+    def publish(self, room_id, frame, timestamp, exclude_user=None, seq=0):
+        self.deliver(room_id, frame, timestamp, exclude_user)
+
+    def close(self):
+        pass
+
+
+class HubBroker:
+    """Shares rooms between server processes through a hub on a Unix socket (see hub.py).
+
+    Every broadcast goes to the hub, which relays it to all connected servers,
+    the publisher included. Servers only deliver and record what comes back
+    from the hub, so every process sees each room's messages in the same order.
+    The hub numbers them too, so a message has the same seq on every server and
+    a client can resume on any of them. A server that started late or lost the
+    hub for a while is missing messages; it drops its copy of the room's earlier
+    history and carries on from the hub's seq (see rooms.Room.publish).
+    Broadcasts made while the hub is unreachable are dropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.deliver = None
+        self.last_seqs = None  # returns {room_id: last seq} for the hub on connecting
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._closed = False
+        self._connected = threading.Event()
+        self._reader = None
+
+    def start(self, deliver, last_seqs=None, timeout=5.0):
+        """Start relaying; waits up to timeout for the first connection to the hub"""
+        self.deliver = deliver
+        self.last_seqs = last_seqs
+        self._reader = threading.Thread(target=self._run, name="hub-reader", daemon=True)
+        self._reader.start()
+        if not self._connected.wait(timeout):
+            logger.warning(f"Hub at {self.path} not reachable yet; broadcasts are dropped until it is")
+
+    def publish(self, room_id, frame, timestamp, exclude_user=None, seq=0):
+        """Send a broadcast to the hub; seq is the last one this server has in the room"""
+        packet = pack_packet(room_id, frame, timestamp, exclude_user, seq)
+        with self._send_lock:
+            sock = self._sock
+            if sock is None:
+                logger.warning(f"Hub unavailable; dropped broadcast to room '{room_id}'")
+                return
+            try:
+                sock.sendall(packet)
+            except OSError as e:
+                logger.error(f"Error publishing to hub: {e}")
+
+    def _connect(self):
+        delay = RECONNECT_DELAY
+        while not self._closed:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+            except OSError:
+                sock.close()
+                time.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            logger.info(f"Connected to hub at {self.path}")
+            if self.last_seqs is not None:
+                # So a hub that has restarted numbers on from where the rooms are
+                sock.sendall(b''.join(pack_packet(room_id, b'', 0, seq=seq)
+                                      for room_id, seq in self.last_seqs().items()))
+            return sock
+        return None
+
+    def _run(self):
+        """Reader thread: deliver everything the hub relays, reconnecting if it goes away"""
+        while not self._closed:
+            sock = self._connect()
+            if sock is None:
+                return
+            with self._send_lock:
+                self._sock = sock
+            self._connected.set()
+
+            buffer = b''
+            try:
+                while True:
+                    chunk = sock.recv(1 << 16)
+                    if not chunk:
+                        break
+                    buffer += chunk
+                    end = split_packets(buffer)
+                    if end:
+                        for packet in unpack_packets(buffer[:end]):
+                            try:
+                                self.deliver(*packet)
+                            except Exception as e:
+                                logger.error(f"Error delivering hub message to room '{packet[0]}': {e}")
+                        buffer = buffer[end:]
+            except OSError:
+                pass
+            finally:
+                with self._send_lock:
+                    self._sock = None
+                sock.close()
+            if not self._closed:
+                logger.warning(f"Lost connection to hub at {self.path}; reconnecting")
+
+    def close(self):
+        self._closed = True
+        with self._send_lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
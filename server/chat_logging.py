@@ -0,0 +1,107 @@
+"""Logging setup for the chat server.
+
+In async mode every handler sits behind a queue: the thread that logs only
+enqueues the record and a QueueListener thread formats and writes it. Per-message
+events (each chat message, each broadcast) go to their own logger, where they can
+be sampled and rate limited so a busy room can't flood the log.
+"""
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_MODES = ('sync', 'async')
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock prepare() formats the record in the logging thread so it can be
+    pickled; our queue never leaves the process. Log arguments must not be
+    mutated after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """Let through one record in every `every`"""
+
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, every)
+        self._count = 0
+
+    def filter(self, record):
+        self._count += 1
+        return self._count % self.every == 0
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket: at most `rate` records per second, with bursts of up to `burst`.
+
+    The first record let through after some were suppressed says how many.
+    """
+
+    def __init__(self, rate, burst=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self._suppressed += 1
+                return False
+            self._tokens -= 1
+            suppressed, self._suppressed = self._suppressed, 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def configure_logging(level='INFO', mode='sync', message_rate=None, message_sample=1, stream=None):
+    """Set up the root logger and the per-message logger.
+
+    Returns the QueueListener in async mode (stop it to flush at shutdown), else None.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    listener = None
+    if mode == 'async':
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        listener.start()
+        handler = DeferredQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # Filters on the logger itself apply to everything logged through it
+    message_log = message_logger()
+    for old in list(message_log.filters):
+        message_log.removeFilter(old)
+    if message_sample > 1:
+        message_log.addFilter(SampleFilter(message_sample))
+    if message_rate:
+        message_log.addFilter(RateLimitFilter(message_rate))
+    return listener
+
+
+def message_logger():
+    """Logger for per-message events; sampled and rate limited by configure_logging"""
+    return logging.getLogger('chat.messages')
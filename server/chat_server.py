@@ -1,11 +1,14 @@
+import argparse
+import itertools
 import os
+import random
+import signal
 import sys
 import grpc
 import threading
 import time
 import logging
 from concurrent import futures
-from collections import defaultdict, deque
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -15,244 +18,817 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
 
 import chat_pb2
 import chat_pb2_grpc
+from chat_logging import LOG_MODES, configure_logging, message_logger
+from broker import BROKERS, HubBroker, InProcessBroker
+from history_store import (HISTORY_STORES, MAX_ROOM_ID_BYTES, CompactHistoryStore, LogHistoryStore,
+                           MemoryHistoryStore)
+from metrics import ChatMetrics, serve_metrics
+from outbox import OVERFLOW_POLICIES, Outbox
+from presence import PresenceDigest, describe
+from ratelimit import RATE_LIMIT_POLICIES, RateLimiter
+from rooms import ClientRegistry, Room
+from search_index import SearchIndex
+from snapshot import load_snapshot, write_snapshot
+from wire import encode_message_list
+
+# Per-message events go to their own logger so they can be sampled and rate limited
+message_log = message_logger()
+
+MAX_HISTORY_PAGE = 500  # GetHistory page size cap
+MAX_REPLAY = 1000  # cap on history replayed by JoinChat; see replay_limit
+SEARCH_PAGE_SIZE = 20  # SearchMessages default page size
+MAX_SEARCH_PAGE = 100
+DRAIN_GRACE = 5.0  # seconds draining streams get to send what is queued before they are cancelled
+# For per-message type checks: chat_pb2.MessageType.TEXT goes through the enum
+# wrapper's __getattr__, which costs about as much as a rate limit check
+TEXT, JOIN, LEAVE = chat_pb2.TEXT, chat_pb2.JOIN, chat_pb2.LEAVE
 
 class ChatServer(chat_pb2_grpc.ChatServiceServicer):
-    def __init__(self):
-        self.clients = {}  # user_id -> client_info
-        self.rooms = defaultdict(set)  # room_id -> set of user_ids
-        self.message_history = defaultdict(lambda: deque(maxlen=50))  # room_id -> recent messages
-        self.lock = threading.RLock()
+    def __init__(self, history_size=50, queue_size=1000, overflow_policy='drop_oldest', history_store=None,
+                 batch_size=64, batch_delay=0.005, broker=None, compression='none', compression_min_bytes=1024,
+                 presence_interval=1.0, rate_limiter=None):
+        self.clients = ClientRegistry()  # session_id -> client_info, one session per stream
+        self._session_ids = itertools.count(1)
+        self.rooms = {}  # room_id -> Room (members + recent messages)
+        self.rooms_lock = threading.Lock()  # only guards creating rooms
+        self.history_size = history_size  # hot tail kept in memory per room
+        self.history_store = history_store or MemoryHistoryStore()
+        self.search_index = SearchIndex(self.history_store)  # rooms are indexed on their first search
+        self.queue_size = queue_size  # per-client outbound bound, 0 = unbounded
+        self.overflow_policy = overflow_policy  # see outbox.OVERFLOW_POLICIES
+        self.batch_size = batch_size  # JoinChatBatched: max messages per batch
+        self.batch_delay = batch_delay  # JoinChatBatched: max seconds a batch waits to fill
+        self.compression = COMPRESSION_ALGORITHMS[compression]  # default for every call; see create_*_server
+        # Adaptive compression: responses smaller than this go out uncompressed, 0 = compress all
+        self.compression_min_bytes = compression_min_bytes if compression != 'none' else 0
+        self.metrics = ChatMetrics(self)  # see metrics.py; exposed by serve(metrics_port=...)
+        # Joins and leaves are announced as one digest per room every presence_interval seconds, 0 = each at once
+        self.presence = PresenceDigest(self.announce_presence, presence_interval)
+        self.rate_limiter = rate_limiter or RateLimiter()  # off unless given rates
+        self.broker = broker or InProcessBroker()  # carries broadcasts to every server sharing the rooms
+        self.broker.start(self.deliver, self.last_seqs)
+        self.draining = False  # set by drain(): new streams are refused
         logger.info("ChatServer initialized with message history")
-    
+
+    def get_room(self, room_id, create=False):
+        """Look up a room, optionally creating it; rooms are kept once created"""
+        room = self.rooms.get(room_id)
+        if room is None and create:
+            with self.rooms_lock:
+                room = self.rooms.get(room_id)
+                if room is None:
+                    room = self.rooms[room_id] = Room(
+                        room_id, self.history_size, self.history_store, self.metrics.room_lock(),
+                        self.search_index)
+        return room
+
+    def new_client_queue(self, room_id):
+        """Create the bounded outbound queue for a newly joined client"""
+        return Outbox(room_id, self.queue_size, self.overflow_policy)
+
+    def end_slow_consumer(self, client_queue, context, username):
+        """Fail the stream of a client whose outbox overflowed under the disconnect policy"""
+        if not client_queue.overflowed:
+            return
+        logger.warning(f"Disconnecting slow client {username}: {client_queue.dropped} messages dropped")
+        context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+        context.set_details("Outbound queue overflowed; reconnect to resume")
+
+    def client_stats(self):
+        """Per-session outbound queue depth and drop counters"""
+        return [
+            {
+                'session_id': session_id,
+                'user_id': info['user_id'],
+                'username': info['username'],
+                'rooms': list(info['rooms']),
+                'queue_depth': info['queue'].qsize(),
+                'dropped': info['queue'].dropped,
+            }
+            for session_id, info in self.clients.snapshot()
+        ]
+
+    def new_session(self, user_id, username, client_queue, context):
+        """Register a session (one stream) of a user; it joins rooms with join_room"""
+        client_info = {
+            'session_id': next(self._session_ids),
+            'user_id': user_id,
+            'username': username,
+            'queue': client_queue,
+            'rooms': {},  # room_id -> Room, in join order; TEXT without a room_id goes to the last
+            'context': context,
+            'lock': threading.Lock(),  # serializes this session's joins, leaves and cleanup
+            'closed': False,
+            'rate_limited': False,  # told it is over a rate limit, until a message fits again
+        }
+        self.clients.register(client_info)
+        return client_info
+
+    def open_session(self, first_message, client_queue, context, replay=None):
+        """Register a session from the first message of its stream and join the room it names
+
+        A TEXT first message is not posted here: the stream's reader posts it
+        first, through the rate limits like every other message.
+        """
+        client_info = self.new_session(first_message.user_id, first_message.username, client_queue, context)
+        self.join_room(client_info, first_message, replay)
+        return client_info
+
+    def join_room(self, client_info, message, replay=None):
+        """Subscribe a session to message.room_id and announce the user to the room
+
+        Joining a room the session is already in only makes it the session's
+        default room. replay is the select_history result for the join if the
+        caller has read it already. Returns the room_id, or None if the session
+        has closed or the room id is too long.
+        """
+        user_id = client_info['user_id']
+        username = client_info['username']
+        room_id = message.room_id or "general"
+        client_queue = client_info['queue']
+        if len(room_id.encode()) > MAX_ROOM_ID_BYTES:
+            self.send_notice(client_info, f"Room ids are limited to {MAX_ROOM_ID_BYTES} bytes")
+            return None
+
+        with client_info['lock']:
+            if client_info['closed']:
+                return None
+            rooms = client_info['rooms']
+            if room_id in rooms:
+                rooms[room_id] = rooms.pop(room_id)
+                return room_id
+
+            logger.info(f"User {username} ({user_id}) joining room '{room_id}'")
+
+            # Send recent message history to the session, as much as they asked for,
+            # then add it to the room; anything recorded in between is caught up
+            # under the room lock so nothing is missed or delivered out of order
+            room = self.get_room(room_id, create=True)
+            replayed_seq = self.send_message_history(client_queue, room, message.history, replay)
+            first_session = room.add_member(client_info, replayed_seq)
+            rooms[room_id] = room
+        if logger.isEnabledFor(logging.DEBUG):
+            # Listing the room takes its lock; only do it when someone will read it
+            logger.debug(f"Room '{room_id}' now has users: {room.usernames()}")
+
+        # Announce the user once, however many sessions they have in the room
+        if first_session:
+            self.presence.joined(room_id, user_id, username)
+        return room_id
+
+    def leave_room(self, client_info, room_id):
+        """Unsubscribe a session from a room; the user's last session leaving is announced"""
+        with client_info['lock']:
+            room = client_info['rooms'].pop(room_id, None)
+            if room is None:
+                return
+            last_session = room.remove_member(client_info)
+
+        # A drained server's sessions are coming back to the next one; their leaves aren't news
+        if last_session and not self.draining:
+            self.presence.left(room_id, client_info['user_id'], client_info['username'])
+
+        # Clean up empty rooms (but keep message history)
+        if room.is_empty():
+            logger.info(f"Room '{room_id}' is now empty (keeping message history)")
+
+    def announce_presence(self, room_id, joined, usernames, exclude_user=None):
+        """Record and broadcast a join or leave digest (see presence.PresenceDigest)"""
+        presence_message = chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message=describe(usernames, "joined" if joined else "left"),
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.JOIN if joined else chat_pb2.MessageType.LEAVE,
+            room_id=room_id
+        )
+        self.broadcast_to_room(room_id, presence_message, exclude_user=exclude_user)
+
+    def send_notice(self, client_info, text, room_id="", retry_after_ms=0):
+        """Queue a SYSTEM message for one session only"""
+        notice = chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message=text,
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.SYSTEM,
+            room_id=room_id,
+            retry_after_ms=retry_after_ms
+        )
+        client_info['queue'].put_nowait(notice.SerializeToString())
+
+    def refuse_stream(self, context):
+        """End a new stream while draining; clients retry it like a dropped stream"""
+        context.set_code(grpc.StatusCode.UNAVAILABLE)
+        context.set_details("Server is restarting; reconnect shortly")
+
+    def drain(self, spread=5.0):
+        """Refuse new streams and end every session's, asking it to reconnect within spread seconds
+
+        Each session gets a SYSTEM notice with a retry_after_ms picked at random
+        in [0, spread), then its stream ends once what is queued has gone out.
+        Clients reconnect when told instead of all at once, so the next server
+        process sees a steady trickle rather than a thundering herd.
+        """
+        self.draining = True
+        sessions = self.clients.snapshot()
+        for _, client_info in sessions:
+            delay = random.uniform(0, spread)
+            self.send_notice(client_info, f"Server is restarting; reconnecting in {delay:.1f}s",
+                             retry_after_ms=int(delay * 1000))
+            client_info['queue'].put_nowait(None)
+        logger.info(f"Draining: {len(sessions)} sessions told to reconnect within {spread}s")
+
+    def handle_session_message(self, client_info, message, replay=None):
+        """Process one message from a session's stream; returns False once the client asks to leave
+
+        JOIN and LEAVE after the first message move the stream between rooms
+        without reconnecting: JOIN subscribes it to message.room_id as well, LEAVE
+        drops that room, and LEAVE without a room_id ends the stream. TEXT goes to
+        message.room_id, or to the room the session joined last. replay is as
+        for join_room.
+        """
+        message_type = message.type
+        if message_type == JOIN:
+            self.join_room(client_info, message, replay)
+
+        elif message_type == LEAVE:
+            if not message.room_id:
+                return False
+            self.leave_room(client_info, message.room_id)
+
+        elif message_type == TEXT:
+            rooms = client_info['rooms']
+            room_id = message.room_id or next(reversed(rooms), None)
+            if room_id in rooms:
+                self.handle_client_message(message, room_id)
+            else:
+                self.send_notice(client_info, f"Not in room '{room_id or ''}'; send JOIN first", room_id or "")
+
+        return True
+
+    def rate_limit(self, client_info, message):
+        """Check a TEXT message against the rate limits: seconds to hold it back, or None to drop it
+
+        The sender gets one SYSTEM notice per run of limited messages.
+        """
+        room_id = message.room_id or next(reversed(client_info['rooms']), "")
+        wait = self.rate_limiter.check(client_info['user_id'], room_id)
+        if wait == 0:
+            client_info['rate_limited'] = False
+            return wait
+        self.metrics.messages_rate_limited.inc()
+        if not client_info['rate_limited']:
+            client_info['rate_limited'] = True
+            outcome = "some were not sent" if wait is None else "they are being delayed"
+            self.send_notice(client_info, f"You are sending messages too fast; {outcome}", room_id)
+        return wait
+
+    def handle_client_message(self, message, room_id):
+        """Post one text message to a room"""
+        # Ensure message has the correct room_id
+        message.room_id = room_id
+        message.timestamp = int(time.time() * 1000)
+
+        if message.type == TEXT:
+            self.metrics.messages_received.inc()
+            message_log.info("[%s] %s: %s", room_id, message.username, message.message)
+
+            # Store in history and broadcast only to users in the same room
+            self.broadcast_to_room(room_id, message)
+
+    def read_messages(self, request_iterator, client_info, first_message=None):
+        """Consume the client's stream until it leaves or disconnects
+
+        first_message, the stream's TEXT first message if it had one, is handled first.
+        """
+        limits = self.rate_limiter.enabled
+        if first_message is not None:
+            request_iterator = itertools.chain((first_message,), request_iterator)
+        try:
+            for message in request_iterator:
+                if limits and message.type == TEXT:
+                    wait = self.rate_limit(client_info, message)
+                    if wait is None:
+                        continue
+                    if wait:
+                        # Not reading meanwhile: flow control holds the client back
+                        time.sleep(wait)
+                if not self.handle_session_message(client_info, message):
+                    break
+        except grpc.RpcError:
+            # The stream was cancelled or the client went away
+            pass
+        except Exception as e:
+            logger.error(f"Error reading from client {client_info['username']}: {e}")
+        finally:
+            # Wake the sender so the stream completes
+            client_info['queue'].put_nowait(None)
+
     def JoinChat(self, request_iterator, context):
-        user_id = None
+        return self.stream_chat(request_iterator, context)
+
+    def JoinChatBatched(self, request_iterator, context):
+        return self.stream_chat(request_iterator, context, batched=True)
+
+    def stream_chat(self, request_iterator, context, batched=False):
+        """Body of both JoinChat flavours; batched streams send MessageBatch frames"""
+        client_info = None
         username = None
-        room_id = None
 
         try:
             # Get the first message to identify the user
             first_message = next(request_iterator)
-            user_id = first_message.user_id
             username = first_message.username
-            room_id = first_message.room_id or "general"
-
-            logger.info(f"User {username} ({user_id}) joining room '{room_id}'")
+            if self.draining:
+                self.refuse_stream(context)
+                return
 
             # Queue for this specific client
-            import queue
-            client_queue = queue.Queue()
-
-            # Register client with their specific room
-            with self.lock:
-                self.clients[user_id] = {
-                    'queue': client_queue,
-                    'username': username,
-                    'room_id': room_id,  # Store the room this client is in
-                    'context': context
-                }
-                
-                # Add to the specific room
-                self.rooms[room_id].add(user_id)
-                logger.info(f"Room '{room_id}' now has users: {[self.clients[uid]['username'] for uid in self.rooms[room_id]]}")
-            
-            # Send recent message history to the new user
-            self.send_message_history(user_id, room_id)
-            
-            # Send join notification to room (but not to the joining user)
-            join_message = chat_pb2.ChatMessage(
-                user_id="SYSTEM",
-                username="System",
-                message=f"{username} joined the room",
-                timestamp=int(time.time() * 1000),
-                type=chat_pb2.MessageType.JOIN,
-                room_id=room_id
+            client_queue = self.new_client_queue(first_message.room_id or "general")
+            client_queue.on_overflow = context.cancel
+            # A disconnect closes the queue, waking the sender below; no polling
+            if not context.add_callback(client_queue.close):
+                return
+            client_info = self.open_session(first_message, client_queue, context)
+
+            # Incoming messages are read on their own thread so that broadcasts are
+            # delivered while the client is still sending
+            reader = threading.Thread(
+                target=self.read_messages,
+                args=(request_iterator, client_info, first_message if first_message.type == TEXT else None),
+                name=f"reader-{client_info['session_id']}",
+                daemon=True
             )
-            
-            # Store join message in history
-            with self.lock:
-                self.message_history[room_id].append(join_message)
-            
-            # Broadcast to others in the same room only
-            self.broadcast_to_room(room_id, join_message, exclude_user=user_id)
-
-            # Generator for outgoing messages to this specific client
-            def send_messages():
-                try:
-                    while True:
-                        try:
-                            message = client_queue.get(timeout=1.0)
-                            if message is None:
-                                break
-                            # Only send messages meant for this client's room
-                            if message.room_id == room_id or message.user_id == "SYSTEM":
-                                yield message
-                        except queue.Empty:
-                            if context.is_active():
-                                continue
-                            else:
-                                break
-                except Exception as e:
-                    logger.error(f"Error in send_messages for {username}: {e}")
-
-            response_generator = send_messages()
-
-            # Handle the first message if it's a text message
-            if first_message.type == chat_pb2.MessageType.TEXT:
-                first_message.timestamp = int(time.time() * 1000)
-                with self.lock:
-                    self.message_history[room_id].append(first_message)
-                self.broadcast_to_room(room_id, first_message)
-            
-            # Process incoming messages from this client
-            for message in request_iterator:
-                # Ensure message has the correct room_id
-                message.room_id = room_id
-                message.timestamp = int(time.time() * 1000)
-                
-                if message.type == chat_pb2.MessageType.TEXT:
-                    logger.info(f"[{room_id}] {message.username}: {message.message}")
-                    
-                    # Store in history
-                    with self.lock:
-                        self.message_history[room_id].append(message)
-                    
-                    # Broadcast only to users in the same room
-                    self.broadcast_to_room(room_id, message)
-                    
-                elif message.type == chat_pb2.MessageType.LEAVE:
+            reader.start()
+
+            # Outgoing messages to this specific client; the thread only wakes for data
+            # or for the end of the stream
+            min_bytes = self.compression_min_bytes
+            while True:
+                if batched:
+                    message = client_queue.get_batch(self.batch_size, self.batch_delay)
+                else:
+                    message = client_queue.get()
+                if message is None:
                     break
-            
-            return response_generator
-    
-        except StopIteration:
-            logger.warning("Client disconnected without sending initial message")
+                # Already encoded; rooms only fan out to their own subscribers
+                frame = encode_message_list(message) if batched else message
+                if len(frame) < min_bytes:
+                    context.disable_next_message_compression()
+                yield frame
+
+            self.end_slow_consumer(client_queue, context, username)
+
+        except (StopIteration, grpc.RpcError):
+            if client_info is None:
+                logger.warning("Client disconnected without sending initial message")
         except Exception as e:
             logger.error(f"Error handling client {username}: {e}")
             import traceback
             traceback.print_exc()
         finally:
-            self.cleanup_client(user_id, username, room_id)
-    
-    def send_message_history(self, user_id, room_id):
-        """Send recent message history to a newly joined user"""
-        with self.lock:
-            if room_id in self.message_history:
-                history_messages = list(self.message_history[room_id])
-                if history_messages:
-                    # Send a system message indicating history
-                    history_header = chat_pb2.ChatMessage(
-                        user_id="SYSTEM",
-                        username="System",
-                        message=f"--- Recent messages in {room_id} ---",
-                        timestamp=int(time.time() * 1000),
-                        type=chat_pb2.MessageType.SYSTEM,
-                        room_id=room_id
-                    )
-                    self.clients[user_id]['queue'].put(history_header)
-                    
-                    # Send each historical message
-                    for msg in history_messages:
-                        if msg.type in [chat_pb2.MessageType.TEXT, chat_pb2.MessageType.JOIN, chat_pb2.MessageType.LEAVE]:
-                            self.clients[user_id]['queue'].put(msg)
-                    
-                    # Send separator
-                    history_footer = chat_pb2.ChatMessage(
-                        user_id="SYSTEM",
-                        username="System", 
-                        message="--- End of history ---",
-                        timestamp=int(time.time() * 1000),
-                        type=chat_pb2.MessageType.SYSTEM,
-                        room_id=room_id
-                    )
-                    self.clients[user_id]['queue'].put(history_footer)
+            self.cleanup_client(client_info)
+
+    def replay_limit(self):
+        """Most messages a join replays: MAX_REPLAY, or less so the replay and its
+        header and footer fit in an empty outbox without tripping the overflow policy"""
+        if self.queue_size:
+            return max(0, min(MAX_REPLAY, self.queue_size - 2))
+        return MAX_REPLAY
+
+    def replay_in_memory(self, preference):
+        """Whether select_history answers a HistoryPreference without reading the history store"""
+        mode = preference.mode
+        return mode == chat_pb2.HistoryMode.NONE or (
+            mode == chat_pb2.HistoryMode.LAST and (preference.limit or self.history_size) <= self.history_size)
+
+    def select_history(self, room, preference):
+        """Encoded messages to replay on join for a HistoryPreference.
+
+        Returns (frames, seq): seq is the last seq the replay covers, or None
+        when the client asked for no history.
+        """
+        store = self.history_store
+        if preference.mode == chat_pb2.HistoryMode.NONE:
+            return [], None
+
+        limit = min(preference.limit or self.history_size, self.replay_limit())
+        if self.replay_in_memory(preference):
+            frames, last_seq = room.history_snapshot()
+            return frames[max(0, len(frames) - limit):], last_seq
+
+        if preference.mode == chat_pb2.HistoryMode.SINCE:
+            # Only what the client missed; seq N is stored at offset N - 1
+            if preference.since_seq > 0:
+                start = preference.since_seq
+            else:
+                start = store.seek_timestamp(room.room_id, preference.since_ts + 1)
+            limit = self.replay_limit()
+        else:
+            start = 0
+
+        # Capped to the most recent messages
+        start = max(start, store.first_offset(room.room_id), store.next_offset(room.room_id) - limit)
+        frames = [frame for _, frame in store.read(room.room_id, start, limit)]
+        return frames, start + len(frames)
+
+    def send_message_history(self, client_queue, room, preference=None, replay=None):
+        """Queue recent message history for a joining user; returns the last seq replayed
+
+        replay is select_history's result, if the caller has it already.
+        """
+        if replay is None:
+            replay = self.select_history(room, preference or chat_pb2.HistoryPreference())
+        history_messages, replayed_seq = replay
+        if not history_messages:
+            return replayed_seq
+
+        # Send a system message indicating history
+        history_header = chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message=f"--- Recent messages in {room.room_id} ---",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.SYSTEM,
+            room_id=room.room_id
+        )
+        client_queue.put_nowait(history_header.SerializeToString())
+
+        # Send each historical message (stored already encoded)
+        for frame in history_messages:
+            client_queue.put_nowait(frame)
+
+        # Send separator
+        history_footer = chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message="--- End of history ---",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.SYSTEM,
+            room_id=room.room_id
+        )
+        client_queue.put_nowait(history_footer.SerializeToString())
+        return replayed_seq
+
+    def history_page(self, request):
+        """Encoded HistoryPage for a GetHistory request, paging backwards by offset"""
+        store = self.history_store
+        room_id = request.room_id or "general"
+        limit = min(request.limit or self.history_size, MAX_HISTORY_PAGE)
+
+        if request.cursor > 0:
+            end = request.cursor
+        elif request.before_ts > 0:
+            end = store.seek_timestamp(room_id, request.before_ts)
+        else:
+            end = store.next_offset(room_id)
+
+        first = store.first_offset(room_id)
+        start = max(first, end - limit)
+        records = store.read(room_id, start, end - start) if end > start else []
+
+        # Stored frames go out as-is: a repeated message field is just their concatenation
+        page = chat_pb2.HistoryPage(next_cursor=start, has_more=start > first)
+        return encode_message_list(frame for _, frame in records) + page.SerializeToString()
+
+    def compress_if_large(self, context, frame):
+        """Adaptive compression: send a response smaller than compression_min_bytes uncompressed"""
+        if len(frame) < self.compression_min_bytes:
+            context.disable_next_message_compression()
+        return frame
+
+    def GetHistory(self, request, context):
+        return self.compress_if_large(context, self.history_page(request))
+
+    def search_page(self, request):
+        """Encoded HistoryPage of SearchMessages matches, paging backwards from the newest"""
+        room_id = request.room_id or "general"
+        limit = min(request.limit or SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE)
+
+        start = time.perf_counter()
+        # One extra match tells whether there is another page
+        offsets = self.search_index.search(room_id, request.query, request.cursor or None, limit + 1)
+        self.metrics.search_seconds.observe(time.perf_counter() - start)
+        has_more = len(offsets) > limit
+        offsets = offsets[:limit]
+
+        frames = []
+        for offset in reversed(offsets):
+            records = self.history_store.read(room_id, offset, 1)
+            if records and records[0][0] == offset:
+                frames.append(records[0][1])
+        page = chat_pb2.HistoryPage(next_cursor=offsets[-1] if offsets else 0, has_more=has_more)
+        return encode_message_list(frames) + page.SerializeToString()
+
+    def SearchMessages(self, request, context):
+        return self.compress_if_large(context, self.search_page(request))
 
     def broadcast_to_room(self, target_room_id, message, exclude_user=None):
-        """Broadcast message ONLY to users in the specified room"""
-        with self.lock:
-            if target_room_id not in self.rooms:
-                logger.warning(f"Attempted to broadcast to non-existent room: {target_room_id}")
-                return
+        """Broadcast message ONLY to users in the specified room, storing it in history
 
-            # Get users only from the target room
-            room_users = self.rooms[target_room_id].copy()
-            recipients = [uid for uid in room_users if uid != exclude_user]
-            
-            logger.info(f"Broadcasting to room '{target_room_id}': {len(recipients)} recipients")
-
-            for client_user_id in recipients:
-                if client_user_id in self.clients:
-                    client_info = self.clients[client_user_id]
-                    
-                    # Double-check the client is in the correct room
-                    if client_info['room_id'] == target_room_id:
-                        try:
-                            client_info['queue'].put(message)
-                        except Exception as e:
-                            logger.error(f"Error sending to {client_user_id}: {e}")
-                            self.cleanup_client(client_user_id, None, target_room_id)
-
-    def cleanup_client(self, user_id, username, room_id):
-        """Cleanup client data when they disconnect"""
-        if not user_id:
+        The message is encoded once and handed to the broker, which delivers it to
+        this server and to any other server sharing the room (see deliver).
+        """
+        room = self.get_room(target_room_id)
+        if room is None:
+            logger.warning(f"Attempted to broadcast to non-existent room: {target_room_id}")
             return
-        
-        with self.lock:
-            if user_id in self.clients:
-                client_info = self.clients[user_id]
-                username = username or client_info.get('username', 'Unknown')
-                room_id = room_id or client_info.get('room_id', 'general')
-
-                # Signal shutdown to client thread
-                try:
-                    client_info['queue'].put(None)
-                except:
-                    pass
-
-                del self.clients[user_id]
-                logger.info(f"Removed {username} ({user_id}) from clients")
-
-            # Remove from room
-            if room_id in self.rooms and user_id in self.rooms[room_id]:
-                self.rooms[room_id].remove(user_id)
-                
-                # Send leave notification
-                if username:
-                    leave_message = chat_pb2.ChatMessage(
-                        user_id="SYSTEM",
-                        username="System",
-                        message=f"{username} left the room",
-                        timestamp=int(time.time() * 1000),
-                        type=chat_pb2.MessageType.LEAVE,
-                        room_id=room_id
-                    )
-                    
-                    # Store in history
-                    self.message_history[room_id].append(leave_message)
-                    
-                    # Broadcast to remaining users in the room
-                    self.broadcast_to_room(room_id, leave_message)
-
-                # Clean up empty rooms (but keep message history)
-                if not self.rooms[room_id]:
-                    logger.info(f"Room '{room_id}' is now empty (keeping message history)")
-
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_server = ChatServer()
-    chat_pb2_grpc.add_ChatServiceServicer_to_server(chat_server, server)
-
-    listen_addr = '[::]:50051'
-    server.add_insecure_port(listen_addr)
+
+        # Serialize once; every recipient stream gets the same bytes (with the room's seq)
+        frame = message.SerializeToString()
+        self.broker.publish(target_room_id, frame, message.timestamp, exclude_user, room.last_seq)
+
+    def last_seqs(self):
+        """room_id -> last seq recorded, for every room in the history store"""
+        store = self.history_store
+        return {room_id: store.next_offset(room_id) for room_id in store.rooms()}
+
+    def deliver(self, target_room_id, frame, timestamp, exclude_user=None, seq=None):
+        """Record an encoded broadcast and queue it for the room's subscribers on this server
+
+        The same bytes are queued for every recipient (see encode_frame). The room
+        hands back its subscriber tuple, kept up to date by joins and leaves, so
+        fan-out is a plain loop over queues; enqueueing happens outside the room
+        lock so a busy room never holds up other rooms or its own joins and
+        leaves. Rooms first heard of from another server are created here, so
+        every server keeps the room's history from then on. seq comes from the hub, if any.
+        """
+        start = time.perf_counter()
+        room = self.get_room(target_room_id, create=True)
+        frame, subscribers = room.publish(frame, timestamp, seq)
+
+        message_log.debug("Broadcasting to room '%s': %d subscribers", target_room_id, len(subscribers))
+
+        delivered = 0
+        failed = []
+        for user_id, client_queue, client_info in subscribers:
+            if user_id == exclude_user:
+                continue
+            try:
+                client_queue.put_nowait(frame)
+                delivered += 1
+            except Exception as e:
+                logger.error(f"Error sending to {user_id}: {e}")
+                failed.append(client_info)
+
+        metrics = self.metrics
+        metrics.fanout_seconds.observe(time.perf_counter() - start)
+        metrics.messages_published.inc()
+        metrics.messages_delivered.inc(delivered)
+
+        for client_info in failed:
+            self.cleanup_client(client_info)
+
+    def cleanup_client(self, client_info):
+        """Cleanup a session when its stream ends: unregister it and leave all its rooms
+
+        Other sessions of the same user are left alone.
+        """
+        if client_info is None:
+            return
+
+        with client_info['lock']:
+            if client_info['closed']:
+                return
+            client_info['closed'] = True
+
+        self.clients.unregister(client_info)
+        # Signal shutdown to client thread
+        try:
+            client_info['queue'].put_nowait(None)
+        except Exception:
+            pass
+        logger.info(f"Removed {client_info['username']} ({client_info['user_id']}) from clients")
+
+        for room_id in list(client_info['rooms']):
+            self.leave_room(client_info, room_id)
+
+
+ENGINES = ('threaded', 'asyncio')
+COMPRESSION_ALGORITHMS = {
+    'none': grpc.Compression.NoCompression,
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+}
+
+
+def encode_frame(response):
+    """Response serializer: broadcasts and batches arrive pre-encoded, anything else is a message"""
+    if isinstance(response, bytes):
+        return response
+    return response.SerializeToString()
+
+
+def add_chat_service(servicer, server):
+    """Register the ChatService like chat_pb2_grpc does, but with encode_frame for responses"""
+    rpc_method_handlers = {
+        'JoinChat': grpc.stream_stream_rpc_method_handler(
+            servicer.JoinChat,
+            request_deserializer=chat_pb2.ChatMessage.FromString,
+            response_serializer=encode_frame,
+        ),
+        'JoinChatBatched': grpc.stream_stream_rpc_method_handler(
+            servicer.JoinChatBatched,
+            request_deserializer=chat_pb2.ChatMessage.FromString,
+            response_serializer=encode_frame,
+        ),
+        'GetHistory': grpc.unary_unary_rpc_method_handler(
+            servicer.GetHistory,
+            request_deserializer=chat_pb2.HistoryRequest.FromString,
+            response_serializer=encode_frame,
+        ),
+        'SearchMessages': grpc.unary_unary_rpc_method_handler(
+            servicer.SearchMessages,
+            request_deserializer=chat_pb2.SearchRequest.FromString,
+            response_serializer=encode_frame,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler('chat.ChatService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+    server.add_registered_method_handlers('chat.ChatService', rpc_method_handlers)
+
+
+def create_threaded_server(chat_server, listen_addr, max_workers=10):
+    """Build a synchronous gRPC server; every JoinChat stream holds one worker thread"""
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), compression=chat_server.compression)
+    add_chat_service(chat_server, server)
+    port = server.add_insecure_port(listen_addr)
+    return server, port
+
+
+def start_metrics(chat_server, metrics_port):
+    """Serve /metrics over HTTP if a port was given"""
+    if metrics_port is None:
+        return None
+    metrics_server = serve_metrics(chat_server.metrics.registry, metrics_port)
+    logger.info(f"Metrics at http://localhost:{metrics_server.server_port}/metrics")
+    return metrics_server
+
+
+def restore_history(history_store, snapshot_path):
+    """Load the snapshot a drained server left at snapshot_path, if any, then remove it
+
+    A snapshot is only loaded once: after a crash, history since it was taken
+    would be missing and seqs would repeat, so starting empty is no worse.
+    """
+    if not snapshot_path or not os.path.exists(snapshot_path):
+        return
+    start = time.perf_counter()
+    try:
+        messages = load_snapshot(history_store, snapshot_path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Not loading history snapshot {snapshot_path}: {e}")
+        return
+    os.remove(snapshot_path)
+    logger.info(f"Loaded {messages} messages from {snapshot_path} in {time.perf_counter() - start:.2f}s")
+
+
+def save_history(history_store, snapshot_path):
+    """Snapshot an in-memory history store for the next server process"""
+    if not snapshot_path:
+        return
+    start = time.perf_counter()
+    size = write_snapshot(history_store, snapshot_path)
+    if size is None:
+        logger.info("History store is durable; no snapshot needed")
+    else:
+        logger.info(f"Wrote history snapshot {snapshot_path} ({size >> 10} KiB) in {time.perf_counter() - start:.2f}s")
+
+
+def serve(engine='threaded', listen_addr='[::]:50051', max_workers=10, metrics_port=None, drain_seconds=0,
+          snapshot_path=None, **options):
+    """Run the chat server until interrupted (SIGINT or SIGTERM); options are passed to ChatServer
+
+    With drain_seconds, shutting down drains the server (see ChatServer.drain)
+    instead of cutting every stream at once. With snapshot_path, an in-memory
+    history store is loaded from it on startup and written to it on the way out.
+    """
+    if threading.current_thread() is threading.main_thread():
+        # Supervisors stop servers with SIGTERM; shut down the same way as on Ctrl-C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if engine == 'asyncio':
+        import asyncio
+        from aio_chat_server import serve_aio
+        try:
+            asyncio.run(serve_aio(listen_addr, metrics_port, drain_seconds, snapshot_path, **options))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    chat_server = ChatServer(**options)
+    restore_history(chat_server.history_store, snapshot_path)
+    server, _ = create_threaded_server(chat_server, listen_addr, max_workers)
+    start_metrics(chat_server, metrics_port)
 
     logger.info(f"Enhanced gRPC Chat Server listening on {listen_addr}")
-    logger.info("Features: Room isolation, Message history, Better logging")
+    logger.info(f"Features: Room isolation, Message history, Better logging (engine: threaded, {max_workers} workers)")
     server.start()
 
     try:
         server.wait_for_termination()
     except KeyboardInterrupt:
         logger.info("Shutting down server...")
-        server.stop(0)
+        if drain_seconds > 0:
+            # Stop listening first, so reconnecting clients find the next process
+            stopped = server.stop(DRAIN_GRACE)
+            chat_server.drain(drain_seconds)
+            stopped.wait()
+        else:
+            server.stop(0)
+    finally:
+        chat_server.presence.close()
+        chat_server.broker.close()
+        save_history(chat_server.history_store, snapshot_path)
+        chat_server.history_store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gRPC bidirectional streaming chat server")
+    parser.add_argument('--engine', choices=ENGINES, default='threaded',
+                        help="threaded: one worker thread per stream; asyncio: grpc.aio coroutines")
+    parser.add_argument('--address', default='[::]:50051', help="listen address (default: [::]:50051)")
+    parser.add_argument('--max-workers', type=int, default=10,
+                        help="worker threads for the threaded engine; caps concurrent streams")
+    parser.add_argument('--queue-size', type=int, default=1000,
+                        help="per-client outbound queue bound, 0 for unbounded (default: 1000)")
+    parser.add_argument('--overflow-policy', choices=OVERFLOW_POLICIES, default='drop_oldest',
+                        help="what to do when a slow client's queue is full")
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help="JoinChatBatched: max messages per batch (default: 64)")
+    parser.add_argument('--batch-delay-ms', type=float, default=5.0,
+                        help="JoinChatBatched: max time a batch waits to fill (default: 5ms)")
+    parser.add_argument('--presence-interval-ms', type=float, default=1000,
+                        help="announce a room's joins and leaves as one digest this often, "
+                             "0 to announce each at once (default: 1000)")
+    parser.add_argument('--user-rate', type=float, default=0,
+                        help="messages per second each user may post, 0 for no limit (default: 0)")
+    parser.add_argument('--user-burst', type=int, default=10,
+                        help="messages a user may post at once before --user-rate applies (default: 10)")
+    parser.add_argument('--room-rate', type=float, default=0,
+                        help="messages per second each room accepts, 0 for no limit (default: 0)")
+    parser.add_argument('--room-burst', type=int, default=100,
+                        help="messages a room accepts at once before --room-rate applies (default: 100)")
+    parser.add_argument('--rate-limit-policy', choices=RATE_LIMIT_POLICIES, default='reject',
+                        help="reject: drop messages over a limit; delay: hold them back until they fit "
+                             "(default: reject)")
+    parser.add_argument('--compression', choices=COMPRESSION_ALGORITHMS, default='none',
+                        help="compress responses with gzip or deflate (default: none)")
+    parser.add_argument('--compression-min-bytes', type=int, default=1024,
+                        help="with --compression, send responses smaller than this uncompressed, so only "
+                             "history pages, batches and long messages are compressed; 0 compresses all "
+                             "(default: 1024)")
+    parser.add_argument('--drain-seconds', type=float, default=5.0,
+                        help="on shutdown, ask clients to reconnect at random within this many seconds "
+                             "instead of all at once; 0 cuts every stream immediately (default: 5)")
+    parser.add_argument('--snapshot',
+                        help="file the memory and compact history stores are saved to on shutdown and "
+                             "loaded from on startup, so a restart keeps history (default: off)")
+    parser.add_argument('--metrics-port', type=int,
+                        help="serve Prometheus metrics at http://HOST:PORT/metrics (default: off)")
+    parser.add_argument('--log-level', default='INFO', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('--log-mode', choices=LOG_MODES, default='async',
+                        help="async: log records are written by a background thread (default); sync: inline")
+    parser.add_argument('--message-log-rate', type=float, default=50,
+                        help="max per-message log lines per second, 0 for no limit (default: 50)")
+    parser.add_argument('--message-log-sample', type=int, default=1,
+                        help="log one in every N per-message events (default: 1)")
+    parser.add_argument('--broker', choices=BROKERS, default='local',
+                        help="local: rooms live in this process; hub: share rooms with other servers through hub.py")
+    parser.add_argument('--hub-socket', default='/tmp/chat-hub.sock',
+                        help="Unix socket of the hub for --broker hub (default: /tmp/chat-hub.sock)")
+    parser.add_argument('--history-store', choices=HISTORY_STORES, default='log',
+                        help="log: durable segmented log per room; memory: lost on restart; "
+                             "compact: in memory too, several times denser")
+    parser.add_argument('--history-dir', default='chat_history',
+                        help="directory for the log history store (default: ./chat_history)")
+    parser.add_argument('--history-max-messages', type=int,
+                        help="messages kept per room by the memory (default: 10000) and compact (default: 100000) stores")
+    args = parser.parse_args()
+
+    log_listener = configure_logging(args.log_level, args.log_mode, args.message_log_rate, args.message_log_sample)
+
+    retention = {} if args.history_max_messages is None else {'max_messages': args.history_max_messages}
+    if args.history_store == 'log':
+        history_store = LogHistoryStore(args.history_dir)
+    elif args.history_store == 'compact':
+        history_store = CompactHistoryStore(**retention)
+    else:
+        history_store = MemoryHistoryStore(**retention)
+    broker = HubBroker(args.hub_socket) if args.broker == 'hub' else InProcessBroker()
+    rate_limiter = RateLimiter(args.user_rate, args.user_burst, args.room_rate, args.room_burst,
+                               args.rate_limit_policy)
+
+    try:
+        serve(args.engine, args.address, args.max_workers, args.metrics_port, args.drain_seconds, args.snapshot,
+              queue_size=args.queue_size, overflow_policy=args.overflow_policy, history_store=history_store,
+              batch_size=args.batch_size, batch_delay=args.batch_delay_ms / 1000, broker=broker,
+              compression=args.compression, compression_min_bytes=args.compression_min_bytes,
+              presence_interval=args.presence_interval_ms / 1000, rate_limiter=rate_limiter)
+    finally:
+        if log_listener is not None:
+            log_listener.stop()  # flush what is still queued
+
 
 if __name__ == '__main__':
-    serve()
\ No newline at end of file
+    main()
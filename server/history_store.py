@@ -0,0 +1,753 @@
+import bisect
+import os
+import struct
+import sys
+import threading
+from array import array
+from collections import Counter, deque
+from itertools import accumulate, islice
+from urllib.parse import quote, unquote
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import chat_pb2
+from wire import WIRETYPE_LENGTH_DELIMITED, WIRETYPE_VARINT, encode_varint
+
+# Log records: 4-byte big-endian length, then the encoded ChatMessage
+RECORD_HEADER = struct.Struct('>I')
+# Sparse index entries: record offset, message timestamp (ms), byte position in the segment
+INDEX_ENTRY = struct.Struct('>qqq')
+
+HISTORY_STORES = ('log', 'memory', 'compact')
+# Rooms are directories in the log store; an id this long quotes to at most 240 characters
+MAX_ROOM_ID_BYTES = 80
+
+
+def room_directory(room_id):
+    """The log store's directory name for a room; distinct rooms get distinct names
+
+    quote() escapes everything but letters, digits and '_.-~', so a name never
+    holds a separator. '.' and '..' would still be the store itself and its
+    parent, so their dots are escaped too; quote() never writes '%2E' itself.
+    """
+    name = quote(room_id, safe='')
+    if name in ('.', '..'):
+        name = name.replace('.', '%2E')
+    return name
+
+
+class MemoryHistoryStore:
+    """Room history kept in process memory only; lost on restart.
+
+    Like every history store, records are encoded ChatMessage frames addressed by
+    a per-room offset that starts at 0 and only grows.
+    """
+
+    snapshot_kind = 'memory'  # see snapshot.py
+
+    def __init__(self, max_messages=10000):
+        self.max_messages = max_messages
+        self._rooms = {}  # room_id -> [next_offset, deque of (offset, timestamp, frame), bytes retained]
+        self._lock = threading.Lock()
+
+    def append(self, room_id, frame, timestamp):
+        """Store an encoded message; returns its offset"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = [0, deque(maxlen=self.max_messages), 0]
+            offset = room[0]
+            if len(room[1]) == self.max_messages:
+                room[2] -= len(room[1][0][2])  # about to be evicted
+            room[1].append((offset, timestamp, frame))
+            room[2] += len(frame)
+            room[0] += 1
+            return offset
+
+    def skip_to(self, room_id, offset):
+        """Drop the room's messages and carry on at offset (see rooms.Room.publish)"""
+        with self._lock:
+            self._rooms[room_id] = [offset, deque(maxlen=self.max_messages), 0]
+
+    def read(self, room_id, start_offset, limit):
+        """Up to limit (offset, frame) pairs from start_offset onwards, oldest first"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or not room[1]:
+                return []
+            records = room[1]
+            first = records[0][0]
+            start = max(0, start_offset - first)
+            return [(offset, frame) for offset, _, frame in islice(records, start, start + limit)]
+
+    def tail(self, room_id, limit):
+        """The most recent limit frames, oldest first"""
+        start = max(0, self.next_offset(room_id) - limit)
+        return [frame for _, frame in self.read(room_id, start, limit)]
+
+    def seek_timestamp(self, room_id, timestamp):
+        """Offset of the first retained message stamped at or after timestamp"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return 0
+            result = room[0]
+            for offset, stamped, _ in reversed(room[1]):
+                if stamped < timestamp:
+                    break
+                result = offset
+            return result
+
+    def first_offset(self, room_id):
+        """Offset of the oldest retained message"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return 0
+            return room[1][0][0] if room[1] else room[0]
+
+    def next_offset(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return room[0] if room else 0
+
+    def rooms(self):
+        with self._lock:
+            return list(self._rooms)
+
+    def stats(self):
+        """room_id -> (messages, bytes) retained"""
+        with self._lock:
+            return {room_id: (len(room[1]), room[2]) for room_id, room in self._rooms.items()}
+
+    def dump(self, writer):
+        """Write every room to a snapshot.SnapshotWriter: timestamps and frame lengths as arrays, then the frames"""
+        with self._lock:
+            rooms = [(room_id, room[0], list(room[1])) for room_id, room in self._rooms.items()]
+        writer.int(len(rooms))
+        for room_id, next_offset, records in rooms:
+            writer.string(room_id)
+            writer.int(next_offset)
+            writer.array(array('q', [timestamp for _, timestamp, _ in records]))
+            writer.array(array('I', [len(frame) for _, _, frame in records]))
+            writer.bytes(b''.join([frame for _, _, frame in records]))
+
+    def load(self, reader):
+        """Fill an empty store from what dump wrote; returns the number of messages kept"""
+        rooms = {}
+        for _ in range(reader.int()):
+            room_id = reader.string()
+            next_offset = reader.int()
+            timestamps = reader.array('q')
+            lengths = reader.array('I')
+            frames = bytes(reader.bytes())
+            ends = list(accumulate(lengths))
+            starts = [0] + ends[:-1]
+            # The deque keeps the newest max_messages, as appending them one by one would
+            records = deque(zip(range(next_offset - len(lengths), next_offset), timestamps,
+                                map(frames.__getitem__, map(slice, starts, ends))), maxlen=self.max_messages)
+            rooms[room_id] = [next_offset, records, sum(lengths[len(lengths) - len(records):])]
+        with self._lock:
+            if self._rooms:
+                raise ValueError("Snapshots only load into an empty store")
+            self._rooms = rooms
+        return sum(len(room[1]) for room in rooms.values())
+
+    def close(self):
+        pass
+
+
+def encode_string_field(field_number, value):
+    """A string field on the wire; proto3 leaves empty strings out"""
+    if not value:
+        return b''
+    data = value.encode()
+    return encode_varint(field_number << 3 | WIRETYPE_LENGTH_DELIMITED) + encode_varint(len(data)) + data
+
+
+HAS_SEQ = 0x80  # flag in CompactRoom.kinds: the message carried seq = offset + 1
+# Tags of the ChatMessage fields rebuilt from columns
+MESSAGE_TAG = encode_varint(3 << 3 | WIRETYPE_LENGTH_DELIMITED)
+TIMESTAMP_TAG = encode_varint(4 << 3 | WIRETYPE_VARINT)
+TYPE_TAG = encode_varint(5 << 3 | WIRETYPE_VARINT)
+SEQ_TAG = encode_varint(8 << 3 | WIRETYPE_VARINT)
+
+
+class HistoryRecord:
+    """A view of one message of a CompactHistoryStore, decoded from its columns"""
+
+    __slots__ = ('offset', 'timestamp', 'user_id', 'username', 'type', 'message', 'room_id', 'seq')
+
+    def __init__(self, offset, timestamp, user_id, username, type, message, room_id, seq):
+        self.offset = offset
+        self.timestamp = timestamp
+        self.user_id = user_id
+        self.username = username
+        self.type = type
+        self.message = message
+        self.room_id = room_id
+        self.seq = seq
+
+
+class _CompactRoom:
+    """One room's messages as parallel columns plus one arena holding every body.
+
+    Row i is offset first_offset + i. ends holds the arena position just past each
+    body, counted from the room's first message ever, so trimming the oldest rows
+    only needs arena_base to move.
+    """
+
+    __slots__ = ('room_id', 'room_field', 'first_offset', 'timestamps', 'senders', 'kinds', 'ends',
+                 'arena', 'arena_base')
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.room_field = encode_string_field(6, room_id)  # ChatMessage.room_id, the same for every row
+        self.first_offset = 0
+        self.timestamps = array('q')
+        self.senders = array('I')  # index into CompactHistoryStore identities
+        self.kinds = array('B')  # MessageType | HAS_SEQ
+        self.ends = array('Q')
+        self.arena = bytearray()  # UTF-8 bodies, back to back
+        self.arena_base = 0  # arena position of arena[0]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def body(self, i):
+        start = self.ends[i - 1] if i else self.arena_base
+        return bytes(self.arena[start - self.arena_base:self.ends[i] - self.arena_base])
+
+    def trim(self, count):
+        """Forget the oldest count rows"""
+        cut = self.ends[count - 1] - self.arena_base
+        for column in (self.timestamps, self.senders, self.kinds, self.ends):
+            del column[:count]
+        del self.arena[:cut]
+        self.arena_base += cut
+        self.first_offset += count
+
+    def nbytes(self):
+        columns = (self.timestamps, self.senders, self.kinds, self.ends)
+        return len(self.arena) + sum(len(column) * column.itemsize for column in columns)
+
+
+class CompactHistoryStore:
+    """Room history kept in process memory in a columnar layout; lost on restart.
+
+    MemoryHistoryStore keeps every frame as its own bytes object in a tuple, and
+    every frame repeats the sender's user_id, username and the room_id. Here
+    each room is a handful of arrays (timestamp, sender, type) and one arena of
+    message bodies. Senders are interned per store and freed once no retained
+    row refers to them, the room_id and seq (offset + 1) are implied by the row,
+    so a message costs its body plus about 21 bytes. Frames are rebuilt from the columns on read, byte for byte what
+    the server would encode, minus fields history never carries (history).
+
+    Each room keeps at least max_messages. To keep trimming cheap the oldest
+    quarter is dropped at once, so up to a quarter more may be retained.
+    """
+
+    snapshot_kind = 'compact'  # see snapshot.py
+
+    def __init__(self, max_messages=100000):
+        self.max_messages = max_messages
+        self._slack = max(1, max_messages // 4)
+        self._rooms = {}  # room_id -> _CompactRoom
+        self._identities = []  # (user_id, username, encoded fields 1 and 2), None once freed
+        self._identity_index = {}  # (user_id, username) -> index into _identities
+        self._refs = []  # rows referring to each identity
+        self._free = []  # freed indexes into _identities, reused first
+        self._lock = threading.Lock()
+
+    def _sender(self, user_id, username):
+        """Intern a new sender; caller holds the lock"""
+        fields = encode_string_field(1, user_id) + encode_string_field(2, username)
+        if self._free:
+            index = self._free.pop()
+            self._identities[index] = (user_id, username, fields)
+        else:
+            index = len(self._identities)
+            self._identities.append((user_id, username, fields))
+            self._refs.append(0)
+        self._identity_index[(user_id, username)] = index
+        return index
+
+    def _release(self, senders):
+        """Drop the rows' references to their senders and free the unused ones; caller holds the lock"""
+        for index, count in Counter(senders).items():
+            self._refs[index] -= count
+            if not self._refs[index]:
+                user_id, username, _ = self._identities[index]
+                del self._identity_index[(user_id, username)]
+                self._identities[index] = None
+                self._free.append(index)
+
+    def append(self, room_id, frame, timestamp):
+        """Store an encoded message; returns its offset"""
+        message = chat_pb2.ChatMessage.FromString(frame)
+        body = message.message.encode()
+        sender = (message.user_id, message.username)
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = _CompactRoom(room_id)
+            offset = room.first_offset + len(room)
+            room.timestamps.append(timestamp)
+            index = self._identity_index.get(sender)
+            if index is None:
+                index = self._sender(*sender)
+            self._refs[index] += 1
+            room.senders.append(index)
+            room.kinds.append(message.type | (HAS_SEQ if message.seq == offset + 1 else 0))
+            room.arena += body
+            room.ends.append(room.arena_base + len(room.arena))
+            if len(room) >= self.max_messages + self._slack:
+                self._release(room.senders[:self._slack])
+                room.trim(self._slack)
+            return offset
+
+    def skip_to(self, room_id, offset):
+        """Drop the room's messages and carry on at offset (see rooms.Room.publish)"""
+        room = _CompactRoom(room_id)
+        room.first_offset = offset
+        with self._lock:
+            old = self._rooms.get(room_id)
+            if old is not None:
+                self._release(old.senders)
+            self._rooms[room_id] = room
+
+    def _record(self, room, i):
+        """HistoryRecord for row i of a room; caller holds the lock"""
+        user_id, username, _ = self._identities[room.senders[i]]
+        kind = room.kinds[i]
+        offset = room.first_offset + i
+        return HistoryRecord(offset, room.timestamps[i], user_id, username, kind & ~HAS_SEQ,
+                             room.body(i).decode(), room.room_id, offset + 1 if kind & HAS_SEQ else 0)
+
+    def _frame(self, room, i):
+        """Encoded ChatMessage for row i of a room; caller holds the lock"""
+        # Fields in number order, as SerializeToString and with_seq would write them
+        parts = [self._identities[room.senders[i]][2]]
+        base = room.arena_base
+        start = room.ends[i - 1] if i else base
+        end = room.ends[i]
+        if end > start:
+            parts += (MESSAGE_TAG, encode_varint(end - start), room.arena[start - base:end - base])
+        timestamp = room.timestamps[i]
+        if timestamp:
+            parts += (TIMESTAMP_TAG, encode_varint(timestamp))
+        kind = room.kinds[i]
+        if kind & ~HAS_SEQ:
+            parts += (TYPE_TAG, encode_varint(kind & ~HAS_SEQ))
+        parts.append(room.room_field)
+        if kind & HAS_SEQ:
+            parts += (SEQ_TAG, encode_varint(room.first_offset + i + 1))
+        return b''.join(parts)
+
+    def _rows(self, room_id, start_offset, limit):
+        """The room and the row range for up to limit messages from start_offset; caller holds the lock"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            return None, range(0)
+        start = max(0, start_offset - room.first_offset)
+        return room, range(start, min(len(room), start + max(0, limit)))
+
+    def read(self, room_id, start_offset, limit):
+        """Up to limit (offset, frame) pairs from start_offset onwards, oldest first"""
+        with self._lock:
+            room, rows = self._rows(room_id, start_offset, limit)
+            return [(room.first_offset + i, self._frame(room, i)) for i in rows]
+
+    def records(self, room_id, start_offset, limit):
+        """Like read, but HistoryRecord views instead of encoded frames"""
+        with self._lock:
+            room, rows = self._rows(room_id, start_offset, limit)
+            return [self._record(room, i) for i in rows]
+
+    def tail(self, room_id, limit):
+        """The most recent limit frames, oldest first"""
+        start = max(0, self.next_offset(room_id) - limit)
+        return [frame for _, frame in self.read(room_id, start, limit)]
+
+    def seek_timestamp(self, room_id, timestamp):
+        """Offset of the first retained message stamped at or after timestamp"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return 0
+            return room.first_offset + bisect.bisect_left(room.timestamps, timestamp)
+
+    def first_offset(self, room_id):
+        """Offset of the oldest retained message"""
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return room.first_offset if room else 0
+
+    def next_offset(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return room.first_offset + len(room) if room else 0
+
+    def rooms(self):
+        with self._lock:
+            return list(self._rooms)
+
+    def stats(self):
+        """room_id -> (messages, bytes) retained"""
+        with self._lock:
+            return {room_id: (len(room), room.nbytes()) for room_id, room in self._rooms.items()}
+
+    def dump(self, writer):
+        """Write the senders and every room's columns and arena to a snapshot.SnapshotWriter
+
+        Freed senders are written as empty strings so the rows' indexes still hold.
+        """
+        with self._lock:
+            writer.int(len(self._identities))
+            for identity in self._identities:
+                user_id, username, _ = identity or ('', '', None)
+                writer.string(user_id)
+                writer.string(username)
+            writer.int(len(self._rooms))
+            for room in self._rooms.values():
+                writer.string(room.room_id)
+                writer.int(room.first_offset)
+                writer.int(room.arena_base)
+                for column in (room.timestamps, room.senders, room.kinds, room.ends):
+                    writer.array(column)
+                writer.bytes(room.arena)
+
+    def load(self, reader):
+        """Fill an empty store from what dump wrote; returns the number of messages kept
+
+        Columns and arenas are copied in whole; the only per-message work is
+        counting each sender's rows, in C.
+        """
+        with self._lock:
+            if self._rooms or self._identities:
+                raise ValueError("Snapshots only load into an empty store")
+            senders = [(reader.string(), reader.string()) for _ in range(reader.int())]
+            loaded = 0
+            for _ in range(reader.int()):
+                room = _CompactRoom(reader.string())
+                room.first_offset = reader.int()
+                room.arena_base = reader.int()
+                room.timestamps = reader.array('q')
+                room.senders = reader.array('I')
+                room.kinds = reader.array('B')
+                room.ends = reader.array('Q')
+                room.arena = bytearray(reader.bytes())
+                if len(room) >= self.max_messages + self._slack:
+                    room.trim(len(room) - self.max_messages)
+                self._rooms[room.room_id] = room
+                loaded += len(room)
+            refs = Counter()
+            for room in self._rooms.values():
+                refs.update(room.senders)
+            # Senders no kept row refers to (freed, or trimmed just now) start out free
+            for index, (user_id, username) in enumerate(senders):
+                if refs[index]:
+                    fields = encode_string_field(1, user_id) + encode_string_field(2, username)
+                    self._identities.append((user_id, username, fields))
+                    self._identity_index[(user_id, username)] = index
+                else:
+                    self._identities.append(None)
+                    self._free.append(index)
+            self._refs = [refs[index] for index in range(len(senders))]
+        return loaded
+
+    def close(self):
+        pass
+
+
+class _Segment:
+    """One log file of a room plus its sparse index"""
+
+    __slots__ = ('base_offset', 'log_path', 'index_path', 'index', 'size')
+
+    def __init__(self, directory, base_offset):
+        self.base_offset = base_offset
+        self.log_path = os.path.join(directory, f"{base_offset:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_offset:020d}.idx")
+        self.index = []  # (offset, timestamp, position), every index_interval records
+        self.size = 0
+
+    def load_index(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        self.index = [entry for entry in INDEX_ENTRY.iter_unpack(data[:usable])]
+
+    def seek_position(self, offset):
+        """Byte position and offset of the closest indexed record at or before offset"""
+        i = bisect.bisect_right(self.index, (offset, float('inf'), float('inf'))) - 1
+        if i < 0:
+            return 0, self.base_offset
+        return self.index[i][2], self.index[i][0]
+
+
+class _RoomLog:
+    """Append-only segmented log for one room"""
+
+    def __init__(self, directory, segment_bytes, max_segments, index_interval, fsync):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self.segments = []
+        self.next_offset = 0
+        self.lock = threading.Lock()
+        self._log_file = None
+        self._index_file = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Discover segments and recover the end of the last one after a crash"""
+        bases = sorted(int(name[:-4]) for name in os.listdir(self.directory) if name.endswith('.log'))
+        for base in bases:
+            segment = _Segment(self.directory, base)
+            segment.load_index()
+            segment.size = os.path.getsize(segment.log_path)
+            self.segments.append(segment)
+        if not self.segments:
+            return
+
+        last = self.segments[-1]
+        position, offset = last.seek_position(float('inf'))
+        with open(last.log_path, 'rb') as f:
+            f.seek(position)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                length, = RECORD_HEADER.unpack(header)
+                if len(f.read(length)) < length:
+                    break
+                position += RECORD_HEADER.size + length
+                offset += 1
+
+        if position < last.size:
+            # Drop a torn write at the end, and any index entries pointing into it
+            with open(last.log_path, 'r+b') as f:
+                f.truncate(position)
+            last.size = position
+            last.index = [entry for entry in last.index if entry[2] < position]
+        if os.path.exists(last.index_path):
+            with open(last.index_path, 'r+b') as f:
+                f.truncate(len(last.index) * INDEX_ENTRY.size)
+        self.next_offset = offset
+
+    def _active_segment(self):
+        """The segment to append to, rolling to a new one when the newest is full"""
+        if self.segments and self.segments[-1].size < self.segment_bytes:
+            active = self.segments[-1]
+        else:
+            self._close_files()
+            active = _Segment(self.directory, self.next_offset)
+            self.segments.append(active)
+            # Retention: the oldest segments go once the room exceeds its disk budget
+            while len(self.segments) > self.max_segments:
+                expired = self.segments.pop(0)
+                for path in (expired.log_path, expired.index_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+        if self._log_file is None:
+            self._log_file = open(active.log_path, 'ab')
+            self._index_file = open(active.index_path, 'ab')
+        return active
+
+    def append(self, frame, timestamp):
+        with self.lock:
+            active = self._active_segment()
+            offset = self.next_offset
+
+            if (offset - active.base_offset) % self.index_interval == 0:
+                entry = (offset, timestamp, active.size)
+                active.index.append(entry)
+                self._index_file.write(INDEX_ENTRY.pack(*entry))
+                self._index_file.flush()
+
+            self._log_file.write(RECORD_HEADER.pack(len(frame)))
+            self._log_file.write(frame)
+            self._log_file.flush()
+            if self.fsync:
+                os.fsync(self._log_file.fileno())
+            active.size += RECORD_HEADER.size + len(frame)
+            self.next_offset += 1
+            return offset
+
+    def skip_to(self, offset):
+        """Delete every segment and start an empty one at offset"""
+        with self.lock:
+            self._close_files()
+            for segment in self.segments:
+                for path in (segment.log_path, segment.index_path):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            self.segments = []
+            self.next_offset = offset
+            self._active_segment()  # its empty files keep offset across a restart
+
+    def read(self, start_offset, limit):
+        with self.lock:
+            if not self.segments or limit <= 0:
+                return []
+            start_offset = max(start_offset, self.segments[0].base_offset)
+            i = bisect.bisect_right([s.base_offset for s in self.segments], start_offset) - 1
+            records = []
+            for segment in self.segments[max(i, 0):]:
+                position, offset = segment.seek_position(start_offset)
+                with open(segment.log_path, 'rb') as f:
+                    f.seek(position)
+                    while len(records) < limit and position < segment.size:
+                        length, = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                        if offset >= start_offset:
+                            records.append((offset, f.read(length)))
+                        else:
+                            f.seek(length, os.SEEK_CUR)
+                        position += RECORD_HEADER.size + length
+                        offset += 1
+                if len(records) >= limit:
+                    break
+            return records
+
+    def seek_timestamp(self, timestamp):
+        with self.lock:
+            # The last segment whose first record is older than timestamp
+            firsts = [s.index[0][1] if s.index else float('-inf') for s in self.segments]
+            i = bisect.bisect_left(firsts, timestamp) - 1
+            if i < 0:
+                return self.segments[0].base_offset if self.segments else self.next_offset
+            segment = self.segments[i]
+
+            # Then the last index entry older than timestamp, and scan from there
+            j = bisect.bisect_left([entry[1] for entry in segment.index], timestamp) - 1
+            offset, _, position = segment.index[j] if j >= 0 else (segment.base_offset, 0, 0)
+            with open(segment.log_path, 'rb') as f:
+                f.seek(position)
+                while position < segment.size:
+                    length, = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    if chat_pb2.ChatMessage.FromString(f.read(length)).timestamp >= timestamp:
+                        return offset
+                    position += RECORD_HEADER.size + length
+                    offset += 1
+            # Everything in this segment is older; the next one starts at or after timestamp
+            return self.segments[i + 1].base_offset if i + 1 < len(self.segments) else self.next_offset
+
+    def first_offset(self):
+        with self.lock:
+            return self.segments[0].base_offset if self.segments else self.next_offset
+
+    def stats(self):
+        with self.lock:
+            first = self.segments[0].base_offset if self.segments else self.next_offset
+            return self.next_offset - first, sum(segment.size for segment in self.segments)
+
+    def _close_files(self):
+        for f in (self._log_file, self._index_file):
+            if f is not None:
+                f.close()
+        self._log_file = None
+        self._index_file = None
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+
+
+class LogHistoryStore:
+    """Durable room history: a segmented append-only log per room.
+
+    Each room gets a directory of segments named by the offset of their first
+    record. Segments roll over at segment_bytes and only the newest max_segments
+    are kept, so each room's disk usage is bounded. Every index_interval-th record
+    gets a sparse index entry (offset, timestamp, position), which lets reads seek
+    close to any offset or time without scanning the whole segment.
+    """
+
+    def __init__(self, directory, segment_bytes=8 << 20, max_segments=16, index_interval=64, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.index_interval = index_interval
+        self.fsync = fsync
+        self._logs = {}  # room_id -> _RoomLog, opened on first use
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _log(self, room_id, create=False):
+        """The room's log; rooms without history on disk are only created by appends
+
+        Raises ValueError when creating a room whose id is over MAX_ROOM_ID_BYTES.
+        """
+        log = self._logs.get(room_id)
+        if log is None:
+            if len(room_id.encode()) > MAX_ROOM_ID_BYTES:
+                if not create:
+                    return None
+                raise ValueError(f"Room id is over {MAX_ROOM_ID_BYTES} bytes")
+            directory = os.path.join(self.directory, room_directory(room_id))
+            if not create and not os.path.isdir(directory):
+                return None
+            with self._lock:
+                log = self._logs.get(room_id)
+                if log is None:
+                    log = self._logs[room_id] = _RoomLog(
+                        directory, self.segment_bytes, self.max_segments, self.index_interval, self.fsync)
+        return log
+
+    def append(self, room_id, frame, timestamp):
+        """Store an encoded message; returns its offset"""
+        return self._log(room_id, create=True).append(frame, timestamp)
+
+    def skip_to(self, room_id, offset):
+        """Drop the room's messages and carry on at offset (see rooms.Room.publish)"""
+        self._log(room_id, create=True).skip_to(offset)
+
+    def read(self, room_id, start_offset, limit):
+        """Up to limit (offset, frame) pairs from start_offset onwards, oldest first"""
+        log = self._log(room_id)
+        return log.read(start_offset, limit) if log else []
+
+    def tail(self, room_id, limit):
+        """The most recent limit frames, oldest first"""
+        start = max(0, self.next_offset(room_id) - limit)
+        return [frame for _, frame in self.read(room_id, start, limit)]
+
+    def seek_timestamp(self, room_id, timestamp):
+        """Offset of the first retained message stamped at or after timestamp"""
+        log = self._log(room_id)
+        return log.seek_timestamp(timestamp) if log else 0
+
+    def first_offset(self, room_id):
+        """Offset of the oldest retained message"""
+        log = self._log(room_id)
+        return log.first_offset() if log else 0
+
+    def next_offset(self, room_id):
+        log = self._log(room_id)
+        return log.next_offset if log else 0
+
+    def rooms(self):
+        return [unquote(name) for name in os.listdir(self.directory)
+                if os.path.isdir(os.path.join(self.directory, name))]
+
+    def stats(self):
+        """room_id -> (messages, bytes) retained, for rooms opened since startup"""
+        with self._lock:
+            logs = list(self._logs.items())
+        return {room_id: log.stats() for room_id, log in logs}
+
+    def close(self):
+        with self._lock:
+            for log in self._logs.values():
+                log.close()
@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import logging
+import os
+
+from broker import sequence_packets, split_packets
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MAX_BUFFERED = 64 << 20  # bytes queued for one server before it is cut off
+
+
+class Hub:
+    """Relays every packet a chat server publishes to all connected chat servers.
+
+    The hub never decodes messages: it reads whatever arrived, stamps each
+    complete packet in it with the room's next seq, and forwards them with one
+    write per server. Packets from one server keep their order, and every
+    server receives all packets, and so every seq, in the same order.
+    Seqs live in memory only; servers report theirs when they (re)connect.
+    A server that stops reading is disconnected rather than buffered forever; it
+    reconnects on its own.
+    """
+
+    def __init__(self, max_buffered=MAX_BUFFERED):
+        self.max_buffered = max_buffered
+        self.writers = set()
+        self.seqs = {}  # room_id (encoded) -> last seq handed out
+
+    async def handle_server(self, reader, writer):
+        self.writers.add(writer)
+        logger.info(f"Chat server connected ({len(self.writers)} total)")
+        buffer = b''
+        try:
+            while True:
+                chunk = await reader.read(1 << 16)
+                if not chunk:
+                    break
+                buffer += chunk
+                end = split_packets(buffer)
+                if not end:
+                    continue
+                packets, buffer = sequence_packets(buffer[:end], self.seqs), buffer[end:]
+                if not packets:
+                    continue
+                for target in list(self.writers):
+                    if target.transport.get_write_buffer_size() > self.max_buffered:
+                        logger.warning("Disconnecting a chat server that stopped reading")
+                        self.writers.discard(target)
+                        target.close()
+                        continue
+                    target.write(packets)
+        except ConnectionError:
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+            logger.info(f"Chat server disconnected ({len(self.writers)} left)")
+
+
+async def serve_hub(path):
+    if os.path.exists(path):
+        os.unlink(path)  # left over from a previous run
+    hub = Hub()
+    server = await asyncio.start_unix_server(hub.handle_server, path)
+    logger.info(f"Chat hub listening on {path}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Relay hub that lets several chat server processes share rooms")
+    parser.add_argument('--socket', default='/tmp/chat-hub.sock', help="Unix socket path (default: /tmp/chat-hub.sock)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_hub(args.socket))
+    except KeyboardInterrupt:
+        logger.info("Shutting down hub...")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+"""Metrics in the Prometheus text exposition format, without extra dependencies.
+
+Hot-path metrics (counters, histograms, timed locks) cost one uncontended lock and
+a couple of additions per update. Anything that can be read off existing state
+(client counts, queue depths, history sizes) is computed by collectors only when
+/metrics is scraped, so it costs nothing in between.
+"""
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; suits fan-out and lock timings from microseconds up to a stalled second
+LATENCY_BUCKETS = (1e-6, 5e-6, 1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1.0)
+QUEUE_DEPTH_BUCKETS = (0, 1, 10, 100, 1000, 10000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{escape(str(value))}"' for key, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, None, self.value)]
+
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        return [(self.name, None, self.value)]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = tuple(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        return histogram_samples(self.name, self.bounds, counts, total)
+
+
+def histogram_samples(name, bounds, counts, total, labels=None):
+    """Cumulative bucket, sum and count samples for per-bucket counts"""
+    samples = []
+    cumulative = 0
+    for bound, count in zip(bounds + (float('inf'),), counts):
+        cumulative += count
+        samples.append((f'{name}_bucket', dict(labels or {}, le=format_value(float(bound))), cumulative))
+    samples.append((f'{name}_sum', labels, total))
+    samples.append((f'{name}_count', labels, cumulative))
+    return samples
+
+
+class Collected:
+    """A metric whose samples are computed by a callback at scrape time"""
+
+    def __init__(self, name, kind, help, collect):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.collect = collect  # returns [(sample name, labels, value)]
+
+    def samples(self):
+        return self.collect()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def collected(self, name, kind, help, collect):
+        return self.register(Collected(name, kind, help, collect))
+
+    def exposition(self):
+        """Every metric in the Prometheus text format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class TimedLock:
+    """threading.Lock that records how long callers wait for it and hold it.
+
+    Only supports use as a context manager. Both observations are made after
+    the lock is released, so timing never lengthens the critical section.
+    """
+
+    __slots__ = ('_lock', '_wait', '_hold', '_acquired', '_waited')
+
+    def __init__(self, wait_histogram, hold_histogram):
+        self._lock = threading.Lock()
+        self._wait = wait_histogram
+        self._hold = hold_histogram
+        self._acquired = 0.0
+        self._waited = 0.0
+
+    def __enter__(self):
+        start = time.perf_counter()
+        self._lock.acquire()
+        self._acquired = time.perf_counter()
+        self._waited = self._acquired - start  # only the holder writes these
+
+    def __exit__(self, *exc):
+        held = time.perf_counter() - self._acquired
+        waited = self._waited
+        self._lock.release()
+        self._wait.observe(waited)
+        self._hold.observe(held)
+
+
+class ChatMetrics:
+    """The chat server's metrics; hot paths update the attributes directly"""
+
+    def __init__(self, chat_server, registry=None):
+        self.registry = registry or Registry()
+        self.chat_server = chat_server
+        r = self.registry
+
+        self.messages_received = r.counter(
+            'chat_messages_received_total', 'Text messages received from clients')
+        self.messages_published = r.counter(
+            'chat_messages_published_total', 'Broadcasts delivered into rooms on this server')
+        self.messages_delivered = r.counter(
+            'chat_messages_delivered_total', 'Messages queued for clients (one per recipient)')
+        self.messages_rate_limited = r.counter(
+            'chat_messages_rate_limited_total', 'Text messages over a rate limit, dropped or held back')
+        self.fanout_seconds = r.histogram(
+            'chat_fanout_seconds', 'Time to record a broadcast and queue it for every recipient')
+        self.room_lock_wait = r.histogram(
+            'chat_room_lock_wait_seconds', 'Time spent waiting for a room lock')
+        self.room_lock_hold = r.histogram(
+            'chat_room_lock_hold_seconds', 'Time a room lock was held')
+        self.search_seconds = r.histogram(
+            'chat_search_seconds', 'Time to look up a SearchMessages query, including indexing a room on first use')
+
+        r.collected('chat_connected_clients', 'gauge', 'Connected sessions (streams)', self.collect_clients)
+        r.collected('chat_connected_users', 'gauge', 'Users with at least one connected session',
+                    self.collect_users)
+        r.collected('chat_room_members', 'gauge', 'Users per room', self.collect_room_members)
+        r.collected('chat_client_queue_depth', 'histogram',
+                    'Outbound queue depth of connected clients, sampled at scrape time', self.collect_queue_depths)
+        r.collected('chat_client_queue_depth_max', 'gauge',
+                    'Deepest outbound queue of any connected client', self.collect_max_queue_depth)
+        r.collected('chat_connected_client_dropped_messages', 'gauge',
+                    'Messages dropped by the outbound queues of connected clients', self.collect_dropped)
+        r.collected('chat_history_messages', 'gauge', 'Messages retained per room by the history store',
+                    lambda: self.collect_history(0))
+        r.collected('chat_history_bytes', 'gauge', 'Bytes retained per room by the history store',
+                    lambda: self.collect_history(1))
+
+    def room_lock(self):
+        """A lock for a new room, timed into the room lock histograms"""
+        return TimedLock(self.room_lock_wait, self.room_lock_hold)
+
+    def collect_clients(self):
+        return [('chat_connected_clients', None, len(self.chat_server.clients))]
+
+    def collect_users(self):
+        return [('chat_connected_users', None, self.chat_server.clients.user_count())]
+
+    def collect_room_members(self):
+        rooms = list(self.chat_server.rooms.values())
+        return [('chat_room_members', {'room': room.room_id}, len(room.user_sessions)) for room in rooms]
+
+    def queue_depths(self):
+        return [info['queue'].qsize() for _, info in self.chat_server.clients.snapshot()]
+
+    def collect_queue_depths(self):
+        counts = [0] * (len(QUEUE_DEPTH_BUCKETS) + 1)
+        depths = self.queue_depths()
+        for depth in depths:
+            counts[bisect.bisect_left(QUEUE_DEPTH_BUCKETS, depth)] += 1
+        return histogram_samples('chat_client_queue_depth', QUEUE_DEPTH_BUCKETS, counts, sum(depths))
+
+    def collect_max_queue_depth(self):
+        return [('chat_client_queue_depth_max', None, max(self.queue_depths(), default=0))]
+
+    def collect_dropped(self):
+        dropped = sum(info['queue'].dropped for _, info in self.chat_server.clients.snapshot())
+        return [('chat_connected_client_dropped_messages', None, dropped)]
+
+    def collect_history(self, field):
+        name = ('chat_history_messages', 'chat_history_bytes')[field]
+        stats = self.chat_server.history_store.stats()
+        return [(name, {'room': room_id}, sizes[field]) for room_id, sizes in stats.items()]
+
+
+def serve_metrics(registry, port, host=''):
+    """Serve GET /metrics from a daemon thread; returns the HTTP server"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # scrapes are too frequent to log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
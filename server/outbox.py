@@ -0,0 +1,194 @@
+import asyncio
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import chat_pb2
+
+OVERFLOW_POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+
+class Outbox:
+    """Bounded outbound queue of encoded frames for one client.
+
+    Broadcasters never block on it. When a slow reader lets it fill up, the
+    overflow policy decides what happens to the next frame:
+
+    - drop_oldest: discard the oldest queued frame
+    - coalesce: discard the oldest frame and tell the client how many it missed
+      with a single SYSTEM notice once it catches up
+    - disconnect: discard everything and end the client's stream
+
+    put_nowait(None) closes the outbox; get() returns None once it is closed and
+    drained. A sender blocked on gRPC flow control never gets back to get(), so
+    on_overflow lets the disconnect policy cancel the stream directly.
+    """
+
+    def __init__(self, room_id, maxsize=1000, policy='drop_oldest'):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.room_id = room_id
+        self.maxsize = maxsize  # 0 means unbounded
+        self.policy = policy
+        self.dropped = 0  # frames discarded over the client's lifetime
+        self.skipped = 0  # discarded frames not yet reported to the client
+        self.overflowed = False  # the disconnect policy tripped
+        self.closed = False
+        self.on_overflow = None  # called once when the disconnect policy trips
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def put_nowait(self, frame):
+        if frame is None:
+            self.close()
+            return
+
+        on_overflow = None
+        with self._cond:
+            if self.closed:
+                return
+            if self.maxsize and len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'disconnect':
+                    self.overflowed = True
+                    self.closed = True
+                    self._items.clear()
+                    on_overflow, self.on_overflow = self.on_overflow, None
+                else:
+                    self._items.popleft()
+                    if self.policy == 'coalesce':
+                        self.skipped += 1
+            if not self.overflowed:
+                self._items.append(frame)
+            self._wakeup()
+
+        # Outside the lock: cancelling the stream runs cleanup, which closes us again
+        if on_overflow is not None:
+            on_overflow()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._wakeup()
+
+    def get(self, timeout=None):
+        """Block until a frame is available; raises queue.Empty on timeout"""
+        with self._cond:
+            if not self._cond.wait_for(self._ready, timeout):
+                raise queue.Empty
+            return self._take()
+
+    def get_batch(self, max_items=64, max_delay=0.005, timeout=None):
+        """Block until a frame is available, then gather up to max_items frames.
+
+        Waits at most max_delay after the first frame for the batch to fill.
+        Returns a list of frames, or None at end of stream; raises queue.Empty
+        if nothing arrives within timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(self._ready, timeout):
+                raise queue.Empty
+            batch = []
+            deadline = time.monotonic() + max_delay
+            while True:
+                self._take_into(batch, max_items)
+                if len(batch) >= max_items or self.closed:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return batch or None
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+    def _ready(self):
+        return self._items or self.closed
+
+    def _take_into(self, batch, max_items):
+        """Move queued frames into batch, up to max_items; caller holds the lock"""
+        while len(batch) < max_items and (self._items or self.skipped):
+            batch.append(self._take())
+
+    def _take(self):
+        """Next frame to send, or None at end of stream; caller holds the lock"""
+        if self.skipped:
+            skipped, self.skipped = self.skipped, 0
+            return self._skipped_notice(skipped)
+        if self._items:
+            return self._items.popleft()
+        return None
+
+    def _wakeup(self):
+        self._cond.notify()
+
+    def _skipped_notice(self, skipped):
+        return chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message=f"{skipped} messages skipped (connection too slow)",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.SYSTEM,
+            room_id=self.room_id
+        ).SerializeToString()
+
+
+class AsyncOutbox(Outbox):
+    """Outbox for the asyncio engine; get() is awaitable and must run on the event loop.
+
+    Create it on the loop. put_nowait() may be called from other threads too.
+    """
+
+    def __init__(self, room_id, maxsize=1000, policy='drop_oldest'):
+        super().__init__(room_id, maxsize, policy)
+        self._event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+
+    def _wakeup(self):
+        if threading.get_ident() == self._loop_thread:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def get(self):
+        while True:
+            with self._cond:
+                if self._ready():
+                    return self._take()
+                self._event.clear()
+            await self._event.wait()
+
+    async def get_batch(self, max_items=64, max_delay=0.005):
+        """Await a frame, then gather up to max_items frames for at most max_delay.
+
+        Returns a list of frames, or None at end of stream.
+        """
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        while True:
+            with self._cond:
+                self._take_into(batch, max_items)
+                if len(batch) >= max_items or self.closed:
+                    return batch or None
+                self._event.clear()
+            if not batch:
+                await self._event.wait()
+                continue
+            if deadline is None:
+                deadline = loop.time() + max_delay
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return batch
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return batch
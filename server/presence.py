@@ -0,0 +1,97 @@
+"""Join and leave announcements, coalesced into one digest per room per interval.
+
+Announcing every join to everyone in the room costs O(N) messages per join, so
+a storm of N joins costs O(N²) and floods every member's outbound queue. With an
+interval, a room's joins and leaves are collected and announced together
+("12 users joined the room: ..."). A user who joins and leaves within one
+interval is not announced at all.
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+DIGEST_NAMES = 5  # usernames listed in a digest; the rest are counted
+
+
+def describe(usernames, verb):
+    """Digest text, e.g. "alice joined the room" or "12 users joined the room: alice, bob, ... and 7 more" """
+    if len(usernames) == 1:
+        return f"{usernames[0]} {verb} the room"
+    names = ", ".join(usernames[:DIGEST_NAMES])
+    more = f" and {len(usernames) - DIGEST_NAMES} more" if len(usernames) > DIGEST_NAMES else ""
+    return f"{len(usernames)} users {verb} the room: {names}{more}"
+
+
+class PresenceDigest:
+    """Coalesces a server's join and leave announcements.
+
+    announce(room_id, joined, usernames, exclude_user) is called with a digest
+    (joined is True for joins, False for leaves), from a background thread once
+    per interval; exclude_user is set when the digest is about a single user,
+    who is not told about their own join. With interval 0 each join and leave
+    is announced at once, on the caller's thread.
+    """
+
+    def __init__(self, announce, interval=1.0):
+        self.announce = announce
+        self.interval = interval
+        self._pending = {}  # room_id -> {user_id: [username, present before, present now]}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def joined(self, room_id, user_id, username):
+        """A user's first session joined the room"""
+        self._record(room_id, user_id, username, True)
+
+    def left(self, room_id, user_id, username):
+        """A user's last session left the room"""
+        self._record(room_id, user_id, username, False)
+
+    def _record(self, room_id, user_id, username, present):
+        if not self.interval:
+            self.announce(room_id, present, [username], user_id if present else None)
+            return
+        with self._lock:
+            users = self._pending.setdefault(room_id, {})
+            state = users.get(user_id)
+            if state is None:
+                users[user_id] = [username, not present, present]
+            else:
+                state[2] = present
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="presence-digest", daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._wakeup.wait()
+            # Let the interval's joins and leaves pile up, then announce them together
+            self._closed.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Announce everything pending now"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for room_id, users in pending.items():
+            joined = [(user_id, state[0]) for user_id, state in users.items() if state[2] and not state[1]]
+            left = [state[0] for state in users.values() if state[1] and not state[2]]
+            try:
+                if joined:
+                    exclude_user = joined[0][0] if len(joined) == 1 else None
+                    self.announce(room_id, True, [username for _, username in joined], exclude_user)
+                if left:
+                    self.announce(room_id, False, left, None)
+            except Exception as e:
+                logger.error(f"Error announcing presence in room '{room_id}': {e}")
+
+    def close(self):
+        """Announce what is pending and stop the background thread"""
+        self._closed.set()
+        self._wakeup.set()
+        self.flush()
@@ -0,0 +1,85 @@
+"""Token-bucket rate limits on what clients post, per user and per room.
+
+Every text message costs a token from its sender's bucket and one from its
+room's bucket. Buckets refill at `rate` tokens per second, up to `burst`. Over
+the limit, a message is either dropped (reject) or held back until it fits
+(delay); holding back a message stops the stream being read, so gRPC flow
+control pushes back on the client.
+
+Buckets are kept the GCRA way: instead of a token count and a refill time, a
+key only stores the time its bucket will be full again (its "theoretical
+arrival time"). A message fits if that is at most burst - 1 intervals away,
+and moves it one interval on. Same behaviour, a single float per key in a
+plain dict, and a check is a couple of dict operations with no lock.
+Concurrent senders may race on a key, or write to a table while it is being
+swept; either race can only let a message through, never hold one back
+wrongly. Sweeps, which drop keys whose buckets are full again, run one at a
+time under a lock and work from a copy of the table.
+"""
+import threading
+import time
+
+RATE_LIMIT_POLICIES = ('reject', 'delay')
+SWEEP_MIN = 1024  # keys kept before those with full buckets are swept out
+
+
+class RateLimiter:
+    """Per-user and per-room token buckets; a rate of 0 turns that limit off"""
+
+    def __init__(self, user_rate=0, user_burst=10, room_rate=0, room_burst=100, policy='reject', max_delay=5.0):
+        if policy not in RATE_LIMIT_POLICIES:
+            raise ValueError(f"Unknown rate limit policy: {policy}")
+        self.user_interval = 1 / user_rate if user_rate > 0 else 0  # seconds per token
+        self.user_window = (max(user_burst, 1) - 1) * self.user_interval  # how far ahead a full burst runs
+        self.room_interval = 1 / room_rate if room_rate > 0 else 0
+        self.room_window = (max(room_burst, 1) - 1) * self.room_interval
+        self.reject = policy == 'reject'
+        self.max_delay = max_delay  # delay: a message that would wait longer is dropped instead
+        self.enabled = bool(self.user_interval or self.room_interval)
+        self._users = {}  # user_id -> time the user's bucket is full again
+        self._rooms = {}  # room_id -> time the room's bucket is full again
+        self._sweep_users = self._sweep_rooms = SWEEP_MIN
+        self._sweep_lock = threading.Lock()
+
+    def check(self, user_id, room_id):
+        """Admit one message: seconds to hold it back (0 = post now), or None to drop it"""
+        now = time.monotonic()
+        wait = 0.0
+        user_interval = self.user_interval
+        room_interval = self.room_interval
+        if user_interval:
+            user_full = self._users.get(user_id, now)
+            if user_full < now:
+                user_full = now
+            if user_full - now > self.user_window:
+                wait = user_full - now - self.user_window
+        if room_interval:
+            room_full = self._rooms.get(room_id, now)
+            if room_full < now:
+                room_full = now
+            if room_full - now - self.room_window > wait:
+                wait = room_full - now - self.room_window
+
+        if wait and (self.reject or wait > self.max_delay):
+            return None
+        # A held-back message still spends its token, so the next one waits longer
+        if user_interval:
+            self._users[user_id] = user_full + user_interval
+            if len(self._users) > self._sweep_users:
+                with self._sweep_lock:
+                    if len(self._users) > self._sweep_users:
+                        self._users, self._sweep_users = self._swept(self._users, now)
+        if room_interval:
+            self._rooms[room_id] = room_full + room_interval
+            if len(self._rooms) > self._sweep_rooms:
+                with self._sweep_lock:
+                    if len(self._rooms) > self._sweep_rooms:
+                        self._rooms, self._sweep_rooms = self._swept(self._rooms, now)
+        return wait
+
+    @staticmethod
+    def _swept(table, now):
+        """A full bucket is the same as none: keep only the keys that posted recently"""
+        # list() copies the items in one step, so other threads' inserts can't break the loop
+        table = {key: full for key, full in list(table.items()) if full > now}
+        return table, max(SWEEP_MIN, 2 * len(table))
@@ -0,0 +1,229 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from itertools import islice
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import chat_pb2
+from wire import with_seq
+
+logger = logging.getLogger(__name__)
+
+
+class Room:
+    """State for one chat room: members and recent history, guarded by the room's own lock
+
+    history is a hot in-memory tail of the room's history store; it is primed from
+    the store when the room is created, so replays on join never touch the store.
+    Every recorded message gets the next per-room seq, which is its store offset + 1.
+    Members are sessions (streams); a user with several sessions in the room is
+    still one user for join and leave announcements.
+    """
+
+    def __init__(self, room_id, history_size=50, store=None, lock=None, index=None):
+        self.room_id = room_id
+        self.members = {}  # session_id -> client_info
+        self.user_sessions = {}  # user_id -> number of that user's sessions in the room
+        self.subscribers = ()  # (user_id, queue, client_info) per member, what publish fans out to
+        self._subscribers_stale = False
+        self.history = deque(maxlen=history_size)  # recent messages, encoded
+        self._snapshot = None  # (tuple of history, last_seq), shared by joiners until the next message
+        self.store = store
+        self.index = index  # a search_index.SearchIndex over the store, fed every recorded message
+        self.last_seq = 0
+        self.lock = lock or threading.Lock()  # e.g. a metrics.TimedLock
+        if store is not None:
+            self.history.extend(store.tail(room_id, history_size))
+            self.last_seq = store.next_offset(room_id)
+
+    def add_member(self, client_info, since_seq=None):
+        """Add a session. With since_seq, first queue anything recorded after that seq
+        so the session's history replay joins up with live traffic.
+
+        Returns True if this is the user's first session in the room.
+        """
+        with self.lock:
+            if since_seq is not None and since_seq < self.last_seq:
+                self._catch_up(client_info['queue'], since_seq)
+            self.members[client_info['session_id']] = client_info
+            self._subscribers_stale = True
+            user_id = client_info['user_id']
+            count = self.user_sessions.get(user_id, 0)
+            self.user_sessions[user_id] = count + 1
+            return count == 0
+
+    def _catch_up(self, client_queue, since_seq):
+        """Queue the messages recorded after since_seq; caller holds the lock
+
+        The hot tail usually covers them. Older ones (the replay was read a
+        while ago, e.g. off the event loop) are read back from the store, and a
+        SYSTEM notice stands in for any the store no longer has.
+        """
+        missed = self.last_seq - since_seq
+        in_memory = min(missed, len(self.history))
+        if missed > in_memory:
+            tail_offset = self.last_seq - in_memory  # store offset of the hot tail's first message
+            records = self.store.read(self.room_id, since_seq, missed - in_memory) if self.store else []
+            frames = [frame for offset, frame in records if offset < tail_offset]
+            lost = missed - in_memory - len(frames)
+            if lost:
+                logger.warning(f"Room '{self.room_id}': {lost} messages gone before a joiner caught up")
+                client_queue.put_nowait(self._gap_notice(lost))
+            for frame in frames:
+                client_queue.put_nowait(frame)
+        for frame in islice(self.history, len(self.history) - in_memory, None):
+            client_queue.put_nowait(frame)
+
+    def _gap_notice(self, lost):
+        return chat_pb2.ChatMessage(
+            user_id="SYSTEM",
+            username="System",
+            message=f"{lost} messages in {self.room_id} are no longer available",
+            timestamp=int(time.time() * 1000),
+            type=chat_pb2.MessageType.SYSTEM,
+            room_id=self.room_id
+        ).SerializeToString()
+
+    def remove_member(self, client_info):
+        """Remove a session; returns True if it was the user's last session in the room"""
+        with self.lock:
+            if self.members.pop(client_info['session_id'], None) is None:
+                return False
+            self._subscribers_stale = True
+            user_id = client_info['user_id']
+            count = self.user_sessions.pop(user_id) - 1
+            if count:
+                self.user_sessions[user_id] = count
+            return not count
+
+    def usernames(self):
+        with self.lock:
+            return [info['username'] for info in self.members.values()]
+
+    def is_empty(self):
+        with self.lock:
+            return not self.members
+
+    def publish(self, frame, timestamp, seq=None):
+        """Sequence and record an encoded message, and return it with the room's subscribers.
+
+        All of it happens under the room lock, so seq order, history order (in
+        memory and in the store) and delivery order agree; the caller enqueues
+        the returned frame outside the lock. seq is the room's next seq unless
+        given, as the hub does for rooms shared by several servers.
+        """
+        with self.lock:
+            if seq is not None and seq != self.last_seq + 1:
+                self.resequence(seq)
+            self.last_seq += 1
+            frame = with_seq(frame, self.last_seq)
+            self.history.append(frame)
+            self._snapshot = None
+            if self.store is not None:
+                self.store.append(self.room_id, frame, timestamp)
+                if self.index is not None:
+                    self.index.add(self.room_id, self.last_seq - 1, frame)
+            if self._subscribers_stale:
+                # Joins and leaves only mark the tuple stale, so they stay O(1); it is
+                # rebuilt once per publish after a change, not per recipient
+                self.subscribers = tuple(
+                    (info['user_id'], info['queue'], info) for info in self.members.values())
+                self._subscribers_stale = False
+            return frame, self.subscribers
+
+    def resequence(self, seq):
+        """Handle a seq from the hub that does not follow on from this room's; caller holds the lock
+
+        Ahead: this server missed messages (it started late, or lost the hub for
+        a while). Offsets are seq - 1 in every store, so the room's earlier
+        history is dropped here and the room carries on from the hub's seq.
+        Behind: the hub restarted and heard from a server further behind first;
+        the room keeps its own numbering.
+        """
+        if seq <= self.last_seq:
+            logger.warning(f"Room '{self.room_id}': hub seq {seq} is behind this server's {self.last_seq}")
+            return
+        logger.warning(f"Room '{self.room_id}': missed messages {self.last_seq + 1} to {seq - 1}; "
+                       f"dropping its earlier history here")
+        self.history.clear()
+        if self.store is not None:
+            self.store.skip_to(self.room_id, seq - 1)
+        self.last_seq = seq - 1
+
+    def history_snapshot(self):
+        """The hot tail as a tuple, and the seq of its last message
+
+        Built once per change to the history and shared by every joiner until
+        the next message, so a join storm copies the tail once, not per join.
+        A snapshot read while a message is being recorded is merely one message
+        behind; add_member catches the session up from its seq.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._snapshot = (tuple(self.history), self.last_seq)
+        return snapshot
+
+
+class ClientRegistry:
+    """Connected sessions (one per stream) by session_id, indexed by user_id too.
+
+    A user may have several sessions at once, e.g. on two devices. Guarded by a
+    lock separate from any room.
+    """
+
+    def __init__(self):
+        self._sessions = {}  # session_id -> client_info
+        self._by_user = {}  # user_id -> {session_id: client_info}
+        self._lock = threading.Lock()
+
+    def register(self, client_info):
+        with self._lock:
+            session_id = client_info['session_id']
+            self._sessions[session_id] = client_info
+            self._by_user.setdefault(client_info['user_id'], {})[session_id] = client_info
+
+    def unregister(self, client_info):
+        """Remove a session; returns False if it was not registered"""
+        with self._lock:
+            session_id = client_info['session_id']
+            if self._sessions.pop(session_id, None) is None:
+                return False
+            user_id = client_info['user_id']
+            sessions = self._by_user[user_id]
+            del sessions[session_id]
+            if not sessions:
+                del self._by_user[user_id]
+            return True
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def sessions(self, user_id):
+        """The user's connected sessions"""
+        with self._lock:
+            return list(self._by_user.get(user_id, {}).values())
+
+    def snapshot(self):
+        """List of (session_id, client_info) pairs"""
+        with self._lock:
+            return list(self._sessions.items())
+
+    def user_count(self):
+        with self._lock:
+            return len(self._by_user)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._by_user
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
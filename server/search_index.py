@@ -0,0 +1,244 @@
+"""Inverted index over room history for SearchMessages.
+
+Each room's index maps tokens to the sorted offsets of the TEXT messages that
+contain them (postings), plus a sorted vocabulary for prefix terms. A room is
+indexed from its history store the first time it is searched; after that the
+room feeds it every recorded message, in offset order, under the room's lock.
+Queries walk the postings of their terms and never look at message bodies.
+
+The room feeds the index while holding its own lock, so the index's lock is
+never held for a whole build: a catch-up indexes the store into a separate
+part without it, meanwhile the room's messages are skipped, and only merging
+the part and indexing the last few messages happen under the lock.
+"""
+import bisect
+import logging
+import os
+import re
+import sys
+import threading
+from array import array
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import chat_pb2
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKEN_LENGTH = 40  # longer "words" (hashes, URLs) are not indexed
+MAX_QUERY_TERMS = 8
+MAX_PREFIX_EXPANSIONS = 64  # like Elasticsearch's max_expansions: a prefix matches its first 64 tokens
+MIN_PREFIX_LENGTH = 2
+CATCH_UP_CHUNK = 1000  # messages read from the store at a time when building an index
+PRUNE_EVERY = 10000  # drop postings of messages the store no longer retains after this many
+
+
+def tokenize(text):
+    """Lowercased word tokens of a message, each once"""
+    return {token for token in TOKEN_RE.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH}
+
+
+def parse_query(query):
+    """(term, is_prefix) pairs; a trailing * makes a term a prefix"""
+    terms = []
+    for word in query.lower().split():
+        tokens = TOKEN_RE.findall(word)
+        terms.extend((token, False) for token in tokens)
+        if tokens and word.endswith('*') and len(tokens[-1]) >= MIN_PREFIX_LENGTH:
+            terms[-1] = (tokens[-1], True)
+    return terms[:MAX_QUERY_TERMS]
+
+
+def last_at_or_before(arrays, offset):
+    """Largest offset <= offset in any of the sorted arrays, or -1"""
+    best = -1
+    for postings in arrays:
+        i = bisect.bisect_right(postings, offset)
+        if i and postings[i - 1] > best:
+            best = postings[i - 1]
+    return best
+
+
+class _RoomIndex:
+    __slots__ = ('postings', 'vocabulary', 'next_offset', 'pruned_below', 'lock', 'build_lock')
+
+    def __init__(self, next_offset=0):
+        self.postings = {}  # token -> array('q') of offsets, ascending
+        self.vocabulary = []  # every token, sorted, for prefix terms
+        self.next_offset = next_offset  # offsets below this have been indexed
+        self.pruned_below = next_offset
+        self.lock = threading.Lock()  # taken by searches and by the room's live adds
+        self.build_lock = threading.Lock()  # one catch-up at a time
+
+    def add(self, offset, frame):
+        """Index one recorded message; caller holds the lock"""
+        message = chat_pb2.ChatMessage.FromString(frame)
+        if message.type == chat_pb2.MessageType.TEXT:
+            for token in tokenize(message.message):
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = array('q')
+                    bisect.insort(self.vocabulary, token)
+                postings.append(offset)
+        self.next_offset = offset + 1
+
+    def merge(self, part):
+        """Take over a part indexed from offset part.pruned_below on; caller holds the lock
+
+        Messages the room added live meanwhile are already here and are skipped in the part.
+        """
+        if self.next_offset == part.pruned_below and not self.postings:
+            # A first build: nothing to merge with
+            self.postings, self.vocabulary = part.postings, part.vocabulary
+        else:
+            new_tokens = []
+            for token, offsets in part.postings.items():
+                cut = bisect.bisect_left(offsets, self.next_offset)
+                if cut == len(offsets):
+                    continue
+                if cut:
+                    del offsets[:cut]
+                postings = self.postings.get(token)
+                if postings is None:
+                    self.postings[token] = offsets
+                    new_tokens.append(token)
+                else:
+                    postings.extend(offsets)
+            if new_tokens:
+                self.vocabulary = sorted(self.vocabulary + new_tokens)
+        self.next_offset = max(self.next_offset, part.next_offset)
+
+    def term_arrays(self, term, prefix):
+        """Postings arrays matching one query term"""
+        if not prefix:
+            postings = self.postings.get(term)
+            return [postings] if postings else []
+        arrays = []
+        i = bisect.bisect_left(self.vocabulary, term)
+        while i < len(self.vocabulary) and len(arrays) < MAX_PREFIX_EXPANSIONS:
+            token = self.vocabulary[i]
+            if not token.startswith(term):
+                break
+            arrays.append(self.postings[token])
+            i += 1
+        return arrays
+
+    def search(self, terms, before, floor, limit):
+        """Offsets in [floor, before) of messages matching every term, newest first"""
+        term_arrays = [self.term_arrays(term, prefix) for term, prefix in terms]
+        if not term_arrays or not all(term_arrays):
+            return []
+        # The rarest term proposes candidates; the others confirm them or skip past them
+        term_arrays.sort(key=lambda arrays: sum(len(postings) for postings in arrays))
+        driver, others = term_arrays[0], term_arrays[1:]
+
+        results = []
+        candidate = before - 1
+        while len(results) < limit:
+            candidate = last_at_or_before(driver, candidate)
+            if candidate < floor:
+                break
+            for arrays in others:
+                found = last_at_or_before(arrays, candidate)
+                if found != candidate:
+                    candidate = found
+                    break
+            else:
+                results.append(candidate)
+                candidate -= 1
+        return results
+
+    def prune(self, floor):
+        """Forget offsets below floor; caller holds the lock"""
+        for token, postings in list(self.postings.items()):
+            cut = bisect.bisect_left(postings, floor)
+            if cut == len(postings):
+                del self.postings[token]
+            elif cut:
+                del postings[:cut]
+        if len(self.vocabulary) != len(self.postings):
+            self.vocabulary = [token for token in self.vocabulary if token in self.postings]
+        self.pruned_below = floor
+
+
+class SearchIndex:
+    """Per-room inverted indexes over a history store"""
+
+    def __init__(self, store):
+        self.store = store
+        self._rooms = {}  # room_id -> _RoomIndex, for rooms searched since startup
+        self._lock = threading.Lock()
+
+    def add(self, room_id, offset, frame):
+        """Index a message just recorded at offset; rooms never searched are skipped"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            return
+        with room.lock:
+            # Below next_offset: already read from the store by a catch-up. Above it:
+            # a catch-up is running and will read it from the store
+            if offset == room.next_offset:
+                room.add(offset, frame)
+
+    def _index_range(self, room, room_id, start, end):
+        """Index the store's messages in [start, end) into room, a _RoomIndex"""
+        start = max(start, self.store.first_offset(room_id))
+        while start < end:
+            records = self.store.read(room_id, start, min(CATCH_UP_CHUNK, end - start))
+            if not records:
+                break
+            for offset, frame in records:
+                room.add(offset, frame)
+            start = room.next_offset
+
+    def _room(self, room_id):
+        """The room's index, brought up to date with the store"""
+        room = self._rooms.get(room_id)
+        if room is None:
+            with self._lock:
+                room = self._rooms.get(room_id)
+                if room is None:
+                    room = self._rooms[room_id] = _RoomIndex(self.store.first_offset(room_id))
+        with room.build_lock:
+            while True:
+                with room.lock:
+                    start = room.next_offset
+                    end = self.store.next_offset(room_id)
+                    if end - start <= CATCH_UP_CHUNK:
+                        self._index_range(room, room_id, start, end)
+                        return room
+                # Too far behind to index under the lock the room's publishes wait on
+                logger.info(f"Indexing {end - start} messages of room '{room_id}' for search")
+                part = _RoomIndex(start)
+                self._index_range(part, room_id, start, end)
+                with room.lock:
+                    room.merge(part)
+                if part.next_offset == start:
+                    return room  # the store had nothing to read
+
+    def search(self, room_id, query, before=None, limit=20):
+        """Offsets of the newest limit messages before offset `before` matching the query, newest first
+
+        Terms are ANDed; "term*" matches tokens starting with term.
+        """
+        terms = parse_query(query)
+        if not terms or not self.store.next_offset(room_id):
+            return []
+        room = self._room(room_id)
+        floor = self.store.first_offset(room_id)
+        with room.lock:
+            if floor - room.pruned_below >= PRUNE_EVERY:
+                room.prune(floor)
+            end = room.next_offset if before is None else min(before, room.next_offset)
+            return room.search(terms, end, floor, limit)
+
+    def stats(self):
+        """room_id -> (tokens, postings) for rooms indexed so far"""
+        with self._lock:
+            rooms = list(self._rooms.items())
+        stats = {}
+        for room_id, room in rooms:
+            with room.lock:
+                stats[room_id] = (len(room.postings), sum(len(postings) for postings in room.postings.values()))
+        return stats
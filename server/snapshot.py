@@ -0,0 +1,124 @@
+"""Snapshots of an in-memory history store, so a restart keeps room history.
+
+The memory and compact history stores live in process memory: a restart used
+to lose every room's history, and with it the per-room seqs that reconnecting
+clients resume from. A drained server writes its store to a snapshot file on
+the way out, and the next process loads it before it starts listening.
+
+A snapshot is a short header followed by whatever the store's dump() writes:
+counts, strings and the stores' own arrays and byte buffers, each prefixed
+with its length. Arrays are written in machine byte order, so the compact
+store loads a room with a few memcpys instead of a parse per message. The
+log store is durable already and has no dump().
+"""
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'CHATSNAP'
+VERSION = 1
+INT = struct.Struct('<q')  # counts and lengths
+
+
+class SnapshotWriter:
+    """Length-prefixed values written to a binary file"""
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0  # bytes written
+
+    def int(self, value):
+        self.f.write(INT.pack(value))
+        self.size += INT.size
+
+    def bytes(self, data):
+        data = memoryview(data).cast('B')
+        self.int(len(data))
+        self.f.write(data)
+        self.size += len(data)
+
+    def string(self, value):
+        self.bytes(value.encode())
+
+    def array(self, values):
+        """An array.array; read back with SnapshotReader.array and the same typecode"""
+        self.bytes(values)
+
+
+class SnapshotReader:
+    """Reads back what a SnapshotWriter wrote, from the whole file in memory"""
+
+    def __init__(self, data):
+        self.data = data
+        self.view = memoryview(data)
+        self.pos = 0
+
+    def int(self):
+        if self.pos + INT.size > len(self.data):
+            raise ValueError("Snapshot is truncated")
+        value, = INT.unpack_from(self.data, self.pos)
+        self.pos += INT.size
+        return value
+
+    def bytes(self):
+        """A memoryview of the next buffer, without copying"""
+        length = self.int()
+        start = self.pos
+        self.pos += length
+        if self.pos > len(self.data):
+            raise ValueError("Snapshot is truncated")
+        return self.view[start:self.pos]
+
+    def string(self):
+        return str(self.bytes(), 'utf-8')
+
+    def array(self, typecode):
+        values = array(typecode)
+        values.frombytes(self.bytes())
+        return values
+
+
+def write_snapshot(store, path):
+    """Write a history store to path; returns the bytes written, or None if the store has no dump()
+
+    The file is written next to path and renamed over it, so a crash midway
+    leaves the previous snapshot (or none) rather than half of one.
+    """
+    if not hasattr(store, 'dump'):
+        return None
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as f:
+        writer = SnapshotWriter(f)
+        f.write(MAGIC)
+        writer.int(VERSION)
+        writer.string(sys.byteorder)
+        writer.string(store.snapshot_kind)
+        store.dump(writer)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return writer.size + len(MAGIC)
+
+
+def load_snapshot(store, path):
+    """Fill an empty history store from the snapshot at path; returns the number of messages loaded
+
+    Raises ValueError if the file is not a snapshot this store can load.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("Not a history snapshot")
+    reader = SnapshotReader(data)
+    reader.pos = len(MAGIC)
+    version = reader.int()
+    if version != VERSION:
+        raise ValueError(f"Unsupported snapshot version {version}")
+    byteorder = reader.string()
+    if byteorder != sys.byteorder:
+        raise ValueError(f"Snapshot was written on a {byteorder}-endian machine")
+    kind = reader.string()
+    if kind != getattr(store, 'snapshot_kind', None):
+        raise ValueError(f"Snapshot is of a {kind} history store")
+    return store.load(reader)
@@ -0,0 +1,33 @@
+"""Protobuf wire-format helpers for working with already-encoded messages.
+
+Broadcasts are serialized once and then handled as bytes. Adding a field or
+wrapping frames in a repeated field only needs a few bytes of framing, so these
+helpers never decode and re-encode a message.
+"""
+
+WIRETYPE_VARINT = 0
+WIRETYPE_LENGTH_DELIMITED = 2
+
+SEQ_FIELD = 8  # ChatMessage.seq
+
+
+def encode_varint(value):
+    if value <= 0x7f:
+        return bytes((value,))  # most lengths and tags
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_message_list(frames, field_number=1):
+    """Encode already-serialized messages as a repeated message field"""
+    tag = encode_varint(field_number << 3 | WIRETYPE_LENGTH_DELIMITED)
+    return b''.join(tag + encode_varint(len(frame)) + frame for frame in frames)
+
+
+def with_seq(frame, seq):
+    """Set ChatMessage.seq on an encoded message; for scalar fields the last value on the wire wins"""
+    return frame + encode_varint(SEQ_FIELD << 3 | WIRETYPE_VARINT) + encode_varint(seq)
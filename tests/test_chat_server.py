@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import pytest
+
+import chat_pb2
+from chat_server import ChatServer
+from history_store import MemoryHistoryStore
+
+
+def post(server, room_id, count):
+    server.get_room(room_id, create=True)
+    for i in range(count):
+        message = chat_pb2.ChatMessage(user_id='poster', username='poster', message=f'm{i}',
+                                       type=chat_pb2.TEXT, room_id=room_id)
+        server.broadcast_to_room(room_id, message)
+
+
+def join(server, history):
+    client_queue = server.new_client_queue('general')
+    client_info = server.new_session('joiner', 'joiner', client_queue, None)
+    server.join_room(client_info, chat_pb2.ChatMessage(room_id='general', history=history))
+    return client_queue
+
+
+def drain_frames(client_queue):
+    messages = []
+    while client_queue.qsize():
+        messages.append(chat_pb2.ChatMessage.FromString(client_queue.get(timeout=0)))
+    return messages
+
+
+@pytest.mark.parametrize('policy', ['drop_oldest', 'coalesce', 'disconnect'])
+@pytest.mark.parametrize('queue_size, history', [
+    (100, chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.LAST, limit=1000)),
+    (100, chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.SINCE, since_seq=1)),
+    (10, chat_pb2.HistoryPreference()),
+])
+def test_join_replay_fits_the_outbox(policy, queue_size, history):
+    server = ChatServer(queue_size=queue_size, overflow_policy=policy, presence_interval=0)
+    post(server, 'general', 150)
+
+    client_queue = join(server, history)
+    assert not client_queue.overflowed
+    assert client_queue.dropped == 0
+
+    messages = drain_frames(client_queue)
+    assert len(messages) == queue_size
+    assert messages[0].message.startswith('--- Recent messages')
+    assert messages[-1].message == '--- End of history ---'
+    assert [m.seq for m in messages[1:-1]] == list(range(150 - queue_size + 3, 151))
+
+
+def test_unbounded_outbox_replays_up_to_max_replay():
+    server = ChatServer(queue_size=0, presence_interval=0)
+    post(server, 'general', 1100)
+
+    client_queue = join(server, chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.SINCE, since_seq=1))
+    messages = drain_frames(client_queue)
+    assert [m.seq for m in messages[1:-1]] == list(range(101, 1101))
+
+
+def test_join_catches_up_past_the_hot_tail():
+    server = ChatServer(presence_interval=0)
+    post(server, 'general', 100)
+    since = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.SINCE, since_seq=10)
+    replay = server.select_history(server.get_room('general'), since)
+    post(server, 'general', 60)  # more than the 50-message hot tail
+
+    client_queue = server.new_client_queue('general')
+    server.open_session(chat_pb2.ChatMessage(user_id='joiner', username='joiner', room_id='general', history=since),
+                        client_queue, None, replay)
+    messages = drain_frames(client_queue)
+    assert [m.seq for m in messages if m.type == chat_pb2.TEXT] == list(range(11, 161))
+
+
+def test_join_reports_a_gap_the_store_no_longer_has():
+    server = ChatServer(presence_interval=0, history_store=MemoryHistoryStore(max_messages=100))
+    post(server, 'general', 100)
+    since = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.SINCE, since_seq=10)
+    replay = server.select_history(server.get_room('general'), since)
+    post(server, 'general', 150)
+
+    client_queue = server.new_client_queue('general')
+    server.open_session(chat_pb2.ChatMessage(user_id='joiner', username='joiner', room_id='general', history=since),
+                        client_queue, None, replay)
+    messages = drain_frames(client_queue)[-101:]  # after the replay of 11 to 100
+    assert messages[0].message == '50 messages in general are no longer available'
+    assert [m.seq for m in messages[1:]] == list(range(151, 251))
@@ -0,0 +1,82 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import pytest
+
+import chat_pb2
+from history_store import MAX_ROOM_ID_BYTES, CompactHistoryStore, LogHistoryStore
+from snapshot import load_snapshot, write_snapshot
+
+
+@pytest.mark.parametrize('room_id', ['.', '..', '%2E', '../general', 'a/b', 'room.1'])
+def test_log_store_keeps_rooms_inside_its_directory(tmp_path, room_id):
+    directory = tmp_path / 'history'
+    store = LogHistoryStore(str(directory))
+    store.append(room_id, b'frame', 1)
+    store.append('general', b'other', 2)
+
+    assert sorted(os.listdir(tmp_path)) == ['history']
+    assert not any(name.endswith(('.log', '.idx')) for name in os.listdir(directory))
+    assert sorted(store.rooms()) == sorted([room_id, 'general'])
+    assert store.read(room_id, 0, 10) == [(0, b'frame')]
+    store.close()
+
+    reopened = LogHistoryStore(str(directory))
+    assert reopened.read(room_id, 0, 10) == [(0, b'frame')]
+    reopened.close()
+
+
+def test_log_store_refuses_overlong_room_ids(tmp_path):
+    store = LogHistoryStore(str(tmp_path))
+    longest = 'é' * (MAX_ROOM_ID_BYTES // 2)
+    store.append(longest, b'frame', 1)
+    assert store.read(longest, 0, 10) == [(0, b'frame')]
+
+    overlong = 'x' * (MAX_ROOM_ID_BYTES + 1)
+    with pytest.raises(ValueError):
+        store.append(overlong, b'frame', 1)
+    assert store.read(overlong, 0, 10) == []
+    assert store.next_offset(overlong) == 0
+    store.close()
+
+
+def message_frame(user_id, text, seq):
+    return chat_pb2.ChatMessage(user_id=user_id, username=user_id, message=text, timestamp=seq,
+                                type=chat_pb2.TEXT, room_id='general', seq=seq).SerializeToString()
+
+
+def test_compact_store_frees_senders_it_no_longer_keeps(tmp_path):
+    store = CompactHistoryStore(max_messages=100)
+    frames = [message_frame(f'user-{i}', f'm{i}', i + 1) for i in range(10000)]
+    for i, frame in enumerate(frames):
+        store.append('general', frame, i + 1)
+
+    live = [identity for identity in store._identities if identity is not None]
+    assert len(live) <= 125
+    assert len(store._identities) <= 126
+    assert store.read('general', 9990, 10) == list(enumerate(frames[9990:], 9990))
+
+    path = str(tmp_path / 'snapshot')
+    write_snapshot(store, path)
+    reloaded = CompactHistoryStore(max_messages=100)
+    assert load_snapshot(reloaded, path) == len(store.read('general', 0, 1000))
+    assert reloaded.read('general', 0, 1000) == store.read('general', 0, 1000)
+    assert len(reloaded._identity_index) == len(live)
+
+    # Freed slots are reused, and a returning sender is interned again
+    frame = message_frame('user-0', 'back', 10001)
+    reloaded.append('general', frame, 10001)
+    assert reloaded.read('general', 10000, 1) == [(10000, frame)]
+    assert len(reloaded._identities) == len(store._identities)
+
+
+def test_compact_store_skip_to_frees_the_rooms_senders():
+    store = CompactHistoryStore()
+    store.append('general', message_frame('alice', 'hi', 1), 1)
+    store.skip_to('general', 5)
+    assert store._identity_index == {}
+    store.append('general', message_frame('bob', 'hi', 6), 6)
+    assert store.read('general', 0, 10) == [(5, message_frame('bob', 'hi', 6))]
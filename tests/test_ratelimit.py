@@ -0,0 +1,32 @@
+import os
+import sys
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+
+from ratelimit import RateLimiter
+
+
+def test_concurrent_checks_survive_sweeps():
+    limiter = RateLimiter(user_rate=1000, user_burst=1, room_rate=1000, room_burst=1)
+    errors = []
+
+    def sender(worker):
+        try:
+            for i in range(50000):
+                limiter.check(f'user-{worker}-{i}', f'room-{worker}-{i}')
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=sender, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_user_limit():
+    limiter = RateLimiter(user_rate=1, user_burst=3)
+    assert [limiter.check('alice', 'general') for _ in range(4)] == [0, 0, 0, None]
+    assert limiter.check('bob', 'general') == 0
@@ -0,0 +1,95 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import pytest
+
+import chat_pb2
+from chat_server import ChatServer, restore_history, save_history
+from history_store import CompactHistoryStore, LogHistoryStore, MemoryHistoryStore
+from snapshot import load_snapshot, write_snapshot
+
+
+def post(server, room_id, count):
+    server.get_room(room_id, create=True)
+    for i in range(count):
+        message = chat_pb2.ChatMessage(user_id=f'user-{i % 7}', username=f'User {i % 7}', message=f'm{i}',
+                                       timestamp=1000 + i, type=chat_pb2.TEXT, room_id=room_id)
+        server.broadcast_to_room(room_id, message)
+
+
+def test_drain_tells_every_session_when_to_reconnect_then_ends_its_stream():
+    server = ChatServer(presence_interval=0)
+    queues = []
+    for i in range(5):
+        client_queue = server.new_client_queue('general')
+        client_info = server.new_session(f'user-{i}', f'user-{i}', client_queue, None)
+        history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE)
+        server.join_room(client_info, chat_pb2.ChatMessage(room_id='general', history=history))
+        queues.append(client_queue)
+    for client_queue in queues:
+        while client_queue.qsize():
+            client_queue.get(timeout=0)  # join announcements
+
+    server.drain(spread=2.0)
+    assert server.draining
+    for client_queue in queues:
+        notice = chat_pb2.ChatMessage.FromString(client_queue.get(timeout=0))
+        assert notice.type == chat_pb2.SYSTEM
+        assert 0 <= notice.retry_after_ms < 2000
+        assert client_queue.get(timeout=0) is None
+
+
+@pytest.mark.parametrize('store_class', [MemoryHistoryStore, CompactHistoryStore])
+def test_snapshot_round_trip(tmp_path, store_class):
+    store = store_class()
+    server = ChatServer(history_store=store, presence_interval=0)
+    post(server, 'general', 300)
+    post(server, 'random', 20)
+
+    path = str(tmp_path / 'history.snapshot')
+    assert write_snapshot(store, path) > 0
+    reloaded = store_class()
+    assert load_snapshot(reloaded, path) == 320
+    for room_id in ('general', 'random'):
+        assert reloaded.read(room_id, 0, 1000) == store.read(room_id, 0, 1000)
+        assert reloaded.next_offset(room_id) == store.next_offset(room_id)
+        assert reloaded.seek_timestamp(room_id, 1010) == store.seek_timestamp(room_id, 1010)
+
+
+def test_snapshot_refuses_the_wrong_store(tmp_path):
+    path = str(tmp_path / 'history.snapshot')
+    store = MemoryHistoryStore()
+    store.append('general', b'frame', 1)
+    write_snapshot(store, path)
+    with pytest.raises(ValueError):
+        load_snapshot(CompactHistoryStore(), path)
+    with pytest.raises(ValueError):
+        load_snapshot(store, path)  # only into an empty store
+    log_store = LogHistoryStore(str(tmp_path / 'log'))
+    assert write_snapshot(log_store, path) is None  # durable already
+    log_store.close()
+
+
+def test_restarted_server_carries_on_the_room_seqs(tmp_path):
+    path = str(tmp_path / 'history.snapshot')
+    store = CompactHistoryStore()
+    post(ChatServer(history_store=store, presence_interval=0), 'general', 60)
+    save_history(store, path)
+
+    store = CompactHistoryStore()
+    restore_history(store, path)
+    assert not os.path.exists(path)  # loaded once
+    server = ChatServer(history_store=store, presence_interval=0)
+    post(server, 'general', 1)
+
+    client_queue = server.new_client_queue('general')
+    client_info = server.new_session('joiner', 'joiner', client_queue, None)
+    history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.SINCE, since_seq=55)
+    server.join_room(client_info, chat_pb2.ChatMessage(room_id='general', history=history))
+    messages = []
+    while client_queue.qsize():
+        messages.append(chat_pb2.ChatMessage.FromString(client_queue.get(timeout=0)))
+    assert [m.seq for m in messages if m.type == chat_pb2.TEXT] == list(range(56, 62))
@@ -0,0 +1,61 @@
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'server'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'pbs'))
+
+import pytest
+
+import chat_pb2
+from chat_server import ChatServer
+
+QUEUE_SIZE = 50
+MESSAGES = 500
+
+
+def session(server, user_id):
+    client_queue = server.new_client_queue('general')
+    client_info = server.new_session(user_id, user_id, client_queue, None)
+    history = chat_pb2.HistoryPreference(mode=chat_pb2.HistoryMode.NONE)
+    server.join_room(client_info, chat_pb2.ChatMessage(room_id='general', history=history))
+    return client_queue
+
+
+def read_all(client_queue):
+    messages = []
+    while client_queue.qsize():
+        frame = client_queue.get(timeout=0)
+        if frame is None:
+            break
+        messages.append(chat_pb2.ChatMessage.FromString(frame))
+    return messages
+
+
+@pytest.mark.parametrize('policy', ['drop_oldest', 'coalesce', 'disconnect'])
+def test_stalled_client_does_not_hold_up_the_room(policy):
+    server = ChatServer(queue_size=QUEUE_SIZE, overflow_policy=policy, presence_interval=0)
+    readers = [session(server, f'reader-{i}') for i in range(3)]
+    stalled = session(server, 'stalled')
+    received = [[] for _ in readers]
+
+    for i in range(MESSAGES):
+        message = chat_pb2.ChatMessage(user_id='poster', username='poster', message=f'm{i}',
+                                       type=chat_pb2.TEXT, room_id='general')
+        server.broadcast_to_room('general', message)
+        assert stalled.qsize() <= QUEUE_SIZE
+        for client_queue, messages in zip(readers, received):
+            messages.extend(m.message for m in read_all(client_queue) if m.type == chat_pb2.TEXT)
+
+    expected = [f'm{i}' for i in range(MESSAGES)]
+    assert received == [expected] * len(readers)
+    assert all(client_queue.dropped == 0 for client_queue in readers)
+
+    backlog = read_all(stalled)
+    if policy == 'disconnect':
+        assert stalled.overflowed and backlog == []
+    else:
+        assert stalled.dropped == MESSAGES - QUEUE_SIZE
+        text = [m.message for m in backlog if m.type == chat_pb2.TEXT]
+        assert text == expected[-QUEUE_SIZE:]
+        if policy == 'coalesce':
+            assert backlog[0].message == f"{MESSAGES - QUEUE_SIZE} messages skipped (connection too slow)"